@@ -1,25 +1,44 @@
 import os
+import threading
 from dotenv import load_dotenv
 from crewai import Agent, Task, Crew, Process, LLM
-from servicenow_tools import ServiceNowQueryTool, ServiceNowCreateTool, ServiceNowUpdateTool
+from metrics import timed_kickoff
+from agent_tools import ServiceNowQueryTool, ServiceNowCreateTool, ServiceNowUpdateTool, ServiceNowSchemaLookupTool, ServiceNowBulkCreateTool, ServiceNowBulkUpdateTool
 
 load_dotenv()
 
 # --- CONFIGURATION ---
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+# Idle agents kept per instance URL
+AGENT_POOL_SIZE = int(os.getenv("SN_AGENT_POOL_SIZE", "4"))
 
 # --- LLM SETUP ---
-gemini_llm = LLM(
-    model="openai/gemini-flash-latest",
-    api_key=GOOGLE_API_KEY,
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-    temperature=0.7
-)
+_llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    """
+    Builds the shared LLM client on first use.
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = LLM(
+                    model="openai/gemini-flash-latest",
+                    api_key=GOOGLE_API_KEY,
+                    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+                    temperature=0.7
+                )
+    return _llm
 
 def get_agent(instance_url):
     query_tool = ServiceNowQueryTool(instance_url=instance_url)
     create_tool = ServiceNowCreateTool(instance_url=instance_url)
     update_tool = ServiceNowUpdateTool(instance_url=instance_url)
+    schema_tool = ServiceNowSchemaLookupTool(instance_url=instance_url)
+    bulk_create_tool = ServiceNowBulkCreateTool(instance_url=instance_url)
+    bulk_update_tool = ServiceNowBulkUpdateTool(instance_url=instance_url)
 
     return Agent(
         role='ServiceNow System Administrator',
@@ -27,22 +46,65 @@ def get_agent(instance_url):
         backstory="""You are an expert ServiceNow Administrator. 
         You know the internal table names (e.g., 'sys_user', 'incident', 'sys_script_client', 'sys_scope').
         You are careful when creating or updating records.
-        You always verify table names before acting.""",
-        tools=[query_tool, create_tool, update_tool],
-        llm=gemini_llm,
+        You always verify table names before acting, using the Schema Lookup tool rather than trial queries.
+        When a change applies to more than a couple of records, you query their sys_ids once and use the Bulk tools in a single call.""",
+        tools=[schema_tool, query_tool, create_tool, update_tool, bulk_create_tool, bulk_update_tool],
+        llm=get_llm(),
         verbose=True
     )
 
+class AgentPool:
+    """
+    Reusable, initialized agents (with their tools) per instance URL.
+    An agent is acquired by one crew at a time and released afterwards.
+    """
+
+    def __init__(self, max_idle=AGENT_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, instance_url):
+        with self._lock:
+            idle = self._idle.get(instance_url)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+        agent = get_agent(instance_url)
+        with self._lock:
+            self.created += 1
+        return agent
+
+    def release(self, instance_url, agent):
+        with self._lock:
+            idle = self._idle.setdefault(instance_url, [])
+            if len(idle) < self.max_idle:
+                idle.append(agent)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle": {url: len(agents) for url, agents in self._idle.items()},
+                "created": self.created,
+                "reused": self.reused,
+            }
+
+agent_pool = AgentPool()
+
 # --- FUNCTION FOR API ---
-def run_admin_command(user_request, instance_url, history=[]):
-    # Format history for the agent
+def run_admin_command(user_request, instance_url, history=[], summary=""):
+    # Format history for the agent. Older turns arrive pre-compacted in summary.
     history_str = ""
+    if summary:
+        history_str += f"(Summary of earlier turns)\n{summary}\n(Recent turns)\n"
     for msg in history:
         role = msg.get('role', 'user')
         content = msg.get('content', '')
         history_str += f"{role.upper()}: {content}\n"
 
-    agent = get_agent(instance_url)
+    agent = agent_pool.acquire(instance_url)
 
     task_admin = Task(
         description=f"""
@@ -72,11 +134,15 @@ def run_admin_command(user_request, instance_url, history=[]):
         verbose=True
     )
 
-    result = crew.kickoff()
+    try:
+        with timed_kickoff("admin_command"):
+            result = crew.kickoff()
+    finally:
+        agent_pool.release(instance_url, agent)
     return str(result)
 
 def analyze_error_log(error_message, instance_url):
-    agent = get_agent(instance_url)
+    agent = agent_pool.acquire(instance_url)
 
     task_analysis = Task(
         description=f"""
@@ -98,7 +164,11 @@ def analyze_error_log(error_message, instance_url):
         verbose=True
     )
 
-    result = crew.kickoff()
+    try:
+        with timed_kickoff("analyze_error"):
+            result = crew.kickoff()
+    finally:
+        agent_pool.release(instance_url, agent)
     return str(result)
 
 # --- CLI RUNNER ---
@@ -0,0 +1,240 @@
+import json
+from crewai.tools import BaseTool
+from pydantic import Field
+from servicenow_tools import get_client, run_bulk_writes, BULK_MAX_ITEMS
+from schema_index import get_schema_index, ensure_index
+from metrics import log
+from rate_limiter import RateLimited
+from record_format import DEFAULT_FIELDS, format_records
+
+QUERY_TOOL_LIMIT = 10
+
+class ServiceNowQueryTool(BaseTool):
+    name: str = "ServiceNow Table Query"
+    description: str = "Queries any ServiceNow table. Useful for finding records (Users, Incidents, Scripts, etc). Input should be a pipe-separated string: 'table_name|query_string' or 'table_name|query_string|field1,field2' to choose the columns returned. Example: 'sys_user|active=true^nameLIKEAlice|user_name,email'"
+    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+
+    def _run(self, input_str: str) -> str:
+        parts = input_str.split('|', 2)
+        if len(parts) < 2:
+            return "Error: Input must be in format 'table_name|query_string' or 'table_name|query_string|fields'"
+        table, query = parts[0].strip(), parts[1].strip()
+        fields = parts[2].strip() if len(parts) == 3 and parts[2].strip() else DEFAULT_FIELDS.get(table)
+
+        params = {
+            'sysparm_query': query,
+            'sysparm_limit': QUERY_TOOL_LIMIT,
+            'sysparm_display_value': 'true',
+            'sysparm_exclude_reference_link': 'true'
+        }
+        if fields:
+            params['sysparm_fields'] = fields
+        
+        try:
+            response = get_client(self.instance_url).get(f"/api/now/table/{table}", params=params)
+            if response.status_code == 200:
+                results = response.json().get('result', [])
+                total = response.headers.get('X-Total-Count')
+                return format_records(results, fields, int(total) if total else None)
+            else:
+                return f"Error: {response.status_code} - {response.text[:500]}"
+        except RateLimited as e:
+            return f"Error: {str(e)}"
+        except Exception as e:
+            return f"Connection Failed: {str(e)}"
+
+def schema_problems(instance_url, table, data):
+    """
+    Checks a write payload against the local schema index before any network
+    call. Only uses an index that already exists on disk; a failed check on a
+    stale index is retried once after an incremental refresh.
+    """
+    index = get_schema_index(instance_url)
+    if not index.is_loaded():
+        return []
+    problems = index.validate(table, data)
+    if problems and index.is_stale():
+        try:
+            index.refresh()
+            problems = index.validate(table, data)
+        except Exception as e:
+            log("schema_refresh_failed", level="warning", instance=instance_url, error=str(e))
+    return problems
+
+def _schema_error(problems):
+    return "Error: " + "; ".join(problems) + ". Use the ServiceNow Schema Lookup tool to find the right names."
+
+class ServiceNowSchemaLookupTool(BaseTool):
+    name: str = "ServiceNow Schema Lookup"
+    description: str = "Finds table and field names from a local index of the instance schema, without querying ServiceNow. Input 'search term' to find tables (e.g. 'business rule'), or 'table_name|search term' to find fields on a table, including inherited ones (e.g. 'incident|assignment')."
+    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+
+    def _run(self, input_str: str) -> str:
+        table, _, term = input_str.rpartition('|')
+        table = table.strip() or None
+        try:
+            index = ensure_index(self.instance_url)
+        except Exception as e:
+            return f"Schema index unavailable: {str(e)}"
+
+        if table and table not in index.tables:
+            return _schema_error(index.validate(table, {}))
+        matches = index.lookup(term, table=table)
+        if not matches:
+            return f"No {'fields on ' + table if table else 'tables'} matching '{term.strip()}'."
+        header = "field | label | type" if table else "table | label | extends"
+        return "\n".join([header] + [f"{name} | {label} | {detail}" for name, label, detail in matches])
+
+class ServiceNowCreateTool(BaseTool):
+    name: str = "ServiceNow Create Record"
+    description: str = "Creates a new record in any ServiceNow table. Input should be a pipe-separated string: 'table_name|json_data'. Example: 'incident|{\"short_description\": \"Server outage\", \"urgency\": \"1\"}'"
+    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+
+    def _run(self, input_str: str) -> str:
+        try:
+            table, data_str = input_str.split('|', 1)
+            data = json.loads(data_str.strip())
+        except ValueError:
+            return "Error: Input must be in format 'table_name|json_data'"
+        except json.JSONDecodeError:
+            return "Error: Invalid JSON data provided."
+
+        problems = schema_problems(self.instance_url, table.strip(), data)
+        if problems:
+            return _schema_error(problems)
+
+        try:
+            response = get_client(self.instance_url).post(f"/api/now/table/{table.strip()}", json=data)
+            if response.status_code == 201:
+                result = response.json().get('result', {})
+                return f"Success! Record created. SysID: {result.get('sys_id')} \nNumber: {result.get('number')}"
+            else:
+                return f"Error: {response.status_code} - {response.text}"
+        except RateLimited as e:
+            return f"Error: {str(e)}"
+        except Exception as e:
+            return f"Connection Failed: {str(e)}"
+
+class ServiceNowUpdateTool(BaseTool):
+    name: str = "ServiceNow Update Record"
+    description: str = "Updates an existing record. Input should be a pipe-separated string: 'table_name|sys_id|json_data'. Example: 'incident|abc12345|{\"state\": \"2\"}'"
+    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+
+    def _run(self, input_str: str) -> str:
+        try:
+            parts = input_str.split('|', 2)
+            if len(parts) != 3:
+                raise ValueError
+            table, sys_id, data_str = parts
+            data = json.loads(data_str.strip())
+        except ValueError:
+            return "Error: Input must be in format 'table_name|sys_id|json_data'"
+        except json.JSONDecodeError:
+            return "Error: Invalid JSON data provided."
+
+        problems = schema_problems(self.instance_url, table.strip(), data)
+        if problems:
+            return _schema_error(problems)
+
+        try:
+            response = get_client(self.instance_url).put(f"/api/now/table/{table.strip()}/{sys_id.strip()}", json=data)
+            if response.status_code == 200:
+                result = response.json().get('result', {})
+                return f"Success! Record updated. SysID: {result.get('sys_id')}"
+            else:
+                return f"Error: {response.status_code} - {response.text}"
+        except RateLimited as e:
+            return f"Error: {str(e)}"
+        except Exception as e:
+            return f"Connection Failed: {str(e)}"
+
+
+# --- BULK WRITES ---
+def summarize_writes(results, verb, table, keys):
+    """
+    One summary line plus compact tables of failures and, for creates, the new
+    records. keys[i] names item i in failure rows (a sys_id or list position).
+    """
+    failed = [r for r in results if not r["ok"]]
+    lines = [f"{verb} {len(results) - len(failed)} of {len(results)} {table} records."]
+    if failed:
+        rows = [{"item": keys[r["index"]], "status": r["status"] or '', "error": r["error"]} for r in failed]
+        lines.append("Failed:\n" + format_records(rows, "item,status,error"))
+    if verb == "Created":
+        created = [r for r in results if r["ok"]]
+        if created:
+            lines.append(format_records(created, "number,sys_id"))
+    return "\n".join(lines)
+
+def _parse_bulk(input_str, usage):
+    """
+    Splits 'table|...|json' bulk input. Returns (table, middle or None, data) or raises ValueError(usage).
+    """
+    parts = input_str.split('|', 2)
+    if len(parts) < 2:
+        raise ValueError(usage)
+    try:
+        data = json.loads(parts[-1].strip())
+    except ValueError:
+        raise ValueError("Error: Invalid JSON data provided.")
+    return parts[0].strip(), parts[1].strip() if len(parts) == 3 else None, data
+
+class ServiceNowBulkCreateTool(BaseTool):
+    name: str = "ServiceNow Bulk Create Records"
+    description: str = f"Creates many records in one call (up to {BULK_MAX_ITEMS}). Use instead of repeating Create Record. Input should be a pipe-separated string: 'table_name|json_list'. Example: 'incident|[{{\"short_description\": \"Disk full\"}}, {{\"short_description\": \"VPN down\"}}]'"
+    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+
+    def _run(self, input_str: str) -> str:
+        usage = "Error: Input must be in format 'table_name|json_list'"
+        try:
+            table, _, records = _parse_bulk(input_str, usage)
+        except ValueError as e:
+            return str(e)
+        if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+            return usage
+
+        fields = {field: None for record in records for field in record}
+        problems = schema_problems(self.instance_url, table, fields)
+        if problems:
+            return _schema_error(problems)
+
+        try:
+            results = run_bulk_writes(self.instance_url, [("POST", f"/api/now/table/{table}", record) for record in records])
+        except ValueError as e:
+            return f"Error: {str(e)}"
+        return summarize_writes(results, "Created", table, [f"#{i + 1}" for i in range(len(records))])
+
+class ServiceNowBulkUpdateTool(BaseTool):
+    name: str = "ServiceNow Bulk Update Records"
+    description: str = f"Updates many records in one call (up to {BULK_MAX_ITEMS}). Use instead of repeating Update Record. Input 'table_name|sys_id1,sys_id2,...|json_data' applies the same change to every sys_id (e.g. 'incident|abc123,def456|{{\"state\": \"7\"}}'). Input 'table_name|json_list' applies per-record changes, each object including its sys_id (e.g. 'incident|[{{\"sys_id\": \"abc123\", \"priority\": \"2\"}}]')."
+    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+
+    def _run(self, input_str: str) -> str:
+        usage = "Error: Input must be in format 'table_name|sys_id1,sys_id2|json_data' or 'table_name|json_list'"
+        try:
+            table, sys_ids, data = _parse_bulk(input_str, usage)
+        except ValueError as e:
+            return str(e)
+
+        if sys_ids is not None:
+            if not isinstance(data, dict):
+                return usage
+            ids = [sys_id.strip() for sys_id in sys_ids.split(',') if sys_id.strip()]
+            updates = [(sys_id, data) for sys_id in ids]
+        else:
+            if not isinstance(data, list) or not all(isinstance(r, dict) and r.get('sys_id') for r in data):
+                return usage
+            updates = [(r['sys_id'], {k: v for k, v in r.items() if k != 'sys_id'}) for r in data]
+        if not updates:
+            return usage
+
+        fields = {field: None for _, payload in updates for field in payload}
+        problems = schema_problems(self.instance_url, table, fields)
+        if problems:
+            return _schema_error(problems)
+
+        try:
+            results = run_bulk_writes(self.instance_url, [("PUT", f"/api/now/table/{table}/{sys_id}", payload) for sys_id, payload in updates])
+        except ValueError as e:
+            return f"Error: {str(e)}"
+        return summarize_writes(results, "Updated", table, [sys_id for sys_id, _ in updates])
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from servicenow_tools import CACHE_DIR
+
+# --- CONFIGURATION ---
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("SN_ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+
+# Applied in order. Only the parts that vary between occurrences of the same
+# error are replaced; status codes, counts and other numbers are kept, since
+# they tell different errors apart.
+_NORMALIZERS = [
+    (re.compile(r'\b[0-9a-f]{32}\b', re.I), '<sys_id>'),
+    (re.compile(r'\b[A-Z]{2,8}\d{5,}\b'), '<number>'),
+    (re.compile(r'\b\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?\b'), '<ts>'),
+    (re.compile(r'\b\d{2}:\d{2}:\d{2}(\.\d+)?\b'), '<time>'),
+    (re.compile(r'\bline[:\s#]*\d+', re.I), 'line <n>'),
+    # Script positions, e.g. "sys_script_include.abc.script:42:7" or "util.js:12"
+    (re.compile(r'(\.js|script>?):\d+(:\d+)?\b', re.I), r'\1:<n>'),
+    (re.compile(r'\s+'), ' '),
+]
+
+def normalize(message):
+    """
+    Strips the parts of an error message that differ between occurrences of
+    the same error: sys_ids, record numbers, timestamps and line numbers.
+    """
+    text = message or ''
+    for pattern, replacement in _NORMALIZERS:
+        text = pattern.sub(replacement, text)
+    return text.strip().lower()
+
+def fingerprint(message):
+    return hashlib.sha1(normalize(message).encode('utf-8')).hexdigest()
+
+class AnalysisCache:
+    """
+    On-disk (SQLite) store of LLM error analyses keyed by message fingerprint.
+    Least recently used entries are evicted past max_entries. Concurrent
+    requests for the same fingerprint share one in-flight analysis.
+    """
+
+    def __init__(self, path=None, max_entries=ANALYSIS_CACHE_MAX_ENTRIES):
+        self.path = path or os.path.join(CACHE_DIR, "analysis_cache.sqlite3")
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                fingerprint TEXT PRIMARY KEY,
+                sample TEXT,
+                analysis TEXT,
+                created_at REAL,
+                last_used REAL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses (last_used)")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def lookup(self, message):
+        """
+        Returns (fingerprint, analysis or None).
+        """
+        fp = fingerprint(message)
+        with self._lock:
+            row = self._db.execute("SELECT analysis FROM analyses WHERE fingerprint = ?", (fp,)).fetchone()
+            if row is None:
+                return fp, None
+            self._db.execute("UPDATE analyses SET last_used = ?, hits = hits + 1 WHERE fingerprint = ?", (time.time(), fp))
+            self._db.commit()
+            return fp, row[0]
+
+    def put(self, message, analysis):
+        fp = fingerprint(message)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analyses (fingerprint, sample, analysis, created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (fp, message[:2000], analysis, now, now)
+            )
+            self._db.execute(
+                "DELETE FROM analyses WHERE fingerprint IN (SELECT fingerprint FROM analyses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+        return fp
+
+    def get_or_compute(self, message, compute):
+        """
+        Returns (analysis, cached). On a miss, compute() runs once per
+        fingerprint no matter how many callers ask for it at the same time.
+        """
+        fp, analysis = self.lookup(message)
+        if analysis is not None:
+            return analysis, True
+
+        with self._lock:
+            future = self._inflight.get(fp)
+            owner = future is None
+            if owner:
+                future = self._inflight[fp] = Future()
+        if not owner:
+            return future.result(), True
+
+        try:
+            analysis = compute()
+            self.put(message, analysis)
+            future.set_result(analysis)
+            return analysis, False
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(fp, None)
+
+    def stats(self):
+        with self._lock:
+            entries, hits = self._db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM analyses").fetchone()
+            return {"entries": entries, "hits": hits, "in_flight": len(self._inflight)}
+
+analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+def get_analysis_cache():
+    """
+    Opens the shared on-disk cache on first use.
+    """
+    global analysis_cache
+    if analysis_cache is None:
+        with _analysis_cache_lock:
+            if analysis_cache is None:
+                analysis_cache = AnalysisCache()
+    return analysis_cache
@@ -0,0 +1,313 @@
+"""
+Async serving mode: python server.py --async [--port 5001]
+
+The dashboard read endpoints (stats, snapshot, applications, errors, records,
+test_connection, stats_stream) run as aiohttp handlers on the async ServiceNow
+client, so requests waiting on upstream I/O hold no thread. A single process
+can keep hundreds of them in flight. Every other route (agent jobs, sessions,
+history, fleet, metrics) is passed to the Flask app on a small thread pool.
+Those routes either return quickly or queue their work as a job.
+"""
+import asyncio
+import json
+import os
+import queue
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from werkzeug.test import EnvironBuilder
+
+import async_servicenow as asn
+import metrics
+from stats_cache import cache
+from live_stats import get_poller
+from syslog_tail import tail_errors
+from servicenow_tools import fetch_applications, APPLICATIONS_QUERY
+
+# --- CONFIGURATION ---
+# Threads for routes handed to the Flask app
+ASYNC_BRIDGE_WORKERS = int(os.getenv("SN_ASYNC_BRIDGE_WORKERS", "16"))
+# Threads for syslog tailing, kept apart from the bridge so long-polled
+# /jobs waits on the bridge can't stall /errors or snapshots
+ASYNC_TAIL_WORKERS = 4
+STREAM_POLL_INTERVAL = 0.25
+FALLBACK_ROUTE = '/{tail:.*}'
+
+bridge_pool = ThreadPoolExecutor(max_workers=ASYNC_BRIDGE_WORKERS, thread_name_prefix="bridge")
+tail_pool = ThreadPoolExecutor(max_workers=ASYNC_TAIL_WORKERS, thread_name_prefix="tail")
+
+def json_response(payload, status=200, age=None):
+    response = web.json_response(payload, status=status)
+    if age is not None:
+        response.headers['X-Data-Age'] = f"{age:.1f}"
+    return response
+
+def _missing_url():
+    return json_response({"error": "Instance URL required"}, status=400)
+
+async def cached(key, metric, load, reload):
+    """
+    Async StatsCache.get_or_load: load() is awaited on a miss, and stale
+    entries are refreshed in the background with the sync reload().
+    """
+    found = cache.lookup(key)
+    if found is not None:
+        value, age, fresh = found
+        if not fresh:
+            cache.refresh(key, lambda: cache.put(key, reload(), cache.ttl_for(metric)))
+        return value, age
+    value = await load()
+    cache.put(key, value, cache.ttl_for(metric))
+    return value, 0.0
+
+# --- MIDDLEWARE ---
+@web.middleware
+async def cors(request, handler):
+    if request.method == 'OPTIONS':
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Data-Age'
+    return response
+
+@web.middleware
+async def record_route(request, handler):
+    started = time.monotonic()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        # Routes passed to Flask are recorded by its own hooks
+        if route != FALLBACK_ROUTE:
+            metrics.route_seconds.observe(time.monotonic() - started, route=route, method=request.method)
+            metrics.route_requests.inc(route=route, method=request.method, status=str(status))
+
+# --- STATS ---
+def stats_handler(fetch):
+    async def handler(request):
+        url = request.query.get('instance_url')
+        if not url: return _missing_url()
+        try:
+            stats = await fetch(url, cache=cache)
+            return json_response(stats, age=stats["data_age"])
+        except Exception as e:
+            return json_response({"error": str(e)}, status=500)
+    return handler
+
+async def applications_section(url):
+    value, age = await cached((url, 'sys_scope', APPLICATIONS_QUERY), 'applications',
+                              lambda: asn.fetch_applications(url), lambda: fetch_applications(url))
+    return {"data": value, "data_age": age}
+
+async def errors_section(url, cursor=None):
+    return await asyncio.get_running_loop().run_in_executor(tail_pool, tail_errors, url, cursor)
+
+async def applications(request):
+    url = request.query.get('instance_url')
+    if not url: return _missing_url()
+    try:
+        section = await applications_section(url)
+        return json_response(section["data"], age=section["data_age"])
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
+
+def create_app(flask_module):
+    """
+    Builds the aiohttp application. flask_module is the imported server module,
+    whose Flask app serves the routes not handled here.
+    """
+    async def errors(request):
+        url = request.query.get('instance_url')
+        if not url: return _missing_url()
+        cursor = request.query.get('cursor')
+        try:
+            tail = await errors_section(url, cursor)
+            if cursor is None:
+                return json_response(tail["rows"][:flask_module.ERRORS_PANEL_ROWS], age=tail["data_age"])
+            return json_response(tail, age=tail["data_age"])
+        except Exception as e:
+            return json_response({"error": str(e)}, status=500)
+
+    async def error_panel(url):
+        tail = await errors_section(url)
+        return {"data": tail["rows"][:flask_module.ERRORS_PANEL_ROWS], "cursor": tail["cursor"], "data_age": tail["data_age"]}
+
+    sections = {
+        "instance_stats": lambda url: asn.get_instance_stats(url, cache=cache),
+        "errors": error_panel,
+        "security_stats": lambda url: asn.get_security_stats(url, cache=cache),
+        "integration_stats": lambda url: asn.get_integration_health(url, cache=cache),
+        "applications": applications_section,
+    }
+
+    async def dashboard_snapshot(request):
+        url = request.query.get('instance_url')
+        if not url: return _missing_url()
+        view = request.query.get('view', 'all')
+        views = flask_module.SNAPSHOT_VIEWS
+        if view not in views:
+            return json_response({"error": f"Unknown view '{view}'. Expected one of: {', '.join(views)}"}, status=400)
+
+        started = time.monotonic()
+        tasks = {asyncio.ensure_future(sections[name](url)): name for name in views[view]}
+        done, pending = await asyncio.wait(tasks, timeout=flask_module.SNAPSHOT_TIMEOUT)
+
+        results = {name: None for name in tasks.values()}
+        failures = {}
+        for task in done:
+            try:
+                results[tasks[task]] = task.result()
+            except Exception as e:
+                failures[tasks[task]] = str(e)
+        for task in pending:
+            task.cancel()
+            failures[tasks[task]] = f"Timed out after {flask_module.SNAPSHOT_TIMEOUT:g}s"
+
+        age = max((s.get("data_age", 0.0) for s in results.values() if s), default=0.0)
+        return json_response({
+            "view": view,
+            "sections": results,
+            "errors": failures,
+            "data_age": age,
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+        }, age=age)
+
+    async def test_connection(request):
+        data = await request.json()
+        url = data.get('instance_url')
+        if not url: return _missing_url()
+        result = await asn.check_connection(url)
+        metrics.log("test_connection", level="info" if result.get("status") == "success" else "warning", slow=True,
+                    instance=url, status=result.get("status"), message=result.get("message"))
+        return json_response(result)
+
+    async def records(request):
+        data = await request.json()
+        url = data.get('instance_url')
+        table = data.get('table')
+        query = data.get('query')
+        fields = data.get('fields')
+        if not url or not table or not query:
+            return json_response({"error": "Instance URL, Table, and Query required"}, status=400)
+        try:
+            limit = flask_module.records_limit(data.get('limit', 20))
+        except ValueError as e:
+            return json_response({"error": str(e)}, status=400)
+
+        rows = asn.iter_records(url, table, query, fields, max_records=limit)
+        try:
+            first = await rows.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except Exception as e:
+            return json_response({"error": str(e)}, status=500)
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        if first is not None:
+            await response.write((json.dumps(first) + "\n").encode('utf-8'))
+            try:
+                async for row in rows:
+                    await response.write((json.dumps(row) + "\n").encode('utf-8'))
+            except Exception as e:
+                await response.write((json.dumps({"error": str(e)}) + "\n").encode('utf-8'))
+        await response.write_eof()
+        return response
+
+    async def stats_stream(request):
+        url = request.query.get('instance_url')
+        if not url: return _missing_url()
+        poller = get_poller(url)
+        q = poller.subscribe()
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        await response.prepare(request)
+        try:
+            idle = 0.0
+            while True:
+                # The poller publishes to a thread queue; poll it without blocking the loop
+                try:
+                    event = q.get_nowait()
+                except queue.Empty:
+                    await asyncio.sleep(STREAM_POLL_INTERVAL)
+                    idle += STREAM_POLL_INTERVAL
+                    if idle >= flask_module.STREAM_KEEPALIVE:
+                        await response.write(b": keepalive\n\n")
+                        idle = 0.0
+                    continue
+                idle = 0.0
+                await response.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode('utf-8'))
+        except ConnectionResetError:
+            pass
+        finally:
+            poller.unsubscribe(q)
+        return response
+
+    async def flask_fallback(request):
+        """
+        Runs the request through the Flask app on the bridge pool.
+        """
+        body = await request.read()
+        environ = EnvironBuilder(
+            path=request.path, method=request.method, query_string=request.query_string,
+            headers=list(request.headers.items()), data=body,
+        ).get_environ()
+        loop = asyncio.get_running_loop()
+
+        def call():
+            started = {}
+            def start_response(status, headers, exc_info=None):
+                started["status"], started["headers"] = status, headers
+            chunks = flask_module.app(environ, start_response)
+            try:
+                return started, b"".join(chunks)
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+
+        started, payload = await loop.run_in_executor(bridge_pool, call)
+        response = web.Response(status=int(started["status"].split()[0]), body=payload)
+        for key, value in started["headers"]:
+            if key.lower() not in ('content-length', 'access-control-allow-origin', 'access-control-expose-headers'):
+                response.headers[key] = value
+        return response
+
+    app = web.Application(middlewares=[cors, record_route])
+    app.router.add_get('/instance_stats', stats_handler(asn.get_instance_stats))
+    app.router.add_get('/security_stats', stats_handler(asn.get_security_stats))
+    app.router.add_get('/integration_stats', stats_handler(asn.get_integration_health))
+    app.router.add_get('/applications', applications)
+    app.router.add_get('/errors', errors)
+    app.router.add_get('/dashboard_snapshot', dashboard_snapshot)
+    app.router.add_post('/test_connection', test_connection)
+    app.router.add_post('/records', records)
+    app.router.add_get('/stats_stream', stats_stream)
+    app.router.add_route('*', FALLBACK_ROUTE, flask_fallback)
+
+    async def shutdown(app):
+        await asn.close_clients()
+    app.on_cleanup.append(shutdown)
+    return app
+
+def main(flask_module=None, port=5001):
+    if flask_module is None:
+        import server as flask_module
+    web.run_app(create_app(flask_module), host='127.0.0.1', port=port)
+
+if __name__ == '__main__':
+    main(port=int(sys.argv[sys.argv.index('--port') + 1]) if '--port' in sys.argv else 5001)
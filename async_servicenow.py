@@ -0,0 +1,279 @@
+import asyncio
+import json
+import time
+
+import aiohttp
+
+import servicenow_tools as sn
+from count_planner import plan_counts, call_params, split_results
+from metrics import observe_upstream, log
+from rate_limiter import get_limiter, current_lane, RateLimited
+
+# Async counterparts of the servicenow_tools read functions, for the async
+# server mode. Same arguments, same return values; cache entries, history
+# recording and metrics are shared with the sync code.
+
+class AsyncResponse:
+    """
+    The parts of a requests.Response the read functions use, with the body
+    already read.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.links = {}
+        for link in headers.getall('Link', []):
+            for part in link.split(','):
+                url, _, rel = part.partition(';')
+                if 'rel=' in rel:
+                    self.links[rel.split('=', 1)[1].strip().strip('"')] = {"url": url.strip().strip('<>')}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncServiceNowClient:
+    """
+    Non-blocking keep-alive client for one instance URL, bound to the event
+    loop it is first used on. Retries like ServiceNowClient: connection errors
+    and 5xx with exponential backoff, never for POST after the request was sent,
+    and 429s after their Retry-After. Shares the instance's rate limiter with
+    the sync client.
+    """
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, instance_url, username=None, password=None, pool_size=sn.POOL_SIZE, max_retries=sn.MAX_RETRIES, timeout=sn.DEFAULT_TIMEOUT):
+        self.instance_url = instance_url.rstrip('/')
+        self.auth = aiohttp.BasicAuth(username or sn.USERNAME or '', password or sn.PASSWORD or '')
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self.auth,
+                headers={"Content-Type": "application/json", "Accept": "application/json"},
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+        return self._session
+
+    async def request(self, method, path, params=None, json=None, timeout=None):
+        url = path if path.startswith('http') else f"{self.instance_url}{path}"
+        connect, read = timeout or self.timeout
+        client_timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        limiter = get_limiter(self.instance_url)
+        started = time.monotonic()
+        attempt = 0
+        throttled = 0
+        while True:
+            try:
+                await limiter.acquire_async()
+            except RateLimited:
+                if throttled:
+                    return response
+                raise
+            try:
+                async with self._get_session().request(method, url, params=params, json=json, timeout=client_timeout) as res:
+                    response = AsyncResponse(res.status, res.headers, await res.read())
+                if response.status_code in self.RETRY_STATUSES and method != 'POST' and attempt < self.max_retries:
+                    raise aiohttp.ServerConnectionError(f"Retryable status {response.status_code}")
+                observe_upstream(method, path, time.monotonic() - started, response)
+                limiter.observe(response.status_code, response.headers)
+                if response.status_code == 429 and throttled < self.max_retries:
+                    throttled += 1
+                    continue
+                return response
+            except (aiohttp.ClientConnectorError, aiohttp.ServerConnectionError, asyncio.TimeoutError) as e:
+                # A POST that reached the server may have been applied; only retry failed connects
+                retryable = method != 'POST' or isinstance(e, aiohttp.ClientConnectorError)
+                if attempt >= self.max_retries or not retryable:
+                    observe_upstream(method, path, time.monotonic() - started, error=e)
+                    raise
+            attempt += 1
+            await asyncio.sleep(0.3 * (2 ** (attempt - 1)))
+
+    async def get(self, path, params=None, **kwargs):
+        # Shares identical in-flight GETs, like ServiceNowClient.get
+        key = (self.instance_url, path, sn.params_key(params), current_lane())
+        return await sn.read_flight.do_async(key, lambda: self.request('GET', path, params=params, **kwargs))
+
+    async def post(self, path, json=None, **kwargs):
+        return await self.request('POST', path, json=json, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+_clients = {}
+
+def get_async_client(instance_url):
+    """
+    Shared async client per instance URL. Only used from the server's event
+    loop, so no lock is needed.
+    """
+    key = instance_url.rstrip('/')
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = AsyncServiceNowClient(key)
+    return client
+
+async def close_clients():
+    for client in list(_clients.values()):
+        await client.close()
+    _clients.clear()
+
+# --- COUNTS ---
+async def fetch_aggregate(instance_url, call, timeout=None):
+    res = await get_async_client(instance_url).get(f"/api/now/stats/{call['table']}", params=call_params(call), timeout=timeout)
+    if res.status_code != 200:
+        raise sn.ServiceNowError(res.status_code, res.text[:200])
+    return res.json().get('result', {})
+
+async def fetch_count(instance_url, table, query, timeout=None):
+    call = {"table": table, "query": query, "group_by": None, "metrics": {"count": None}}
+    return split_results(call, await fetch_aggregate(instance_url, call, timeout=timeout))["count"]
+
+async def fetch_batch(instance_url, paths, timeout=None):
+    return await sn.read_flight.do_async(sn.batch_key(instance_url, paths), lambda: _fetch_batch(instance_url, paths, timeout))
+
+async def _fetch_batch(instance_url, paths, timeout):
+    payload = sn.batch_payload(sn.batch_get_requests(paths))
+    res = await get_async_client(instance_url).post("/api/now/v1/batch", json=payload, timeout=timeout)
+    return sn.parse_batch(res)
+
+async def _execute_counts(instance_url, queries, max_workers, timeout, total_timeout=None):
+    values = {}
+    errors = {}
+    latency = {}
+    if not queries:
+        return values, errors, latency
+
+    calls = plan_counts(queries)
+    read_timeout = (sn.DEFAULT_TIMEOUT[0], timeout)
+
+    if sn.USE_BATCH_API and len(calls) > 1:
+        started = time.monotonic()
+        try:
+            responses = await fetch_batch(instance_url, sn.count_batch_paths(calls), timeout=read_timeout)
+            values, errors = sn.split_batch_counts(calls, responses)
+            elapsed = round((time.monotonic() - started) * 1000, 1)
+            return values, errors, {metric: elapsed for metric in queries}
+        except Exception as e:
+            log("batch_unavailable", level="warning", instance=instance_url, error=str(e))
+
+    limit = asyncio.Semaphore(max(1, max_workers))
+    deadline = None if total_timeout is None else time.monotonic() + total_timeout
+
+    async def timed(call):
+        async with limit:
+            started = time.monotonic()
+            # Calls still queued on the semaphore only get what is left of total_timeout
+            budget = timeout if deadline is None else min(timeout, deadline - started)
+            try:
+                if budget <= 0:
+                    raise asyncio.TimeoutError()
+                result = await asyncio.wait_for(fetch_aggregate(instance_url, call, timeout=read_timeout), budget)
+                values.update(split_results(call, result))
+            except asyncio.TimeoutError:
+                for metric in call["metrics"]:
+                    errors[metric] = "Timed out"
+            except Exception as e:
+                for metric in call["metrics"]:
+                    errors[metric] = str(e)
+                log("count_failed", level="warning", instance=instance_url, table=call['table'], metrics=call['metrics'], error=str(e))
+            finally:
+                elapsed = round((time.monotonic() - started) * 1000, 1)
+                for metric in call["metrics"]:
+                    latency[metric] = elapsed
+
+    await asyncio.gather(*(timed(call) for call in calls))
+    return values, errors, latency
+
+async def run_count_queries(instance_url, queries, max_workers=None, timeout=None, cache=None, total_timeout=None):
+    """
+    See servicenow_tools.run_count_queries. Stale cache entries are refreshed
+    by the cache's background threads with the sync client.
+    """
+    max_workers = max_workers or sn.COUNT_MAX_WORKERS
+    timeout = timeout or sn.COUNT_TIMEOUT
+    results, ages, misses = sn.begin_counts(instance_url, queries, cache, timeout)
+    values, errors, latency = await _execute_counts(instance_url, misses, max_workers, timeout, total_timeout)
+    return sn.finish_counts(instance_url, queries, cache, results, ages, values, errors, latency)
+
+async def get_instance_stats(instance_url, cache=None):
+    return await run_count_queries(instance_url, sn.INSTANCE_STAT_QUERIES, cache=cache)
+
+async def get_security_stats(instance_url, cache=None):
+    return await run_count_queries(instance_url, sn.SECURITY_STAT_QUERIES, cache=cache)
+
+async def get_integration_health(instance_url, cache=None):
+    return await run_count_queries(instance_url, sn.INTEGRATION_STAT_QUERIES, cache=cache)
+
+# --- RECORDS ---
+async def fetch_applications(instance_url):
+    response = await get_async_client(instance_url).get("/api/now/table/sys_scope", params=sn.APPLICATIONS_PARAMS)
+    if response.status_code != 200:
+        raise sn.ServiceNowError(response.status_code, response.text[:200])
+    return response.json().get('result', [])
+
+async def get_applications(instance_url):
+    try:
+        return await fetch_applications(instance_url)
+    except Exception as e:
+        log("applications_failed", level="warning", instance=instance_url, error=str(e))
+    return []
+
+async def get_recent_errors(instance_url, limit=10):
+    try:
+        response = await get_async_client(instance_url).get("/api/now/table/syslog", params=sn.recent_errors_params(limit))
+        if response.status_code == 200:
+            return response.json().get('result', [])
+    except Exception as e:
+        log("recent_errors_failed", level="warning", instance=instance_url, error=str(e))
+    return []
+
+async def iter_records(instance_url, table, query, fields=None, page_size=sn.PAGE_SIZE, max_records=None):
+    """
+    Async generator version of servicenow_tools.iter_records.
+    """
+    params = sn.page_params(query, fields)
+    client = get_async_client(instance_url)
+    yielded = 0
+    while True:
+        limit = page_size if max_records is None else min(page_size, max_records - yielded)
+        if limit <= 0:
+            return
+        params['sysparm_limit'] = limit
+        response = await client.get(f"/api/now/table/{table}", params=params)
+        if response.status_code != 200:
+            raise sn.ServiceNowError(response.status_code, response.text)
+        rows = response.json().get('result', [])
+        for row in rows:
+            yield row
+        yielded += len(rows)
+
+        if not sn.has_next_page(response, rows, limit):
+            return
+        params['sysparm_offset'] += len(rows)
+
+async def get_records(instance_url, table, query, fields=None, limit=20):
+    try:
+        response = await get_async_client(instance_url).get(f"/api/now/table/{table}", params=sn.record_params(query, fields, limit))
+        return sn.records_result(response)
+    except Exception as e:
+        return {"error": f"Connection Error: {str(e)}"}
+
+async def check_connection(instance_url):
+    try:
+        response = await get_async_client(instance_url).get("/api/now/table/sys_user", params=sn.CONNECTION_PARAMS)
+        return sn.connection_result(response.status_code)
+    except Exception as e:
+        return {"status": "error", "message": f"Connection Failed: {str(e)}"}
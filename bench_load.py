@@ -0,0 +1,265 @@
+"""
+Load benchmark for the Flask endpoints and the ServiceNow tool functions,
+run against a local mock instance (mock_servicenow.py).
+
+    python bench_load.py [--requests 200] [--concurrency 16] [--profile realistic] [--only instance_stats,records]
+    python bench_load.py --mode both --concurrency 200 --only instance_stats,dashboard_snapshot,records
+
+Each scenario is driven with --requests calls on --concurrency threads and
+reports p50/p95/p99 latency, throughput, the upstream calls it caused and
+the reads that were coalesced into another identical call in flight.
+Endpoint scenarios go through the real Flask app (served on a local port)
+and so include its caches (emptied before each scenario); tool scenarios
+call servicenow_tools directly. --mode picks the sync Flask server, the
+async server (async_server.py) or both, for a side-by-side comparison.
+
+Results are written to bench_results/<timestamp>.json and compared with the
+previous run (or --compare FILE).
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import mock_servicenow
+
+RESULTS_DIR = "bench_results"
+
+PROFILES = {
+    "fast": {},
+    "realistic": {"latency_ms": 80, "jitter_ms": 40, "slow_tables": {"syslog": 300}},
+    "flaky": {"latency_ms": 80, "jitter_ms": 40, "error_rate": 0.02, "throttle_rate": 0.05},
+}
+
+# --- SCENARIOS ---
+# name -> fn(ctx) making one call; raises on failure
+def _get(ctx, path, **params):
+    res = ctx["http"].get(f"{ctx['api']}{path}", params={"instance_url": ctx["instance"], **params}, timeout=60)
+    res.raise_for_status()
+    return res
+
+def _records(ctx):
+    res = ctx["http"].post(f"{ctx['api']}/records", json={
+        "instance_url": ctx["instance"], "table": "incident", "query": "active=true", "fields": "number,priority,state", "limit": 1000
+    }, stream=True, timeout=60)
+    res.raise_for_status()
+    for _ in res.iter_lines():
+        pass
+
+def _bulk_update(ctx):
+    from servicenow_tools import run_bulk_writes
+    results = run_bulk_writes(ctx["instance"], [("PUT", f"/api/now/table/incident/{sys_id}", {"state": "2"}) for sys_id in ctx["incident_ids"]])
+    failed = [r for r in results if not r["ok"]]
+    if failed:
+        raise RuntimeError(f"{len(failed)} writes failed")
+
+def _tool(fn):
+    def run(ctx):
+        result = fn(ctx)
+        if isinstance(result, dict) and result.get("error"):
+            raise RuntimeError(result["error"])
+    return run
+
+def _scenarios():
+    import servicenow_tools as sn
+    return {
+        # Flask endpoints
+        "instance_stats": lambda ctx: _get(ctx, "/instance_stats"),
+        "security_stats": lambda ctx: _get(ctx, "/security_stats"),
+        "integration_stats": lambda ctx: _get(ctx, "/integration_stats"),
+        "errors": lambda ctx: _get(ctx, "/errors"),
+        "applications": lambda ctx: _get(ctx, "/applications"),
+        "dashboard_snapshot": lambda ctx: _get(ctx, "/dashboard_snapshot", view="all"),
+        "stats_history": lambda ctx: _get(ctx, "/stats_history"),
+        "fleet": lambda ctx: ctx["http"].get(f"{ctx['api']}/fleet", params={"instances": ctx["instance"]}, timeout=60).raise_for_status(),
+        "records": _records,
+        "metrics": lambda ctx: ctx["http"].get(f"{ctx['api']}/metrics", timeout=60).raise_for_status(),
+        # Tool functions, no caching
+        "tool_count_queries": _tool(lambda ctx: sn.run_count_queries(ctx["instance"], sn.INSTANCE_STAT_QUERIES)),
+        "tool_iter_records": _tool(lambda ctx: sum(1 for _ in sn.iter_records(ctx["instance"], "syslog", "level=2", "sys_created_on,message", max_records=2000))),
+        "tool_get_records": _tool(lambda ctx: sn.get_records(ctx["instance"], "incident", "active=true", "number,short_description", limit=20)),
+        "tool_recent_errors": _tool(lambda ctx: sn.get_recent_errors(ctx["instance"])),
+        "tool_bulk_update": _bulk_update,
+    }
+
+# --- RUNNER ---
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_scenario(fn, ctx, total, concurrency, mock):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            fn(ctx)
+            ok = True
+        except Exception as e:
+            ok = False
+            with lock:
+                errors.append(str(e)[:200])
+        elapsed = (time.perf_counter() - started) * 1000
+        if ok:
+            with lock:
+                latencies.append(elapsed)
+
+    from stats_cache import cache
+    from servicenow_tools import read_flight
+    cache.clear()
+    mock.reset()
+    shared_before = read_flight.stats()["shared"]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+    upstream = mock.stats()["total"]
+    # Reads that joined an identical call already in flight (in-process only)
+    coalesced = read_flight.stats()["shared"] - shared_before
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies), 2) if latencies else None,
+        "throughput_rps": round(total / wall, 1),
+        "upstream_calls": upstream,
+        "upstream_per_request": round(upstream / total, 2),
+        "coalesced_reads": coalesced,
+    }
+
+def start_app():
+    """
+    Serves the Flask app on a free local port. Returns its base URL.
+    """
+    from werkzeug.serving import make_server
+    import server
+    httpd = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="bench-app", daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}"
+
+def start_async_app():
+    """
+    Serves the async app on a free local port from its own event loop thread.
+    """
+    import asyncio
+    from aiohttp import web
+    import server
+    import async_server
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(async_server.create_app(server))
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    threading.Thread(target=loop.run_forever, name="bench-async-app", daemon=True).start()
+    return f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+# --- RESULTS ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save(report):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+def previous_result(exclude):
+    runs = sorted(p for p in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if os.path.abspath(p) != os.path.abspath(exclude))
+    return runs[-1] if runs else None
+
+def _change(new, old):
+    if new is None or not old:
+        return ""
+    return f"{(new - old) / old * 100:+.0f}%"
+
+def print_report(report, baseline=None):
+    base = (baseline or {}).get("results", {})
+    print(f"{'scenario':<30} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'up/req':>7} {'shared':>7} {'err':>5}   vs baseline (p95, rps)")
+    for name, r in report["results"].items():
+        old = base.get(name, {})
+        fmt = lambda v: f"{v:8.1f}" if v is not None else f"{'-':>8}"
+        print(f"{name:<30} {fmt(r['p50_ms'])} {fmt(r['p95_ms'])} {fmt(r['p99_ms'])} {r['throughput_rps']:8.1f} "
+              f"{r['upstream_per_request']:7.2f} {r.get('coalesced_reads', 0):7d} {r['errors']:5d}   {_change(r['p95_ms'], old.get('p95_ms')):>6} {_change(r['throughput_rps'], old.get('throughput_rps')):>6}")
+        if r["first_error"]:
+            print(f"{'':<30} first error: {r['first_error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--profile", choices=PROFILES, default="realistic")
+    parser.add_argument("--scale", type=float, default=1, help="mock data size multiplier")
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--mode", choices=("sync", "async", "both"), default="sync", help="server mode for endpoint scenarios")
+    parser.add_argument("--compare", help="result file to compare with (default: the previous run)")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    _, mock, instance = mock_servicenow.start(scale=args.scale, profile=PROFILES[args.profile])
+    scenarios = _scenarios()
+    names = [n.strip() for n in args.only.split(",")] if args.only else list(scenarios)
+    unknown = [n for n in names if n not in scenarios]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    ctx = {
+        "instance": instance,
+        "http": requests.Session(),
+        "incident_ids": [r["sys_id"] for r in mock.tables["incident"][:50]],
+    }
+    endpoints = [n for n in names if not n.startswith("tool_")]
+    apps = {}
+    if endpoints and args.mode in ("sync", "both"):
+        apps["sync"] = start_app()
+    if endpoints and args.mode in ("async", "both"):
+        apps["async"] = start_async_app()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "profile": args.profile, "scale": args.scale, "mode": args.mode},
+        "results": {},
+    }
+    for name in names:
+        if name in endpoints:
+            for mode, api in apps.items():
+                label = f"{name} [{mode}]" if len(apps) > 1 else name
+                report["results"][label] = run_scenario(scenarios[name], {**ctx, "api": api}, args.requests, args.concurrency, mock)
+        else:
+            report["results"][name] = run_scenario(scenarios[name], ctx, args.requests, args.concurrency, mock)
+
+    path = None if args.no_save else save(report)
+    baseline_path = args.compare or (previous_result(path) if path else None)
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if path:
+        print(f"\nSaved {path}" + (f", compared with {baseline_path}" if baseline_path else ""))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
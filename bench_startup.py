@@ -0,0 +1,81 @@
+"""
+Startup benchmark for the lazy agent stack and the agent pool.
+
+    python bench_startup.py [--runs 5] [--instance-url https://dev12345.service-now.com]
+
+1. Imports server.py in fresh interpreters and checks crewai was not loaded.
+2. Times importing admin_agent (what the first AI request pays).
+3. Compares building an agent with get_agent() against reusing one from the pool.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_PROBE = """
+import sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(elapsed, 'crewai' in sys.modules)
+"""
+
+def time_import(module, runs):
+    timings = []
+    loaded_crewai = False
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE.format(module=module)],
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        elapsed, crewai = out.split()
+        timings.append(float(elapsed))
+        loaded_crewai = loaded_crewai or crewai == "True"
+    return timings, loaded_crewai
+
+def time_agents(instance_url, runs):
+    from admin_agent import get_agent, AgentPool
+
+    fresh = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        get_agent(instance_url)
+        fresh.append(time.perf_counter() - started)
+
+    pool = AgentPool(max_idle=1)
+    pool.release(instance_url, pool.acquire(instance_url))
+    pooled = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        agent = pool.acquire(instance_url)
+        pooled.append(time.perf_counter() - started)
+        pool.release(instance_url, agent)
+    return fresh, pooled
+
+def report(label, timings):
+    print(f"{label:<32} median {statistics.median(timings) * 1000:9.1f} ms   max {max(timings) * 1000:9.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--instance-url", default="https://example.service-now.com")
+    args = parser.parse_args()
+
+    server_timings, loaded_crewai = time_import("server", args.runs)
+    report("import server (stats only)", server_timings)
+    print(f"{'crewai imported at startup':<32} {'YES - lazy import is broken' if loaded_crewai else 'no'}")
+
+    try:
+        agent_timings, _ = time_import("admin_agent", args.runs)
+        report("import admin_agent (first AI)", agent_timings)
+        fresh, pooled = time_agents(args.instance_url, args.runs)
+        report("get_agent() per request", fresh)
+        report("AgentPool.acquire() reuse", pooled)
+    except (subprocess.CalledProcessError, ImportError) as e:
+        print(f"Agent stack not available, skipped agent timings: {e}")
+
+    return 1 if loaded_crewai else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import os
+import re
+
+# Fields that are safe to pass as sysparm_group_by: a handful of distinct
+# values each, so the aggregate response stays small. Add more with
+# SN_GROUP_BY_FIELDS (comma-separated).
+GROUP_BY_FIELDS = {'priority', 'state', 'level', 'active', 'impact', 'urgency', 'severity', 'type', 'approval'}
+GROUP_BY_FIELDS |= {f.strip() for f in os.getenv("SN_GROUP_BY_FIELDS", "").split(',') if f.strip()}
+
+# Encoded-query operators that change how conditions combine; queries using
+# them are never merged.
+_UNMERGEABLE = ('^OR', '^NQ', 'ORDERBY', 'GROUPBY')
+_EQUALS = re.compile(r'^([A-Za-z0-9_]+)=(.*)$')
+
+def _conditions(query):
+    return [c for c in query.split('^') if c]
+
+def _group_selector(condition):
+    """
+    Returns (field, value) for a condition that can be answered by grouping on
+    field, or None.
+    """
+    match = _EQUALS.match(condition)
+    if match and match.group(1) in GROUP_BY_FIELDS:
+        return match.group(1), match.group(2)
+    return None
+
+def _single(table, query, metrics):
+    return {"table": table, "query": query, "group_by": None, "metrics": {m: None for m in metrics}}
+
+def _plan_table(table, metric_queries):
+    """
+    Plans the calls for one table. metric_queries maps metric -> query.
+    """
+    calls = []
+
+    # Identical queries always share a call
+    by_query = {}
+    for metric, query in metric_queries.items():
+        by_query.setdefault(query, []).append(metric)
+
+    candidates = {q: ms for q, ms in by_query.items() if not any(op in q for op in _UNMERGEABLE)}
+    for query in set(by_query) - set(candidates):
+        calls.append(_single(table, query, by_query[query]))
+
+    while len(candidates) > 1:
+        conds = {q: _conditions(q) for q in candidates}
+        first = conds[next(iter(conds))]
+        base = [c for c in first if all(c in other for other in conds.values())]
+
+        mergeable = {}
+        rejected = []
+        for query, cs in conds.items():
+            extra = [c for c in cs if c not in base]
+            if not extra:
+                mergeable[query] = None
+            elif len(extra) == 1 and _group_selector(extra[0]):
+                mergeable[query] = _group_selector(extra[0])
+            else:
+                rejected.append(query)
+
+        if rejected:
+            # Plan the others without the queries that don't fit this base
+            for query in rejected:
+                calls.append(_single(table, query, candidates.pop(query)))
+            continue
+
+        base_query = '^'.join(base)
+        fields = []
+        for selector in mergeable.values():
+            if selector and selector[0] not in fields:
+                fields.append(selector[0])
+
+        if not fields or len(fields) >= len(candidates):
+            # Merging would not save a round trip
+            break
+
+        field_calls = {
+            field: {"table": table, "query": base_query, "group_by": field, "metrics": {}}
+            for field in fields
+        }
+        for query, selector in mergeable.items():
+            # Totals are the sum of any grouping; hang them on the first call
+            target = field_calls[selector[0]] if selector else field_calls[fields[0]]
+            for metric in candidates[query]:
+                target["metrics"][metric] = selector
+        calls.extend(field_calls.values())
+        candidates = {}
+
+    for query, metrics in candidates.items():
+        calls.append(_single(table, query, metrics))
+    return calls
+
+def plan_counts(queries):
+    """
+    Rewrites count queries into as few Aggregate API calls as possible.
+    queries maps metric -> (table, query). Returns a list of calls, each a dict
+    with table, query, group_by (a field or None) and metrics, which maps every
+    metric answered by the call to its selector: None for the total row count,
+    or (field, value) for the count of one group.
+    """
+    by_table = {}
+    for metric, (table, query) in queries.items():
+        by_table.setdefault(table, {})[metric] = query
+
+    calls = []
+    for table, metric_queries in by_table.items():
+        calls.extend(_plan_table(table, metric_queries))
+    return calls
+
+def call_params(call):
+    """
+    Aggregate API query parameters for a planned call.
+    """
+    params = {
+        'sysparm_count': 'true',
+        'sysparm_query': call["query"]
+    }
+    if call["group_by"]:
+        params['sysparm_group_by'] = call["group_by"]
+    return params
+
+def split_results(call, result):
+    """
+    Splits the 'result' of an Aggregate API response back out per metric.
+    """
+    if not call["group_by"]:
+        count = int((result or {}).get('stats', {}).get('count', 0))
+        return {metric: count for metric in call["metrics"]}
+
+    groups = {}
+    for row in result or []:
+        value = ''
+        for group_field in row.get('groupby_fields', []):
+            if group_field.get('field') == call["group_by"]:
+                value = group_field.get('value', '')
+        groups[value] = groups.get(value, 0) + int(row.get('stats', {}).get('count', 0))
+
+    counts = {}
+    for metric, selector in call["metrics"].items():
+        counts[metric] = sum(groups.values()) if selector is None else groups.get(selector[1], 0)
+    return counts
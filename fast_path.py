@@ -0,0 +1,222 @@
+import os
+import re
+import threading
+
+from servicenow_tools import get_client, ServiceNowError
+from record_format import DEFAULT_FIELDS, format_records
+from metrics import admin_commands, log
+
+# Routine admin commands ("list the last 5 business rules", "find user with
+# email X", "show P1 incidents") are mapped straight to a table query instead
+# of a crew run. Each pattern has to match the whole command; anything it
+# doesn't cover exactly, including any extra words, goes to the agent.
+
+# --- CONFIGURATION ---
+FAST_PATH_ENABLED = os.getenv("SN_FAST_PATH", "true").lower() == "true"
+FAST_PATH_MAX_ROWS = int(os.getenv("SN_FAST_PATH_MAX_ROWS", "50"))
+FAST_PATH_DEFAULT_ROWS = 10
+# A person reads these, not the agent, so allow a longer table
+FAST_PATH_MAX_CHARS = 20000
+
+VERB = r'(?:(?:please\s+)?(?:list|show|get|display|fetch|find|give|look\s*up|search\s+for)\s+)?(?:me\s+)?'
+
+# label, noun pattern, table, base query
+LIST_TARGETS = [
+    ("business rules", r'business\s+rules?', 'sys_script', ''),
+    ("client scripts", r'client\s+scripts?', 'sys_script_client', ''),
+    ("script includes", r'script\s+includes?', 'sys_script_include', ''),
+    ("incidents", r'incidents?', 'incident', ''),
+    ("problems", r'problems?', 'problem', ''),
+    ("change requests", r'changes?(?:\s+requests?)?', 'change_request', ''),
+    ("users", r'users?', 'sys_user', ''),
+    ("groups", r'(?:user\s+)?groups?', 'sys_user_group', ''),
+    ("applications", r'(?:applications?|apps?)', 'sys_scope', ''),
+    ("errors", r'(?:errors?|error\s+logs?)', 'syslog', 'level=2'),
+]
+
+NUMBER_PREFIXES = {
+    'INC': 'incident',
+    'PRB': 'problem',
+    'CHG': 'change_request',
+    'RITM': 'sc_req_item',
+}
+
+_LAST = re.compile(
+    rf'^{VERB}(?:the\s+)?(?:(?P<n1>\d{{1,4}})\s+)?(?:last|latest|newest|most\s+recent|recent)\s+'
+    rf'(?:(?P<n2>\d{{1,4}})\s+)?(?:(?P<when1>created|updated|modified)\s+)?(?P<noun>[a-z\s]+?)'
+    rf'(?:\s+(?P<when2>created|updated|modified))?$'
+)
+_USER_EMAIL = re.compile(
+    rf'^{VERB}(?:the\s+)?user\s+(?:with\s+(?:the\s+)?)?(?:(?:e-?mail)(?:\s+address)?\s*(?:=|:|of|is)?\s*)?'
+    r'(?P<email>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)$'
+)
+_USER_NAME = re.compile(
+    rf'^{VERB}(?:the\s+)?user\s+(?:with\s+(?:the\s+)?)?(?:user\s*name|user\s*id|login)\s*(?:=|:|of|is)?\s*(?P<user_name>[\w.@-]+)$'
+)
+_PRIORITY_INCIDENTS = re.compile(
+    rf'^{VERB}(?:all\s+)?(?:the\s+)?(?:open\s+|active\s+)?(?:p|priority\s*)(?P<priority>[1-5])\s+incidents?$'
+)
+_UNASSIGNED_INCIDENTS = re.compile(
+    rf'^{VERB}(?:all\s+)?(?:the\s+)?(?:open\s+|active\s+)?unassigned\s+incidents?$'
+)
+_RECORD_NUMBER = re.compile(
+    rf'^{VERB}(?:the\s+)?(?:incident\s+|problem\s+|change\s+|request\s+item\s+|record\s+)?'
+    rf'(?P<number>(?:{"|".join(NUMBER_PREFIXES).lower()})\d{{5,}})$'
+)
+
+# --- ROUTES ---
+# Each returns a query spec, or None when the command isn't one it can answer.
+def _last_records(command):
+    match = _LAST.match(command)
+    if not match:
+        return None
+    noun = match.group('noun').strip()
+    for label, pattern, table, base in LIST_TARGETS:
+        if re.fullmatch(pattern, noun):
+            break
+    else:
+        return None
+    requested = int(match.group('n1') or match.group('n2') or FAST_PATH_DEFAULT_ROWS)
+    if requested < 1:
+        return None
+    limit = min(requested, FAST_PATH_MAX_ROWS)
+    when = match.group('when1') or match.group('when2')
+    order_by = 'sys_updated_on' if when in ('updated', 'modified') else 'sys_created_on'
+    title = f"Last {limit} {label}" + (" by update time" if order_by == 'sys_updated_on' else "")
+    if limit < requested:
+        title += f" (limited to {FAST_PATH_MAX_ROWS})"
+    return {
+        "title": title,
+        "table": table,
+        "query": f"{base}^ORDERBYDESC{order_by}" if base else f"ORDERBYDESC{order_by}",
+        "limit": limit,
+        "with_total": False,
+    }
+
+def _user_by_email(command):
+    match = _USER_EMAIL.match(command)
+    if not match:
+        return None
+    email = match.group('email')
+    return {"title": f"Users with email {email}", "table": 'sys_user', "query": f"email={email}"}
+
+def _user_by_name(command):
+    match = _USER_NAME.match(command)
+    if not match:
+        return None
+    user_name = match.group('user_name')
+    return {"title": f"Users with user name {user_name}", "table": 'sys_user', "query": f"user_name={user_name}"}
+
+def _priority_incidents(command):
+    match = _PRIORITY_INCIDENTS.match(command)
+    if not match:
+        return None
+    priority = match.group('priority')
+    return {"title": f"Open P{priority} incidents", "table": 'incident', "query": f"active=true^priority={priority}^ORDERBYDESCsys_created_on"}
+
+def _unassigned_incidents(command):
+    if not _UNASSIGNED_INCIDENTS.match(command):
+        return None
+    return {"title": "Open unassigned incidents", "table": 'incident', "query": "active=true^assigned_toISEMPTY^ORDERBYDESCsys_created_on"}
+
+def _record_by_number(command):
+    match = _RECORD_NUMBER.match(command)
+    if not match:
+        return None
+    number = match.group('number').upper()
+    prefix = re.match(r'[A-Z]+', number).group(0)
+    return {"title": f"Record {number}", "table": NUMBER_PREFIXES[prefix], "query": f"number={number}"}
+
+ROUTES = [
+    ("last_records", _last_records),
+    ("user_by_email", _user_by_email),
+    ("user_by_name", _user_by_name),
+    ("priority_incidents", _priority_incidents),
+    ("unassigned_incidents", _unassigned_incidents),
+    ("record_by_number", _record_by_number),
+]
+
+def normalize(command):
+    return " ".join(command.lower().split()).rstrip('.?!').strip()
+
+def match_command(command):
+    """
+    Returns (route name, query spec) for a command the fast path can answer, or None.
+    """
+    text = normalize(command)
+    for name, route in ROUTES:
+        spec = route(text)
+        if spec is not None:
+            return name, spec
+    return None
+
+# --- EXECUTION ---
+def _run_query(instance_url, spec):
+    """
+    Runs spec and returns the result text. Raises if the instance call fails.
+    """
+    fields = DEFAULT_FIELDS.get(spec["table"])
+    params = {
+        'sysparm_query': spec["query"],
+        'sysparm_limit': spec.get("limit", FAST_PATH_DEFAULT_ROWS),
+        'sysparm_display_value': 'true',
+        'sysparm_exclude_reference_link': 'true'
+    }
+    if fields:
+        params['sysparm_fields'] = fields
+    response = get_client(instance_url).get(f"/api/now/table/{spec['table']}", params=params)
+    if response.status_code != 200:
+        raise ServiceNowError(response.status_code, response.text[:500])
+    rows = response.json().get('result', [])
+    total = response.headers.get('X-Total-Count') if spec.get("with_total", True) else None
+    return f"{spec['title']}:\n" + format_records(rows, fields, int(total) if total else None, max_chars=FAST_PATH_MAX_CHARS)
+
+_counts = {}
+_counts_lock = threading.Lock()
+
+def _count(route):
+    with _counts_lock:
+        _counts[route] = _counts.get(route, 0) + 1
+    admin_commands.inc(route=route)
+
+def run_fast_path(command, instance_url):
+    """
+    Answers command with a direct query when it matches a route.
+    Returns (route name, result text), or None to hand it to the agent,
+    including when the query itself fails.
+    """
+    found = match_command(command) if FAST_PATH_ENABLED else None
+    if found is None:
+        _count("agent")
+        return None
+    name, spec = found
+    try:
+        result = _run_query(instance_url, spec)
+    except Exception as e:
+        _count("failed")
+        log("fast_path_failed", level="warning", route=name, instance=instance_url, table=spec["table"], error=str(e))
+        return None
+    _count(name)
+    log("fast_path", route=name, instance=instance_url, table=spec["table"])
+    return name, result
+
+def fast_path_stats():
+    """
+    Commands seen, the share answered without the agent, hits per route, and
+    matched commands whose query failed and went to the agent instead.
+    """
+    with _counts_lock:
+        counts = dict(_counts)
+    total = sum(counts.values())
+    matched = total - counts.get("agent", 0) - counts.get("failed", 0)
+    return {
+        "enabled": FAST_PATH_ENABLED,
+        "commands": total,
+        "matched": matched,
+        "failed": counts.get("failed", 0),
+        "hit_rate": round(matched / total, 3) if total else None,
+        "routes": {
+            name: {"hits": counts.get(name, 0), "hit_rate": round(counts.get(name, 0) / total, 3) if total else None}
+            for name, _ in ROUTES
+        },
+    }
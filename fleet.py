@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from servicenow_tools import run_count_queries, INSTANCE_STAT_QUERIES, SECURITY_STAT_QUERIES, INTEGRATION_STAT_QUERIES
+
+# --- CONFIGURATION ---
+# JSON file of named instance groups: {"prod": ["https://a.service-now.com", ...], ...}
+FLEET_FILE = os.getenv("SN_FLEET_FILE", "fleet.json")
+# Instances queried at once across all fleet requests (the global cap)
+FLEET_MAX_WORKERS = int(os.getenv("SN_FLEET_MAX_WORKERS", "8"))
+# Count queries in flight per instance, so upstream load is at most
+# FLEET_MAX_WORKERS * FLEET_QUERY_WORKERS requests
+FLEET_QUERY_WORKERS = int(os.getenv("SN_FLEET_QUERY_WORKERS", "3"))
+FLEET_INSTANCE_TIMEOUT = float(os.getenv("SN_FLEET_INSTANCE_TIMEOUT", "10"))
+# An instance that failed entirely is skipped for this long instead of tying up a worker
+FLEET_DOWN_BACKOFF = float(os.getenv("SN_FLEET_DOWN_BACKOFF", "60"))
+FLEET_MAX_INSTANCES = 200
+
+FLEET_SECTIONS = {
+    "stats": INSTANCE_STAT_QUERIES,
+    "security": SECURITY_STAT_QUERIES,
+    "integration": INTEGRATION_STAT_QUERIES,
+}
+
+fleet_pool = ThreadPoolExecutor(max_workers=FLEET_MAX_WORKERS, thread_name_prefix="fleet")
+_down = {}  # instance url -> (time it failed, message)
+_down_lock = threading.Lock()
+_inflight = {}  # (instance url, queries) -> (future, clock), shared by concurrent fleet requests
+_inflight_lock = threading.Lock()
+
+def load_groups(path=FLEET_FILE):
+    """
+    Returns the named instance groups, or {} when there is no fleet file.
+    """
+    try:
+        with open(path) as f:
+            groups = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(groups, dict) or not all(isinstance(urls, list) for urls in groups.values()):
+        raise ValueError(f"{path} must map group names to lists of instance URLs")
+    return groups
+
+def resolve_instances(group=None, instances=None):
+    """
+    Instance URLs for a group name and/or a comma-separated list, de-duplicated in order.
+    """
+    urls = []
+    if group:
+        groups = load_groups()
+        if group not in groups:
+            raise ValueError(f"Unknown group '{group}'. Known groups: {', '.join(groups) or 'none'}")
+        urls.extend(groups[group])
+    if instances:
+        urls.extend(u.strip() for u in instances.split(',') if u.strip())
+    urls = list(dict.fromkeys(u.rstrip('/') for u in urls))
+    if not urls:
+        raise ValueError("Provide a group or a list of instances")
+    if len(urls) > FLEET_MAX_INSTANCES:
+        raise ValueError(f"Too many instances ({len(urls)}); the limit is {FLEET_MAX_INSTANCES}")
+    return urls
+
+def _query_instance(url, queries, cache, clock):
+    clock["started"] = time.monotonic()
+    result = run_count_queries(url, queries, max_workers=FLEET_QUERY_WORKERS, timeout=FLEET_INSTANCE_TIMEOUT,
+                               cache=cache, total_timeout=FLEET_INSTANCE_TIMEOUT)
+    errors = result["errors"]
+    if errors and len(errors) == len(queries):
+        # Nothing came back at all: treat the instance as down for a while
+        _mark_down(url, next(iter(errors.values())))
+    else:
+        with _down_lock:
+            _down.pop(url, None)
+    return result
+
+def _submit(url, queries, cache):
+    """
+    Queues the count queries for url, or joins the run already in flight for
+    the same instance and queries. Returns (future, clock); clock gets
+    "started" once a worker picks the run up.
+    """
+    key = (url, tuple(sorted(queries.items())))
+    with _inflight_lock:
+        running = _inflight.get(key)
+        if running is not None:
+            return running
+        clock = {}
+        future = fleet_pool.submit(_query_instance, url, queries, cache, clock)
+        _inflight[key] = (future, clock)
+    future.add_done_callback(lambda f: _finished(key, f))
+    return future, clock
+
+def _finished(key, future):
+    with _inflight_lock:
+        if _inflight.get(key, (None,))[0] is future:
+            del _inflight[key]
+
+def _mark_down(url, message):
+    with _down_lock:
+        _down[url] = (time.time(), message)
+
+def _recently_down(url):
+    with _down_lock:
+        failed = _down.get(url)
+    if failed and time.time() - failed[0] < FLEET_DOWN_BACKOFF:
+        return failed[1]
+    return None
+
+def fleet_stats(urls, sections=None, cache=None):
+    """
+    Runs the chosen sections' count queries on every instance in parallel and
+    returns one table: {"columns", "rows", "errors", "elapsed_ms"}. Each row is
+    [instance, status, metric values...]. An instance that fails, times out or
+    was down recently gets status 'error' / 'timeout' / 'down' and null values,
+    and does not delay the others beyond FLEET_INSTANCE_TIMEOUT.
+    """
+    sections = sections or list(FLEET_SECTIONS)
+    unknown = [s for s in sections if s not in FLEET_SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown section(s) {', '.join(unknown)}. Expected: {', '.join(FLEET_SECTIONS)}")
+    queries = {}
+    for section in sections:
+        queries.update(FLEET_SECTIONS[section])
+    metrics = list(queries)
+
+    started = time.monotonic()
+    futures = {}
+    clocks = {}
+    outcomes = {}
+    for url in urls:
+        down = _recently_down(url)
+        if down:
+            outcomes[url] = ("down", None, down)
+        else:
+            future, clocks[url] = _submit(url, queries, cache)
+            futures[future] = url
+
+    # Each instance's timeout runs from when a worker picks it up, so waiting
+    # in line behind the global cap doesn't count against it.
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        deadlines = {f: clocks[futures[f]]["started"] + FLEET_INSTANCE_TIMEOUT for f in pending if "started" in clocks[futures[f]]}
+        expired = {f for f, deadline in deadlines.items() if deadline <= now}
+        for future in expired:
+            message = f"No response within {FLEET_INSTANCE_TIMEOUT:g}s"
+            outcomes[futures[future]] = ("timeout", None, message)
+            _mark_down(futures[future], message)
+        pending -= expired
+        if not pending:
+            break
+        remaining = [deadlines[f] - now for f in pending if f in deadlines]
+        if len(remaining) < len(pending):
+            # Some are still queued; check back soon to start their clocks
+            remaining.append(0.1)
+        done, pending = wait(pending, timeout=max(0.0, min(remaining)), return_when=FIRST_COMPLETED)
+        for future in done:
+            url = futures[future]
+            try:
+                result = future.result()
+                failed = result["errors"]
+                status = "ok" if not failed else ("error" if len(failed) == len(queries) else "partial")
+                outcomes[url] = (status, result, "; ".join(f"{m}: {e}" for m, e in failed.items()) or None)
+            except Exception as e:
+                outcomes[url] = ("error", None, str(e))
+
+    rows = []
+    errors = {}
+    for url in urls:
+        status, result, error = outcomes[url]
+        rows.append([url, status] + [result.get(m) if result else None for m in metrics])
+        if error:
+            errors[url] = error
+    return {
+        "columns": ["instance", "status"] + metrics,
+        "rows": rows,
+        "errors": errors,
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+    }
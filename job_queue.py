@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CONFIGURATION ---
+JOB_WORKERS = int(os.getenv("SN_JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.getenv("SN_JOB_MAX_PENDING", "20"))
+JOB_TIMEOUT = float(os.getenv("SN_JOB_TIMEOUT", "300"))
+# Finished jobs kept around for polling
+JOB_HISTORY = int(os.getenv("SN_JOB_HISTORY", "200"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+class JobQueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, kind, fn, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.dedupe_key = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        now = time.time()
+        queue_end = self.started_at or self.finished_at or now
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_ms": round((queue_end - self.submitted_at) * 1000, 1),
+            "run_ms": round(((self.finished_at or now) - self.started_at) * 1000, 1) if self.started_at else None,
+        }
+
+class JobQueue:
+    """
+    Bounded worker pool for slow agent runs (CrewAI kickoffs), so they never
+    hold a Flask request thread. submit() returns immediately with a job id.
+    A running job can't be interrupted: cancelling or timing it out marks it
+    finished and discards its result when the worker returns.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, timeout=JOB_TIMEOUT, history=JOB_HISTORY):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.history = history
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._run_ms = []
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, kind, fn, *args, dedupe_key=None, **kwargs):
+        """
+        Queues fn(*args, **kwargs). With a dedupe_key, an unfinished job with the
+        same key is returned instead of queueing a duplicate.
+        """
+        with self._lock:
+            self._expire()
+            if dedupe_key is not None:
+                for job in self._jobs.values():
+                    if job.dedupe_key == dedupe_key and job.status not in FINISHED:
+                        return job.to_dict()
+            if self._count(QUEUED) >= self.max_pending:
+                raise JobQueueFull(f"Job queue is full ({self.max_pending} pending). Try again shortly.")
+            job = Job(kind, fn, args, kwargs)
+            job.dedupe_key = dedupe_key
+            self._jobs[job.id] = job
+            self._trim()
+        job.future = self._pool.submit(self._run, job)
+        return job.to_dict()
+
+    def get(self, job_id, wait=0):
+        """
+        Returns the job as a dict, or None. With wait > 0, blocks up to that
+        many seconds for the job to finish (long polling).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if wait > 0:
+            job.done.wait(timeout=min(wait, self.timeout))
+        with self._lock:
+            self._expire()
+            return job.to_dict()
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in FINISHED:
+                if job.future is not None:
+                    job.future.cancel()
+                self._finish(job, CANCELLED, error="Cancelled by user")
+            return job.to_dict()
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            run_ms = sorted(self._run_ms)
+            return {
+                "workers": self.workers,
+                "queued": self._count(QUEUED),
+                "running": self._count(RUNNING),
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_run_ms": round(sum(run_ms) / len(run_ms), 1) if run_ms else None,
+                "p95_run_ms": round(run_ms[int(len(run_ms) * 0.95)], 1) if run_ms else None,
+            }
+
+    def _run(self, job):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            result = job.fn(*job.args, **job.kwargs)
+            with self._lock:
+                if job.status == RUNNING:
+                    job.result = result
+                    self._finish(job, SUCCEEDED)
+        except Exception as e:
+            with self._lock:
+                if job.status == RUNNING:
+                    self._finish(job, FAILED, error=str(e))
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        if job.started_at:
+            self._run_ms.append((job.finished_at - job.started_at) * 1000)
+            self._run_ms = self._run_ms[-self.history:]
+        if status == SUCCEEDED:
+            self.completed += 1
+        elif status in (FAILED, TIMED_OUT):
+            self.failed += 1
+        job.done.set()
+
+    def _expire(self):
+        now = time.time()
+        for job in self._jobs.values():
+            if job.status == RUNNING and now - job.started_at > self.timeout:
+                self._finish(job, TIMED_OUT, error=f"Timed out after {self.timeout:g}s")
+
+    def _count(self, status):
+        return sum(1 for job in self._jobs.values() if job.status == status)
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+jobs = JobQueue()
@@ -0,0 +1,175 @@
+import os
+import queue
+import threading
+import time
+
+from servicenow_tools import run_count_queries, INSTANCE_STAT_QUERIES, SECURITY_STAT_QUERIES, INTEGRATION_STAT_QUERIES
+from stats_cache import cache
+from metrics import log
+from rate_limiter import lane, BACKGROUND
+
+# --- CONFIGURATION ---
+# Every metric shown on the Stats and Senior views is streamed.
+LIVE_QUERIES = {**INSTANCE_STAT_QUERIES, **SECURITY_STAT_QUERIES, **INTEGRATION_STAT_QUERIES}
+POLL_MIN_INTERVAL = float(os.getenv("SN_POLL_MIN_INTERVAL", "10"))
+# How long a poller keeps running after its last subscriber disconnects
+POLL_IDLE_GRACE = float(os.getenv("SN_POLL_IDLE_GRACE", "30"))
+SUBSCRIBER_QUEUE_SIZE = 100
+
+class StatsPoller:
+    """
+    Background poller for one instance URL, shared by every subscriber.
+    Each metric is refreshed on its own interval (its cache TTL) and only
+    values that changed since the last poll are pushed to subscribers, so
+    upstream load does not grow with the number of viewers.
+    """
+
+    def __init__(self, instance_url, queries=LIVE_QUERIES):
+        self.instance_url = instance_url
+        self.queries = queries
+        self.values = {}
+        self.errors = {}
+        self.updated_at = None
+        self._next_due = {metric: 0.0 for metric in queries}
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._idle_since = None
+
+    def interval_for(self, metric):
+        return max(POLL_MIN_INTERVAL, cache.ttl_for(metric))
+
+    def subscribe(self):
+        """
+        Returns a queue that receives a 'snapshot' event straight away (once the
+        first poll has finished) followed by 'delta' events.
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+            self._idle_since = None
+            if self.values:
+                q.put_nowait(self._snapshot_event())
+            if self._thread is None:
+                # A poller that went idle may have left the registry; put it back
+                _register_poller(self)
+                self._thread = threading.Thread(target=self._run, name=f"poller-{self.instance_url}", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+            if not self._subscribers:
+                self._idle_since = time.monotonic()
+        self._wake.set()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _snapshot_event(self):
+        return {"type": "snapshot", "values": dict(self.values), "errors": dict(self.errors), "ts": self.updated_at}
+
+    def _publish(self, event):
+        with self._lock:
+            for q in self._subscribers:
+                try:
+                    q.put_nowait(event)
+                except queue.Full:
+                    # Slow client: drop its backlog and resync it with a full snapshot
+                    with q.mutex:
+                        q.queue.clear()
+                    q.put_nowait(self._snapshot_event())
+
+    def _poll(self, metrics):
+        # Due metrics are stale by definition, so read the instance directly
+        # (a cache read would return the old value and refresh it too late)
+        # and pass the new values on to the cache for the REST endpoints.
+        # Polling gives way to interactive calls when the instance is busy.
+        with lane(BACKGROUND):
+            result = run_count_queries(self.instance_url, {m: self.queries[m] for m in metrics})
+        for metric in metrics:
+            if metric not in result["errors"]:
+                table, query = self.queries[metric]
+                cache.put((self.instance_url, table, query), result[metric], cache.ttl_for(metric))
+        changed = {}
+        errors = {}
+        with self._lock:
+            for metric in metrics:
+                error = result["errors"].get(metric)
+                if error is not None:
+                    if self.errors.get(metric) != error:
+                        errors[metric] = error
+                    self.errors[metric] = error
+                    continue
+                recovered = metric in self.errors
+                if recovered:
+                    del self.errors[metric]
+                    errors[metric] = None
+                value = result[metric]
+                if recovered or metric not in self.values or self.values[metric] != value:
+                    changed[metric] = value
+                    self.values[metric] = value
+            self.updated_at = time.time()
+        return changed, errors
+
+    def _run(self):
+        first = True
+        while True:
+            with self._lock:
+                if self._idle_since is not None and time.monotonic() - self._idle_since >= POLL_IDLE_GRACE:
+                    self._thread = None
+                    _release_poller(self)
+                    return
+
+            now = time.monotonic()
+            due = [m for m, at in self._next_due.items() if at <= now]
+            if due:
+                try:
+                    changed, errors = self._poll(due)
+                except Exception as e:
+                    log("poller_failed", level="warning", instance=self.instance_url, error=str(e))
+                    changed, errors = {}, {}
+                finally:
+                    done = time.monotonic()
+                    for metric in due:
+                        self._next_due[metric] = done + self.interval_for(metric)
+                if first:
+                    self._publish(self._snapshot_event())
+                    first = False
+                elif changed or errors:
+                    self._publish({"type": "delta", "values": changed, "errors": errors, "ts": self.updated_at})
+
+            sleep_for = max(0.0, min(self._next_due.values()) - time.monotonic())
+            self._wake.wait(timeout=min(sleep_for, POLL_IDLE_GRACE))
+            self._wake.clear()
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+def get_poller(instance_url):
+    """
+    Returns the shared StatsPoller for instance_url, creating it on first use.
+    """
+    key = instance_url.rstrip('/')
+    with _pollers_lock:
+        poller = _pollers.get(key)
+        if poller is None:
+            poller = _pollers[key] = StatsPoller(key)
+        return poller
+
+def _register_poller(poller):
+    with _pollers_lock:
+        _pollers.setdefault(poller.instance_url, poller)
+
+def _release_poller(poller):
+    with _pollers_lock:
+        if _pollers.get(poller.instance_url) is poller:
+            del _pollers[poller.instance_url]
+
+def poller_stats():
+    with _pollers_lock:
+        pollers = list(_pollers.items())
+    return {url: {"subscribers": p.subscriber_count(), "metrics": len(p.values)} for url, p in pollers}
@@ -0,0 +1,188 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# --- CONFIGURATION ---
+# Fraction of routine log events written; warnings, errors and slow calls are always written
+LOG_SAMPLE_RATE = float(os.getenv("SN_LOG_SAMPLE_RATE", "0.1"))
+# Calls slower than this (seconds) are always logged
+LOG_SLOW_SECONDS = float(os.getenv("SN_LOG_SLOW_SECONDS", "2"))
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.type = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.type = "histogram"
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            items = [(dict(key), list(counts)) for key, counts in self._values.items()]
+        for labels, counts in items:
+            for bound, count in zip(self.buckets, counts):
+                out.append((f"{self.name}_bucket", {**labels, "le": f"{bound:g}"}, count))
+            out.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, counts[-1]))
+            out.append((f"{self.name}_sum", labels, round(counts[-2], 6)))
+            out.append((f"{self.name}_count", labels, counts[-1]))
+        return out
+
+class Collected:
+    """
+    Values read from fn() at scrape time, for state another module already
+    keeps (cache sizes, buffers, pools). fn returns [(labels, value), ...].
+    """
+
+    def __init__(self, name, help_text, fn, type="gauge"):
+        self.name = name
+        self.help = help_text
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        try:
+            return [(self.name, labels, value) for labels, value in self.fn()]
+        except Exception as e:
+            log("metric_collect_failed", level="error", metric=self.name, error=str(e))
+            return []
+
+# --- METRICS ---
+upstream_seconds = Histogram("snowagent_upstream_request_seconds", "ServiceNow HTTP call latency")
+upstream_requests = Counter("snowagent_upstream_requests_total", "ServiceNow HTTP calls by status")
+upstream_bytes = Counter("snowagent_upstream_response_bytes_total", "ServiceNow response body bytes")
+upstream_retries = Counter("snowagent_upstream_retries_total", "ServiceNow HTTP retries made by the client")
+route_seconds = Histogram("snowagent_http_request_seconds", "Flask route latency (time to response headers)")
+route_requests = Counter("snowagent_http_requests_total", "Flask requests by status")
+crew_seconds = Histogram("snowagent_crew_kickoff_seconds", "CrewAI kickoff duration")
+crew_runs = Counter("snowagent_crew_kickoffs_total", "CrewAI kickoffs by outcome")
+rate_limit_wait = Histogram("snowagent_rate_limit_wait_seconds", "Time calls waited for the per-instance rate limiter, by lane")
+throttled_responses = Counter("snowagent_throttled_responses_total", "429 responses from ServiceNow")
+admin_commands = Counter("snowagent_admin_commands_total", "Admin commands by fast-path route (route=agent: handed to the crew)")
+coalesced_requests = Counter("snowagent_coalesced_requests_total", "Read calls by single-flight role (leader = sent upstream, shared = joined one in flight)")
+
+REGISTRY = [upstream_seconds, upstream_requests, upstream_bytes, upstream_retries,
+            route_seconds, route_requests, crew_seconds, crew_runs, coalesced_requests,
+            rate_limit_wait, throttled_responses, admin_commands]
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+# (endpoint, table) from a ServiceNow API path
+_PATH_RE = re.compile(r'/api/now/(?:v\d+/)?(table|stats|batch)(?:/([^/?]+))?')
+
+def split_path(path):
+    match = _PATH_RE.search(path or '')
+    if not match:
+        return "other", ""
+    return match.group(1), match.group(2) or ""
+
+def _retries(response):
+    try:
+        return len(response.raw.retries.history)
+    except AttributeError:
+        return 0
+
+def observe_upstream(method, path, seconds, response=None, error=None):
+    """
+    Records one ServiceNow HTTP call (after the client's own retries).
+    """
+    endpoint, table = split_path(path)
+    status = str(response.status_code) if response is not None else "error"
+    upstream_seconds.observe(seconds, endpoint=endpoint, table=table, method=method)
+    upstream_requests.inc(endpoint=endpoint, table=table, method=method, status=status)
+    if response is not None:
+        upstream_bytes.inc(len(response.content or b''), endpoint=endpoint, table=table)
+        retries = _retries(response)
+        if retries:
+            upstream_retries.inc(retries, endpoint=endpoint, table=table)
+    failed = error is not None or (response is not None and response.status_code >= 400)
+    log("upstream", level="warning" if failed else "info", slow=seconds >= LOG_SLOW_SECONDS,
+        method=method, endpoint=endpoint, table=table, status=status,
+        ms=round(seconds * 1000, 1), error=str(error) if error else None)
+
+@contextmanager
+def timed_kickoff(kind):
+    """
+    Times a crew.kickoff() block.
+    """
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        seconds = time.monotonic() - started
+        crew_seconds.observe(seconds, kind=kind)
+        crew_runs.inc(kind=kind, outcome=outcome)
+        log("crew_kickoff", level="info" if outcome == "ok" else "warning", slow=True,
+            kind=kind, outcome=outcome, ms=round(seconds * 1000, 1))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# --- LOGGING ---
+def log(event, level="info", slow=False, **fields):
+    """
+    Writes one JSON log line to stderr. Routine info events are sampled at
+    LOG_SAMPLE_RATE; warnings, errors and slow events are always written.
+    Fields that are None are left out.
+    """
+    if level == "info" and not slow and random.random() >= LOG_SAMPLE_RATE:
+        return
+    record = {"ts": round(time.time(), 3), "level": level, "event": event}
+    record.update((k, v) for k, v in fields.items() if v is not None)
+    if level == "info" and not slow:
+        record["sample_rate"] = LOG_SAMPLE_RATE
+    print(json.dumps(record, default=str), file=sys.stderr, flush=True)
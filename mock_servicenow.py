@@ -0,0 +1,409 @@
+"""
+Local stand-in for a ServiceNow instance, for benchmarks and offline work.
+
+    python mock_servicenow.py [--port 8090] [--scale 1] [--latency-ms 50] [--error-rate 0.01] [--throttle-rate 0.05]
+
+Serves the Table API (GET/POST/PUT/PATCH with sysparm_query, _fields, _limit,
+_offset, X-Total-Count and Link paging), the Aggregate (Stats) API with
+sysparm_group_by, and the Batch API, over seeded data. Any basic auth is
+accepted. Encoded queries support ^-joined =, !=, >, >=, <, <=, LIKE,
+ISEMPTY, ISNOTEMPTY, ONToday and ORDERBY/ORDERBYDESC; ^OR is not supported.
+
+Injectable profile (flags, or POST /mock/profile with the same keys as JSON):
+  latency_ms / jitter_ms    added to every request
+  slow_tables               {"syslog": 800} extra latency per table
+  error_rate                fraction of requests answered with 500
+  throttle_rate             fraction of requests answered with 429 + Retry-After
+  rps_limit                 requests per second before every request gets 429
+
+GET /mock/stats returns request counts (by API and table); POST /mock/reset clears them.
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+DEFAULT_PROFILE = {
+    "latency_ms": 0.0,
+    "jitter_ms": 0.0,
+    "slow_tables": {},
+    "error_rate": 0.0,
+    "throttle_rate": 0.0,
+    "rps_limit": 0,
+}
+MAX_LIMIT = 10000
+
+# --- SEED DATA ---
+def _ts(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def _sys_id(rng):
+    return '%032x' % rng.getrandbits(128)
+
+def seed(scale=1, seed_value=42):
+    """
+    Deterministic tables sized by scale. About a tenth of the rows with a
+    sys_created_on are created today so the ONToday queries have something to count.
+    """
+    rng = random.Random(seed_value)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    tables = {}
+
+    def created():
+        if rng.random() < 0.1:
+            return _ts(now - timedelta(seconds=rng.randint(0, now.hour * 3600 + now.minute * 60)))
+        return _ts(now - timedelta(days=rng.randint(1, 365), seconds=rng.randint(0, 86400)))
+
+    def rows(table, count, make):
+        out = []
+        for i in range(int(count * scale)):
+            row = make(i)
+            row.setdefault('sys_id', _sys_id(rng))
+            row.setdefault('sys_created_on', created())
+            row.setdefault('sys_updated_on', row['sys_created_on'])
+            out.append(row)
+        tables[table] = out
+
+    rows('sys_user', 500, lambda i: {
+        'user_name': f'user{i}', 'name': f'User {i}', 'email': f'user{i}@example.com',
+        'active': 'true' if rng.random() < 0.9 else 'false', 'department': rng.choice(['IT', 'HR', 'Finance', 'Sales'])})
+    users = [u['sys_id'] for u in tables['sys_user']]
+    rows('sys_user_group', 40, lambda i: {'name': f'Group {i}', 'active': 'true', 'manager': rng.choice(users)})
+    groups = [g['sys_id'] for g in tables['sys_user_group']]
+    rows('incident', 5000, lambda i: {
+        'number': f'INC{i:07d}', 'short_description': rng.choice(['Email down', 'VPN issue', 'Laptop slow', 'Printer jam', 'Server outage']),
+        'active': 'true' if rng.random() < 0.3 else 'false', 'priority': str(rng.randint(1, 5)), 'state': str(rng.choice([1, 2, 3, 6, 7])),
+        'assigned_to': rng.choice(users) if rng.random() < 0.8 else '', 'assignment_group': rng.choice(groups)})
+    rows('problem', 300, lambda i: {
+        'number': f'PRB{i:07d}', 'short_description': 'Recurring outage', 'active': 'true' if rng.random() < 0.4 else 'false',
+        'priority': str(rng.randint(1, 5)), 'state': str(rng.randint(1, 4)), 'assigned_to': rng.choice(users)})
+    rows('change_request', 800, lambda i: {
+        'number': f'CHG{i:07d}', 'short_description': 'Patch servers', 'type': rng.choice(['normal', 'standard', 'emergency']),
+        'active': 'true' if rng.random() < 0.2 else 'false', 'state': str(rng.randint(-5, 3))})
+    rows('sys_trigger', 200, lambda i: {'name': f'Job {i}', 'state': str(rng.choice([0, 0, 0, 1, 3])), 'trigger_type': '0', 'next_action': _ts(now)})
+    rows('sys_script', 400, lambda i: {
+        'name': f'BR {i}', 'collection': rng.choice(['incident', 'problem', 'sys_user']), 'when': rng.choice(['before', 'after', 'async']),
+        'order': '100', 'active': 'true' if rng.random() < 0.85 else 'false', 'action_insert': 'true', 'action_update': 'false'})
+    rows('sys_update_xml', 1000, lambda i: {'name': f'sys_script_{i}', 'type': 'Business Rule', 'target_name': f'BR {i}', 'action': 'INSERT_OR_UPDATE', 'sys_updated_by': 'admin'})
+    rows('syslog', 20000, lambda i: {
+        'level': str(rng.choice([0, 0, 0, 1, 2])), 'source': rng.choice(['Evaluator', 'SCHEDULER', 'REST', 'ACL']),
+        'message': rng.choice([
+            "org.mozilla.javascript.EcmaError: Cannot read property 'sys_id' from null (sys_script.%s; line %d)" % (_sys_id(rng), rng.randint(1, 200)),
+            "Security restricted: Read operation against 'incident' from scope 'x_app' has been refused",
+            "Connection timed out: connect to mid.example.com:443",
+        ])})
+    rows('sysevent', 2000, lambda i: {'name': rng.choice(['login', 'login', 'login.failed', 'incident.updated']), 'parm1': f'user{i % 500}'})
+    rows('sys_user_has_role', 1500, lambda i: {'user': rng.choice(users), 'role': _sys_id(rng), 'role.name': rng.choice(['itil', 'itil', 'admin', 'catalog']), 'state': 'active'})
+    rows('ecc_queue', 1000, lambda i: {'agent': 'mid.server.mid1', 'queue': rng.choice(['input', 'output']), 'state': rng.choice(['processed', 'processed', 'error', 'ready'])})
+    rows('sys_scope', 30, lambda i: {'name': f'App {i}', 'scope': f'x_app_{i}', 'version': f'1.{i}.0'})
+
+    fields = {}
+    for table, table_rows in tables.items():
+        fields[table] = sorted({k for row in table_rows[:50] for k in row if '.' not in k})
+    tables['sys_db_object'] = [
+        {'sys_id': _sys_id(rng), 'name': table, 'label': table.replace('_', ' ').title(),
+         'super_class.name': 'task' if table in ('incident', 'problem', 'change_request') else '', 'sys_updated_on': _ts(now - timedelta(days=30))}
+        for table in list(tables) + ['task']
+    ]
+    tables['sys_dictionary'] = [
+        {'sys_id': _sys_id(rng), 'name': table, 'element': element, 'column_label': element.replace('_', ' ').title(),
+         'internal_type': 'string', 'mandatory': 'false', 'sys_updated_on': _ts(now - timedelta(days=30))}
+        for table, elements in fields.items() for element in elements
+    ]
+    return tables
+
+# --- ENCODED QUERIES ---
+_OPERATORS = ('!=', '>=', '<=', '>', '<', '=')
+
+def _condition(term, today):
+    for suffix, test in (('ISNOTEMPTY', lambda v: v != ''), ('ISEMPTY', lambda v: v == '')):
+        if term.endswith(suffix):
+            field = term[:-len(suffix)]
+            return lambda row: test(str(row.get(field, '')))
+    if 'ONToday' in term:
+        field = term.split('ONToday')[0]
+        return lambda row: str(row.get(field, '')).startswith(today)
+    if 'LIKE' in term:
+        field, value = term.split('LIKE', 1)
+        return lambda row: value.lower() in str(row.get(field, '')).lower()
+    for op in _OPERATORS:
+        if op in term:
+            field, value = term.split(op, 1)
+            compare = {
+                '!=': lambda a, b: a != b, '>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b,
+                '>': lambda a, b: a > b, '<': lambda a, b: a < b, '=': lambda a, b: a == b,
+            }[op]
+            return lambda row: compare(str(row.get(field, '')), value)
+    return lambda row: True
+
+def parse_query(query):
+    """
+    Returns (predicate, [(field, descending)]) for an encoded query.
+    """
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    conditions = []
+    order = []
+    for term in (query or '').split('^'):
+        if not term:
+            continue
+        if term.startswith('ORDERBYDESC'):
+            order.append((term[len('ORDERBYDESC'):], True))
+        elif term.startswith('ORDERBY'):
+            order.append((term[len('ORDERBY'):], False))
+        elif term.lower().startswith('orderbydesc:'):
+            order.append((term.split(':', 1)[1], True))
+        else:
+            conditions.append(_condition(term, today))
+    return (lambda row: all(c(row) for c in conditions)), order
+
+# --- SERVER ---
+class MockInstance:
+    def __init__(self, tables, profile=None):
+        self.tables = tables
+        self.profile = {**DEFAULT_PROFILE, **(profile or {})}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._window = []  # request times for rps_limit
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            total = sum(v for k, v in self.counts.items() if not k.startswith('status:'))
+            return {"total": total, "counts": dict(self.counts)}
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+
+    def gate(self, table):
+        """
+        Applies the latency/error/throttle profile. Returns (status, headers) to
+        short-circuit with, or None to serve the request.
+        """
+        profile = self.profile
+        delay = profile["latency_ms"] + random.uniform(0, profile["jitter_ms"]) + profile["slow_tables"].get(table, 0)
+        if delay:
+            time.sleep(delay / 1000)
+        if profile["rps_limit"]:
+            now = time.monotonic()
+            with self._lock:
+                self._window = [t for t in self._window if now - t < 1.0]
+                over = len(self._window) >= profile["rps_limit"]
+                if not over:
+                    self._window.append(now)
+            if over:
+                return 429, {"Retry-After": "1"}
+        if random.random() < profile["throttle_rate"]:
+            return 429, {"Retry-After": "1"}
+        if random.random() < profile["error_rate"]:
+            return 500, {}
+        return None
+
+    # Table API
+    def table_get(self, table, params, sys_id=None):
+        rows = self.tables.get(table)
+        if rows is None:
+            return 400, {"error": {"message": "Invalid table " + table}}, {}
+        if sys_id:
+            row = next((r for r in rows if r['sys_id'] == sys_id), None)
+            return (200, {"result": self._project(row, params)}, {}) if row else (404, {"error": {"message": "No Record found"}}, {})
+        predicate, order = parse_query(params.get('sysparm_query', ''))
+        matched = [r for r in rows if predicate(r)]
+        for field, descending in reversed(order):
+            matched.sort(key=lambda r: str(r.get(field, '')), reverse=descending)
+        offset = int(params.get('sysparm_offset', 0) or 0)
+        limit = min(int(params.get('sysparm_limit', MAX_LIMIT) or MAX_LIMIT), MAX_LIMIT)
+        page = matched[offset:offset + limit]
+        headers = {"X-Total-Count": str(len(matched))}
+        if offset + limit < len(matched):
+            next_params = {**params, 'sysparm_offset': offset + limit, 'sysparm_limit': limit}
+            headers["Link"] = f'</api/now/table/{table}?{urlencode(next_params)}>;rel="next"'
+        return 200, {"result": [self._project(r, params) for r in page]}, headers
+
+    def _project(self, row, params):
+        fields = params.get('sysparm_fields')
+        if not fields:
+            return {k: v for k, v in row.items() if '.' not in k}
+        return {f: row.get(f, '') for f in fields.split(',')}
+
+    def table_write(self, method, table, sys_id, body):
+        rows = self.tables.get(table)
+        if rows is None:
+            return 400, {"error": {"message": "Invalid table " + table}}, {}
+        if method == 'POST':
+            now = _ts(datetime.now(timezone.utc))
+            row = {**body, 'sys_id': uuid.uuid4().hex, 'sys_created_on': now, 'sys_updated_on': now}
+            with self._lock:
+                rows.append(row)
+            return 201, {"result": row}, {}
+        row = next((r for r in rows if r['sys_id'] == sys_id), None)
+        if row is None:
+            return 404, {"error": {"message": "No Record found"}}, {}
+        with self._lock:
+            row.update(body)
+            row['sys_updated_on'] = _ts(datetime.now(timezone.utc))
+        return 200, {"result": row}, {}
+
+    # Aggregate API
+    def stats_get(self, table, params):
+        rows = self.tables.get(table)
+        if rows is None:
+            return 400, {"error": {"message": "Invalid table " + table}}, {}
+        predicate, _ = parse_query(params.get('sysparm_query', ''))
+        matched = [r for r in rows if predicate(r)]
+        group_by = params.get('sysparm_group_by')
+        if not group_by:
+            return 200, {"result": {"stats": {"count": str(len(matched))}}}, {}
+        groups = {}
+        for row in matched:
+            value = str(row.get(group_by, ''))
+            groups[value] = groups.get(value, 0) + 1
+        return 200, {"result": [
+            {"stats": {"count": str(count)}, "groupby_fields": [{"field": group_by, "value": value}]}
+            for value, count in groups.items()
+        ]}, {}
+
+    def dispatch(self, method, path, params, body):
+        """
+        Routes one API call. Returns (status, body, headers).
+        """
+        parts = [p for p in path.split('/') if p]
+        if parts[:3] == ['api', 'now', 'table'] and len(parts) >= 4:
+            table, sys_id = parts[3], parts[4] if len(parts) > 4 else None
+            self.count(f"table:{table}")
+            gated = self.gate(table)
+            if gated:
+                return gated[0], {"error": {"message": "Simulated failure"}}, gated[1]
+            if method == 'GET':
+                return self.table_get(table, params, sys_id)
+            if method in ('POST', 'PUT', 'PATCH'):
+                return self.table_write(method, table, sys_id, body or {})
+        elif parts[:3] == ['api', 'now', 'stats'] and len(parts) == 4:
+            self.count(f"stats:{parts[3]}")
+            gated = self.gate(parts[3])
+            if gated:
+                return gated[0], {"error": {"message": "Simulated failure"}}, gated[1]
+            return self.stats_get(parts[3], params)
+        elif parts[:4] == ['api', 'now', 'v1', 'batch'] and method == 'POST':
+            self.count("batch")
+            gated = self.gate('batch')
+            if gated:
+                return gated[0], {"error": {"message": "Simulated failure"}}, gated[1]
+            return self.batch(body or {})
+        return 404, {"error": {"message": "Not found"}}, {}
+
+    def batch(self, payload):
+        served = []
+        for sub in payload.get('rest_requests', []):
+            url = urlparse(sub.get('url', ''))
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            body = json.loads(base64.b64decode(sub['body'])) if sub.get('body') else None
+            status, result, _ = self.dispatch(sub.get('method', 'GET'), url.path, params, body)
+            served.append({
+                "id": sub.get('id'),
+                "status_code": status,
+                "body": base64.b64encode(json.dumps(result).encode('utf-8')).decode('ascii'),
+            })
+        return 200, {"batch_request_id": payload.get('batch_request_id'), "serviced_requests": served, "unserviced_requests": []}, {}
+
+def make_handler(instance):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _handle(self, method):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length)) if length else None
+            except ValueError:
+                return self._send(400, {"error": {"message": "Invalid JSON"}})
+
+            if url.path == '/mock/stats':
+                return self._send(200, instance.stats())
+            if url.path == '/mock/reset' and method == 'POST':
+                instance.reset()
+                return self._send(200, instance.stats())
+            if url.path == '/mock/profile':
+                if method == 'POST':
+                    instance.profile = {**DEFAULT_PROFILE, **(body or {})}
+                return self._send(200, instance.profile)
+
+            status, result, headers = instance.dispatch(method, url.path, params, body)
+            instance.count(f"status:{status}")
+            self._send(status, result, headers)
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PUT(self):
+            self._handle('PUT')
+
+        def do_PATCH(self):
+            self._handle('PATCH')
+
+    return Handler
+
+def start(port=0, scale=1, profile=None, seed_value=42):
+    """
+    Starts a mock instance on a background thread. Returns (server, instance, base_url).
+    Port 0 picks a free port.
+    """
+    instance = MockInstance(seed(scale, seed_value), profile)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(instance))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-servicenow", daemon=True).start()
+    return server, instance, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--rps-limit", type=int, default=0)
+    parser.add_argument("--slow-table", action="append", default=[], metavar="TABLE=MS")
+    args = parser.parse_args()
+
+    profile = {
+        "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate, "rps_limit": args.rps_limit,
+        "slow_tables": {t: float(ms) for t, ms in (s.split('=', 1) for s in args.slow_table)},
+    }
+    server, instance, url = start(args.port, args.scale, profile, args.seed)
+    print(f"Mock ServiceNow at {url} ({sum(len(r) for r in instance.tables.values())} rows). Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from metrics import rate_limit_wait, throttled_responses, log
+
+# --- CONFIGURATION ---
+# Requests per second sent to one instance, and how many can go at once after a quiet spell
+RATE_LIMIT = float(os.getenv("SN_RATE_LIMIT", "20"))
+RATE_BURST = float(os.getenv("SN_RATE_BURST", "20"))
+# Share of the burst that background calls leave for interactive ones
+RATE_INTERACTIVE_RESERVE = float(os.getenv("SN_RATE_INTERACTIVE_RESERVE", "0.25"))
+# Longest an interactive / background call waits for its turn before failing
+RATE_MAX_WAIT = float(os.getenv("SN_RATE_MAX_WAIT", "10"))
+RATE_BACKGROUND_MAX_WAIT = float(os.getenv("SN_RATE_BACKGROUND_MAX_WAIT", "60"))
+# Slowest rate a throttled instance is backed off to
+RATE_MIN = 0.5
+# Pause after a 429 that carries no Retry-After
+DEFAULT_RETRY_AFTER = 1.0
+MAX_SLEEP = 0.25
+
+# --- LANES ---
+# Calls are interactive unless made inside lane(BACKGROUND): an agent tool or
+# a /records drill-down never queues behind stats polling.
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+_lane = contextvars.ContextVar("sn_lane", default=INTERACTIVE)
+
+def current_lane():
+    return _lane.get()
+
+@contextmanager
+def lane(name):
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def carry_lane(fn):
+    """
+    Wraps fn to run in the caller's lane, for work handed to a thread pool
+    (pool threads don't inherit context variables).
+    """
+    name = current_lane()
+    def run(*args, **kwargs):
+        with lane(name):
+            return fn(*args, **kwargs)
+    return run
+
+class RateLimited(Exception):
+    """
+    Raised when a call would have to wait longer than its lane allows.
+    """
+
+    def __init__(self, instance_url, retry_after):
+        super().__init__(f"ServiceNow is rate limiting {instance_url}; try again in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def parse_retry_after(value, now=None):
+    """
+    Seconds to wait from a Retry-After header (delay-seconds or HTTP date), or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - (now or time.time()))
+    except (TypeError, ValueError):
+        return None
+
+class InstanceLimiter:
+    """
+    Token bucket for one instance. The rate halves on every 429 and the
+    bucket is closed until Retry-After has passed; successful calls win the
+    configured rate back gradually. Background calls wait while any
+    interactive call is waiting and never spend the last
+    RATE_INTERACTIVE_RESERVE of the bucket.
+    """
+
+    def __init__(self, instance_url, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.instance_url = instance_url
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.reserve = burst * RATE_INTERACTIVE_RESERVE
+        self.tokens = burst
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._interactive_waiting = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, lane_name):
+        """
+        Takes a token if lane_name may have one now. Returns 0, or the
+        seconds until it is worth trying again. Caller holds the lock.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        floor = 1.0
+        if lane_name == BACKGROUND:
+            if self._interactive_waiting:
+                return 1.0 / self.rate
+            floor += self.reserve
+        if self.tokens >= floor:
+            self.tokens -= 1
+            return 0.0
+        return (floor - self.tokens) / self.rate
+
+    def _max_wait(self, lane_name):
+        return RATE_BACKGROUND_MAX_WAIT if lane_name == BACKGROUND else RATE_MAX_WAIT
+
+    def _too_long(self, lane_name, deadline):
+        remaining = self.blocked_until - time.monotonic()
+        # Retry-After already says the wait is longer than this lane allows
+        if remaining > deadline - time.monotonic():
+            raise RateLimited(self.instance_url, remaining)
+        if time.monotonic() >= deadline:
+            raise RateLimited(self.instance_url, self._max_wait(lane_name))
+
+    def acquire(self, lane_name=None):
+        """
+        Blocks until the call may be sent. Returns the seconds waited.
+        """
+        lane_name = lane_name or current_lane()
+        started = time.monotonic()
+        deadline = started + self._max_wait(lane_name)
+        waiting = False
+        try:
+            while True:
+                with self._lock:
+                    delay = self._take(lane_name)
+                    if delay and not waiting and lane_name == INTERACTIVE:
+                        self._interactive_waiting += 1
+                        waiting = True
+                if not delay:
+                    return self._waited(lane_name, started)
+                self._too_long(lane_name, deadline)
+                time.sleep(min(delay, MAX_SLEEP))
+        finally:
+            if waiting:
+                with self._lock:
+                    self._interactive_waiting -= 1
+
+    async def acquire_async(self, lane_name=None):
+        """
+        acquire() for the event loop.
+        """
+        lane_name = lane_name or current_lane()
+        started = time.monotonic()
+        deadline = started + self._max_wait(lane_name)
+        waiting = False
+        try:
+            while True:
+                with self._lock:
+                    delay = self._take(lane_name)
+                    if delay and not waiting and lane_name == INTERACTIVE:
+                        self._interactive_waiting += 1
+                        waiting = True
+                if not delay:
+                    return self._waited(lane_name, started)
+                self._too_long(lane_name, deadline)
+                await asyncio.sleep(min(delay, MAX_SLEEP))
+        finally:
+            if waiting:
+                with self._lock:
+                    self._interactive_waiting -= 1
+
+    def _waited(self, lane_name, started):
+        waited = time.monotonic() - started
+        rate_limit_wait.observe(waited, lane=lane_name)
+        return waited
+
+    def observe(self, status_code, headers):
+        """
+        Adjusts the rate from a response: 429 backs off and honours
+        Retry-After, anything else recovers a little of the configured rate.
+        """
+        if status_code == 429:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            if retry_after is None:
+                retry_after = DEFAULT_RETRY_AFTER
+            with self._lock:
+                self.rate = max(RATE_MIN, self.rate / 2)
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                self.tokens = 0.0
+                self.throttled += 1
+            throttled_responses.inc(instance=self.instance_url)
+            log("rate_limited", level="warning", instance=self.instance_url, retry_after=retry_after, rate=round(self.rate, 2))
+            return
+        # ServiceNow rate limit rules report the remaining quota and when it resets
+        if headers.get('X-RateLimit-Remaining') == '0' and headers.get('X-RateLimit-Reset'):
+            try:
+                reset_in = float(headers['X-RateLimit-Reset']) - time.time()
+            except ValueError:
+                reset_in = 0
+            if reset_in > 0:
+                with self._lock:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + reset_in)
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                "rate": round(self.rate, 2),
+                "max_rate": self.max_rate,
+                "tokens": round(self.tokens, 1),
+                "blocked_for": round(max(0.0, self.blocked_until - now), 1),
+                "interactive_waiting": self._interactive_waiting,
+                "throttled": self.throttled,
+            }
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(instance_url):
+    """
+    Returns the shared InstanceLimiter for instance_url, creating it on first use.
+    """
+    key = instance_url.rstrip('/')
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = InstanceLimiter(key)
+        return limiter
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.items())
+    return {url: limiter.stats() for url, limiter in limiters}
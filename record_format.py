@@ -0,0 +1,68 @@
+# Plain-text record tables shared by the agent tools and the admin fast path.
+# Kept free of crewai so the fast path can use it without loading the agent stack.
+
+# --- QUERY OUTPUT ---
+# Columns returned when the agent doesn't ask for specific fields
+DEFAULT_FIELDS = {
+    'incident': 'number,short_description,priority,state,assigned_to,assignment_group,sys_id',
+    'problem': 'number,short_description,priority,state,assigned_to,sys_id',
+    'change_request': 'number,short_description,type,state,start_date,end_date,sys_id',
+    'sc_req_item': 'number,short_description,cat_item,state,requested_for,sys_id',
+    'sys_user': 'user_name,name,email,active,department,sys_id',
+    'sys_user_group': 'name,manager,active,email,sys_id',
+    'sys_user_has_role': 'user,role,state,sys_id',
+    'sys_script': 'name,collection,when,order,active,action_insert,action_update,sys_id',
+    'sys_script_client': 'name,table,type,active,ui_type,sys_id',
+    'sys_script_include': 'name,api_name,active,client_callable,sys_id',
+    'sys_scope': 'name,scope,version,sys_updated_on,sys_id',
+    'sys_trigger': 'name,next_action,state,trigger_type,sys_id',
+    'syslog': 'sys_created_on,level,source,message,sys_id',
+    'sys_update_xml': 'name,type,target_name,action,sys_updated_by,sys_id',
+    'sys_db_object': 'name,label,super_class,sys_id',
+    'sys_dictionary': 'name,element,column_label,internal_type,mandatory,sys_id',
+}
+FIELD_MAX_CHARS = 80
+OUTPUT_MAX_CHARS = 2500
+
+def _cell(value):
+    if isinstance(value, dict):
+        value = value.get('display_value', value.get('value', ''))
+    text = " ".join(str(value if value is not None else '').split()).replace('|', '/')
+    return text if len(text) <= FIELD_MAX_CHARS else text[:FIELD_MAX_CHARS - 3] + '...'
+
+def format_records(rows, fields=None, total=None, max_chars=OUTPUT_MAX_CHARS):
+    """
+    Compact tabular encoding of records for the agent's context: one header
+    line, one ' | '-separated line per row, values truncated per field, and a
+    hard cap (max_chars) on total size. Without fields, columns that are empty
+    in every row (and sys_ columns other than sys_id) are dropped.
+    """
+    if not rows:
+        return "No records found."
+    if fields:
+        columns = [f.strip() for f in fields.split(',') if f.strip()]
+    else:
+        columns = []
+        for row in rows:
+            for key, value in row.items():
+                if key not in columns and _cell(value) and (not key.startswith('sys_') or key == 'sys_id'):
+                    columns.append(key)
+
+    lines = [" | ".join(columns)]
+    size = len(lines[0])
+    shown = 0
+    for row in rows:
+        line = " | ".join(_cell(row.get(c, '')) for c in columns)
+        # Leave room for the footer line
+        if size + len(line) + 1 > max_chars - 80:
+            break
+        lines.append(line)
+        size += len(line) + 1
+        shown += 1
+
+    total = total if total is not None else len(rows)
+    if shown < total:
+        lines.append(f"(showing {shown} of {total} rows; narrow the query or fields to see more)")
+    else:
+        lines.append(f"({total} rows)")
+    return "\n".join(lines)
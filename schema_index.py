@@ -0,0 +1,239 @@
+import bisect
+import difflib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from servicenow_tools import iter_records, CACHE_DIR
+from metrics import log
+from rate_limiter import lane, BACKGROUND
+
+# --- CONFIGURATION ---
+SCHEMA_REFRESH_INTERVAL = float(os.getenv("SN_SCHEMA_REFRESH_INTERVAL", "3600"))
+SCHEMA_PAGE_SIZE = 2000
+
+TABLE_FIELDS = 'name,label,super_class.name,sys_updated_on'
+DICTIONARY_FIELDS = 'name,element,column_label,internal_type,mandatory,sys_updated_on'
+
+class SchemaIndex:
+    """
+    Local copy of sys_db_object and sys_dictionary for one instance.
+    Built in bulk once, then refreshed incrementally by sys_updated_on and
+    kept on disk, so table/field lookups never need a round trip. Records
+    deleted upstream are only dropped by a full rebuild().
+    """
+
+    def __init__(self, instance_url, path=None):
+        self.instance_url = instance_url
+        host = urlparse(instance_url).netloc or instance_url
+        self.path = path or os.path.join(CACHE_DIR, "schema", f"{host}.json")
+        self.tables = {}    # name -> {"label", "super_class"}
+        self.fields = {}    # table -> {element: {"label", "type", "mandatory"}}
+        self.watermark = ""  # highest sys_updated_on seen, 'YYYY-MM-DD HH:MM:SS'
+        self.refreshed_at = 0.0
+        self.refreshing = False
+        self._lock = threading.RLock()
+        self._names = []
+        self._table_keys = []
+        self._table_details = {}
+        self._sorted_lower = []
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self.tables = data.get("tables", {})
+            self.fields = data.get("fields", {})
+            self.watermark = data.get("watermark", "")
+            self.refreshed_at = data.get("refreshed_at", 0.0)
+            self._reindex()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            data = {"tables": self.tables, "fields": self.fields, "watermark": self.watermark, "refreshed_at": self.refreshed_at}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def is_loaded(self):
+        return bool(self.tables)
+
+    def is_stale(self):
+        return time.time() - self.refreshed_at > SCHEMA_REFRESH_INTERVAL
+
+    def rebuild(self):
+        """
+        Downloads the full table and dictionary metadata.
+        """
+        self._fetch("", replace=True)
+        log("schema_index_built", slow=True, instance=self.instance_url, tables=len(self.tables), fields=sum(len(f) for f in self.fields.values()))
+
+    def refresh(self):
+        """
+        Fetches only metadata updated since the last build/refresh.
+        """
+        if not self.watermark:
+            return self.rebuild()
+        # >= so rows updated in the same second as the watermark aren't missed;
+        # re-applying an already seen row is harmless.
+        self._fetch(f"sys_updated_on>={self.watermark}")
+
+    def _fetch(self, since_query, replace=False):
+        order = "ORDERBYsys_updated_on"
+        query = f"{since_query}^{order}" if since_query else order
+        watermark = "" if replace else self.watermark
+
+        tables = {}
+        for row in iter_records(self.instance_url, 'sys_db_object', query, TABLE_FIELDS, page_size=SCHEMA_PAGE_SIZE):
+            tables[row.get('name')] = {"label": row.get('label', ''), "super_class": row.get('super_class.name', '')}
+            watermark = max(watermark, row.get('sys_updated_on', ''))
+
+        fields = {}
+        dictionary_query = f"elementISNOTEMPTY^{query}"
+        for row in iter_records(self.instance_url, 'sys_dictionary', dictionary_query, DICTIONARY_FIELDS, page_size=SCHEMA_PAGE_SIZE):
+            fields.setdefault(row.get('name'), {})[row.get('element')] = {
+                "label": row.get('column_label', ''),
+                "type": row.get('internal_type', ''),
+                "mandatory": row.get('mandatory') == 'true',
+            }
+            watermark = max(watermark, row.get('sys_updated_on', ''))
+
+        with self._lock:
+            if replace:
+                self.tables, self.fields = {}, {}
+            self.tables.update(tables)
+            for table, elements in fields.items():
+                self.fields.setdefault(table, {}).update(elements)
+            self.watermark = watermark
+            self.refreshed_at = time.time()
+            self._reindex()
+        self.save()
+
+    def _reindex(self):
+        self._names = sorted(self.tables)
+        # Pre-lowered search keys so lookups are a single pass over tuples
+        self._table_keys = [(name, name.lower(), (self.tables[name]["label"] or '').lower()) for name in self._names]
+        self._table_details = {name: (meta["label"], meta["super_class"]) for name, meta in self.tables.items()}
+        self._sorted_lower = sorted((name.lower(), name) for name in self.tables)
+
+    def table_fields(self, table):
+        """
+        Fields of table including those inherited from its parent tables.
+        """
+        with self._lock:
+            merged = {}
+            seen = set()
+            while table and table not in seen:
+                seen.add(table)
+                for element, meta in self.fields.get(table, {}).items():
+                    merged.setdefault(element, meta)
+                table = self.tables.get(table, {}).get("super_class")
+            return merged
+
+    def lookup(self, term, table=None, limit=10):
+        """
+        Fuzzy search for tables (or fields of table) by name or label.
+        Returns a list of (name, label, detail) tuples, best match first.
+        """
+        term = term.strip().lower()
+        if not term:
+            return []
+        with self._lock:
+            if not table:
+                # Fast path: exact and prefix hits on table names via binary search
+                start = bisect.bisect_left(self._sorted_lower, (term, ''))
+                names = []
+                for lower, name in self._sorted_lower[start:start + limit]:
+                    if not lower.startswith(term):
+                        break
+                    names.append(name)
+                if len(names) >= limit or (names and names[0].lower() == term):
+                    return [(name,) + self._table_details[name] for name in names]
+            if table:
+                details = {name: (meta["label"], meta["type"]) for name, meta in self.table_fields(table).items()}
+                keys = [(name, name.lower(), (label or '').lower()) for name, (label, _) in details.items()]
+            else:
+                details = self._table_details
+                keys = self._table_keys
+
+        scored = []
+        for name, n, l in keys:
+            if term == n or term == l:
+                score = 0
+            elif n.startswith(term) or l.startswith(term):
+                score = 1
+            elif term in n or term in l:
+                score = 2
+            else:
+                continue
+            scored.append((score, len(name), name))
+        scored.sort()
+        names = [name for _, _, name in scored[:limit]]
+
+        if not names:
+            # Typos only: difflib is far slower than the substring pass
+            names = difflib.get_close_matches(term, [k[0] for k in keys], n=limit, cutoff=0.7)
+        return [(name,) + details[name] for name in names]
+
+    def validate(self, table, data):
+        """
+        Returns a list of problems with writing data to table (empty if it looks valid).
+        """
+        problems = []
+        with self._lock:
+            if table not in self.tables:
+                suggestions = difflib.get_close_matches(table, self._names, n=3, cutoff=0.6)
+                hint = f" Did you mean: {', '.join(suggestions)}?" if suggestions else ""
+                return [f"Unknown table '{table}'.{hint}"]
+        known = self.table_fields(table)
+        for field in data or {}:
+            if field not in known:
+                suggestions = difflib.get_close_matches(field, list(known), n=3, cutoff=0.6)
+                hint = f" (did you mean: {', '.join(suggestions)}?)" if suggestions else ""
+                problems.append(f"Unknown field '{field}' on {table}{hint}")
+        return problems
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_schema_index(instance_url):
+    """
+    Returns the SchemaIndex for instance_url, loaded from disk if present.
+    Does not touch the network.
+    """
+    key = instance_url.rstrip('/')
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = SchemaIndex(key)
+        return index
+
+def ensure_index(instance_url):
+    """
+    Returns an index that is ready to query: builds it on first use and
+    refreshes a stale one incrementally in the background.
+    """
+    index = get_schema_index(instance_url)
+    if not index.is_loaded():
+        index.rebuild()
+    elif index.is_stale() and not index.refreshing:
+        index.refreshing = True
+        threading.Thread(target=_refresh_quietly, args=(index,), daemon=True).start()
+    return index
+
+def _refresh_quietly(index):
+    try:
+        with lane(BACKGROUND):
+            index.refresh()
+    except Exception as e:
+        log("schema_refresh_failed", level="warning", instance=index.instance_url, error=str(e))
+    finally:
+        index.refreshing = False
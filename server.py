@@ -8,16 +8,145 @@ if sys.platform == "win32":
         if not hasattr(signal, sig):
             setattr(signal, sig, 1)
 
-from flask import Flask, request, jsonify
+import json
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 
 load_dotenv()
-from servicenow_tools import get_instance_stats, get_applications, get_recent_errors, get_security_stats, get_integration_health, check_connection, get_records
-from admin_agent import run_admin_command, analyze_error_log
+from servicenow_tools import read_flight, get_instance_stats, fetch_applications, get_security_stats, get_integration_health, check_connection, iter_records, add_count_observer, APPLICATIONS_QUERY
+from stats_cache import cache
+from live_stats import get_poller, poller_stats
+from job_queue import jobs, JobQueueFull
+from analysis_cache import get_analysis_cache
+from sessions import sessions
+from syslog_tail import tail_errors, tailer_stats
+from stats_history import get_stats_history, record_counts
+from fleet import fleet_stats, load_groups, resolve_instances
+from rate_limiter import limiter_stats
+from fast_path import run_fast_path, fast_path_stats
+import metrics
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Data-Age'])
+
+# --- AGENT STACK ---
+# admin_agent pulls in crewai and the LLM client, which takes seconds to import.
+# Stats-only deployments never pay for it; AI requests import it on first use.
+_agent_module = None
+_agent_lock = threading.Lock()
+
+def load_agent_module():
+    global _agent_module
+    if _agent_module is None:
+        with _agent_lock:
+            if _agent_module is None:
+                import admin_agent
+                _agent_module = admin_agent
+    return _agent_module
+
+def run_admin_command(*args):
+    return load_agent_module().run_admin_command(*args)
+
+def analyze_error_log(*args):
+    return load_agent_module().analyze_error_log(*args)
+
+# --- INSTRUMENTATION ---
+@app.before_request
+def start_timer():
+    request.started_at = time.monotonic()
+
+@app.after_request
+def record_route(response):
+    # Streaming routes are timed to their first byte, not the end of the stream
+    started = getattr(request, 'started_at', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        seconds = time.monotonic() - started
+        metrics.route_seconds.observe(seconds, route=route, method=request.method)
+        metrics.route_requests.inc(route=route, method=request.method, status=str(response.status_code))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def _opened_stats(module, name):
+    """
+    stats() of a lazily opened singleton, or None before anything opened it
+    (a scrape shouldn't open the on-disk stores or import the agent stack).
+    """
+    store = getattr(sys.modules.get(module), name, None)
+    return store.stats() if store is not None else None
+
+def _per_instance(stats, field):
+    return [({"instance": url}, values[field]) for url, values in stats.items()]
+
+def _opened_field(module, name, field):
+    stats = _opened_stats(module, name)
+    return [({}, stats[field])] if stats is not None else []
+
+def _opened_map(module, name, field, label):
+    stats = _opened_stats(module, name)
+    return [({label: key}, value) for key, value in (stats[field] if stats is not None else {}).items()]
+
+for _metric in [
+    metrics.Collected("snowagent_stats_cache_entries", "Entries in the in-memory stats cache",
+                      lambda: [({}, cache.stats()["entries"])]),
+    metrics.Collected("snowagent_stats_cache_bytes", "Approximate size of the in-memory stats cache",
+                      lambda: [({}, cache.stats()["bytes"])]),
+    metrics.Collected("snowagent_stats_cache_lookups_total", "Stats cache lookups by result",
+                      lambda: [({"result": result}, cache.stats()[field]) for result, field in
+                               (("fresh", "hits"), ("stale", "stale_hits"), ("miss", "misses"))], type="counter"),
+    metrics.Collected("snowagent_stats_cache_refreshing", "Stale stats cache entries being refreshed in the background",
+                      lambda: [({}, cache.stats()["refreshing"])]),
+    metrics.Collected("snowagent_live_subscribers", "Open /stats_stream subscribers per instance",
+                      lambda: _per_instance(poller_stats(), "subscribers")),
+    metrics.Collected("snowagent_live_metrics", "Metrics tracked by each instance's live poller",
+                      lambda: _per_instance(poller_stats(), "metrics")),
+    metrics.Collected("snowagent_syslog_buffered_rows", "Error rows in each instance's syslog tail buffer",
+                      lambda: _per_instance(tailer_stats(), "buffered")),
+    metrics.Collected("snowagent_syslog_polls_total", "syslog tail polls per instance",
+                      lambda: _per_instance(tailer_stats(), "polls"), type="counter"),
+    metrics.Collected("snowagent_single_flight_in_flight", "Read calls currently in flight that identical calls can join",
+                      lambda: [({"group": read_flight.name}, read_flight.stats()["in_flight"])]),
+    metrics.Collected("snowagent_analysis_cache_entries", "Error analyses stored on disk",
+                      lambda: _opened_field("analysis_cache", "analysis_cache", "entries")),
+    metrics.Collected("snowagent_analysis_cache_hits", "Times stored error analyses were reused (entries still on disk)",
+                      lambda: _opened_field("analysis_cache", "analysis_cache", "hits")),
+    metrics.Collected("snowagent_analysis_cache_in_flight", "Error analyses running that identical requests can join",
+                      lambda: _opened_field("analysis_cache", "analysis_cache", "in_flight")),
+    metrics.Collected("snowagent_stats_history_buckets", "Stored stats history buckets by resolution",
+                      lambda: _opened_map("stats_history", "stats_history", "buckets", "resolution")),
+    metrics.Collected("snowagent_stats_history_written_total", "Count samples written to the stats history",
+                      lambda: _opened_field("stats_history", "stats_history", "written"), type="counter"),
+    metrics.Collected("snowagent_agent_pool_idle", "Idle admin agents kept for reuse per instance",
+                      lambda: _opened_map("admin_agent", "agent_pool", "idle", "instance")),
+    metrics.Collected("snowagent_agent_pool_created_total", "Admin agents built (the rest were reused from the pool)",
+                      lambda: _opened_field("admin_agent", "agent_pool", "created"), type="counter"),
+    metrics.Collected("snowagent_agent_pool_reused_total", "Admin agents reused from the pool",
+                      lambda: _opened_field("admin_agent", "agent_pool", "reused"), type="counter"),
+]:
+    metrics.register(_metric)
+
+@app.route('/rate_limits', methods=['GET'])
+def rate_limits():
+    # Current rate, tokens and Retry-After block for every instance called so far
+    return jsonify(limiter_stats())
+
+def with_age(payload, age):
+    """
+    JSON response carrying the age (seconds) of the cached data in X-Data-Age.
+    """
+    response = jsonify(payload)
+    response.headers['X-Data-Age'] = f"{age:.1f}"
+    return response
 # ... (existing code) ...
 
 @app.route('/security_stats', methods=['GET'])
@@ -25,8 +154,8 @@ def security_stats():
     url = request.args.get('instance_url')
     if not url: return jsonify({"error": "Instance URL required"}), 400
     try:
-        stats = get_security_stats(url)
-        return jsonify(stats)
+        stats = get_security_stats(url, cache=cache)
+        return with_age(stats, stats["data_age"])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -35,18 +164,28 @@ def integration_stats():
     url = request.args.get('instance_url')
     if not url: return jsonify({"error": "Instance URL required"}), 400
     try:
-        stats = get_integration_health(url)
-        return jsonify(stats)
+        stats = get_integration_health(url, cache=cache)
+        return with_age(stats, stats["data_age"])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+ERRORS_PANEL_ROWS = 10
+
 @app.route('/errors', methods=['GET'])
 def errors():
+    """
+    Recent syslog errors from the incremental tailer. Without a cursor, returns
+    the newest rows as a list. With ?cursor=<cursor from a previous call>,
+    returns {"rows", "cursor", "reset"} holding only the rows logged since.
+    """
     url = request.args.get('instance_url')
     if not url: return jsonify({"error": "Instance URL required"}), 400
+    cursor = request.args.get('cursor')
     try:
-        errs = get_recent_errors(url)
-        return jsonify(errs)
+        tail = tail_errors(url, cursor)
+        if cursor is None:
+            return with_age(tail["rows"][:ERRORS_PANEL_ROWS], tail["data_age"])
+        return with_age(tail, tail["data_age"])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -57,11 +196,20 @@ def analyze_error():
     url = data.get('instance_url')
     if not msg or not url:
         return jsonify({"error": "Message and Instance URL required"}), 400
+    # Repeated errors are answered from the fingerprint cache without an LLM run
+    store = get_analysis_cache()
+    fp, analysis = store.lookup(msg)
+    if analysis is not None:
+        return jsonify({"status": "succeeded", "result": analysis, "cached": True, "fingerprint": fp})
+
+    def analyze():
+        return store.get_or_compute(msg, lambda: analyze_error_log(msg, url))[0]
+
     try:
-        analysis = analyze_error_log(msg, url)
-        return jsonify({"analysis": analysis})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        job = jobs.submit('analyze_error', analyze, dedupe_key=('analyze_error', fp))
+        return jsonify(job), 202
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
 
 
 
@@ -69,41 +217,141 @@ def analyze_error():
 def admin_command():
     data = request.json
     command = data.get('command')
-    history = data.get('history', []) # Get history from frontend
     url = data.get('instance_url')
     
     if not command or not url:
         return jsonify({"error": "Command and Instance URL required"}), 400
+
+    # History lives server-side; older clients may still send theirs to seed a new session
+    session = sessions.get(data.get('session_id')) if data.get('session_id') else None
+    if session is None:
+        session = sessions.get_or_create(data.get('session_id'))
+        for msg in data.get('history', []):
+            sessions.append(session.id, msg.get('role', 'user'), msg.get('content', ''))
+    summary, recent = sessions.prompt_context(session.id)
+
+    # Routine lookups are answered straight from the instance, without a crew
+    # run; if that query fails the command goes to the agent like any other
+    fast = run_fast_path(command, url)
+    if fast is not None:
+        route, result = fast
+        sessions.append(session.id, 'user', command)
+        sessions.append(session.id, 'ai', result)
+        return jsonify({"status": "succeeded", "result": result, "fast_path": route, "session_id": session.id})
+
+    def admin_job():
+        result = run_admin_command(command, url, recent, summary)
+        sessions.append(session.id, 'user', command)
+        sessions.append(session.id, 'ai', result)
+        return result
     
     try:
-        result = run_admin_command(command, url, history)
-        return jsonify({"result": result})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        job = jobs.submit('admin_command', admin_job)
+        return jsonify({**job, "session_id": session.id}), 202
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+@app.route('/fast_path', methods=['GET'])
+def fast_path_report():
+    return jsonify(fast_path_stats())
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None: return jsonify({"error": "Session not found"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id): return jsonify({"error": "Session not found"}), 404
+    return jsonify({"status": "deleted"})
+
+# --- AGENT JOBS ---
+# /admin_command and /analyze_error return a job id (202); the result is
+# fetched from /jobs/<id>. Pass ?wait=<seconds> to long-poll until it finishes.
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(jobs.stats())
+
+# Longest a GET /jobs/<id>?wait= long poll is held open
+JOB_MAX_WAIT = 30
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        wait_for = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    if math.isnan(wait_for):
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+    wait_for = max(0.0, min(wait_for, JOB_MAX_WAIT))
+    job = jobs.get(job_id, wait=wait_for)
+    if job is None: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
 
 @app.route('/instance_stats', methods=['GET'])
 def instance_stats():
     url = request.args.get('instance_url')
-    print(f"Received instance_stats request for: {url}")
     if not url: return jsonify({"error": "Instance URL required"}), 400
     try:
-        print("Calling get_instance_stats...")
-        stats = get_instance_stats(url)
-        print(f"get_instance_stats returned: {stats}")
-        return jsonify(stats)
+        stats = get_instance_stats(url, cache=cache)
+        metrics.log("instance_stats", instance=url, errors=stats["errors"] or None, data_age=stats["data_age"])
+        return with_age(stats, stats["data_age"])
     except Exception as e:
-        print(f"instance_stats error: {e}")
+        metrics.log("instance_stats_failed", level="error", instance=url, error=str(e))
         return jsonify({"error": str(e)}), 500
 
+# --- STATS HISTORY ---
+# Every count fetched from an instance (requests, background refreshes and the
+# live poller) is recorded locally, so trend charts never query ServiceNow.
+add_count_observer(record_counts)
+
+@app.route('/stats_history', methods=['GET'])
+def stats_history():
+    """
+    Trend data for ?metrics=a,b between ?start and ?end (epoch seconds; the
+    default is the last 24 hours). ?resolution=minute|hour|day is optional;
+    by default the finest one that fits the range is used.
+    """
+    url = request.args.get('instance_url')
+    if not url: return jsonify({"error": "Instance URL required"}), 400
+    history = get_stats_history()
+    try:
+        end = float(request.args.get('end') or time.time())
+        start = float(request.args.get('start') or end - 86400)
+    except ValueError:
+        return jsonify({"error": "start and end must be epoch seconds"}), 400
+    if not (math.isfinite(start) and math.isfinite(end)):
+        return jsonify({"error": "start and end must be epoch seconds"}), 400
+    names = [m for m in request.args.get('metrics', '').split(',') if m] or history.metrics(url)
+    try:
+        resolution, series = history.query(url, names, start, end, request.args.get('resolution'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "start": start,
+        "end": end,
+        "resolution": resolution,
+        "columns": ["bucket", "avg", "min", "max", "last"],
+        "series": series,
+    })
+
 @app.route('/test_connection', methods=['POST'])
 def test_connection():
     data = request.json
     url = data.get('instance_url')
     if not url: return jsonify({"error": "Instance URL required"}), 400
     
-    print(f"Testing connection to: {url}")
     result = check_connection(url)
-    print(f"Connection result: {result}")
+    metrics.log("test_connection", level="info" if result.get("status") == "success" else "warning", slow=True,
+                instance=url, status=result.get("status"), message=result.get("message"))
     return jsonify(result)
 
 @app.route('/applications', methods=['GET'])
@@ -111,13 +359,31 @@ def applications():
     url = request.args.get('instance_url')
     if not url: return jsonify({"error": "Instance URL required"}), 400
     try:
-        apps = get_applications(url)
-        return jsonify(apps)
+        apps, age = cache.get_or_load((url, 'sys_scope', APPLICATIONS_QUERY), lambda: fetch_applications(url), cache.ttl_for('applications'))
+        return with_age(apps, age)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+RECORDS_MAX = int(os.getenv("SN_RECORDS_MAX", "10000"))
+
+def records_limit(value):
+    """
+    The requested row limit capped at RECORDS_MAX. Raises ValueError unless
+    it is a positive whole number.
+    """
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be a positive integer")
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, RECORDS_MAX)
+
 @app.route('/records', methods=['POST'])
 def records():
+    """
+    Streams matching records as NDJSON (one JSON object per line), page by page.
+    """
     data = request.json
     url = data.get('instance_url')
     table = data.get('table')
@@ -127,12 +393,153 @@ def records():
 
     if not url or not table or not query:
         return jsonify({"error": "Instance URL, Table, and Query required"}), 400
-    
     try:
-        records = get_records(url, table, query, fields, limit)
-        return jsonify(records)
+        limit = records_limit(limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Fetch the first page before streaming so upstream errors still get a
+    # proper status code; after that, errors arrive as an {"error": ...} line.
+    rows = iter_records(url, table, query, fields, max_records=limit)
+    try:
+        first = next(rows, None)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    def ndjson():
+        if first is None:
+            return
+        yield json.dumps(first) + "\n"
+        try:
+            for row in rows:
+                yield json.dumps(row) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
+
+# --- DASHBOARD SNAPSHOT ---
+SNAPSHOT_TIMEOUT = float(os.getenv("SN_SNAPSHOT_TIMEOUT", "15"))
+snapshot_pool = ThreadPoolExecutor(max_workers=int(os.getenv("SN_SNAPSHOT_WORKERS", "8")), thread_name_prefix="snapshot")
+
+def _cached_list(url, table, query, metric, loader):
+    value, age = cache.get_or_load((url, table, query), loader, cache.ttl_for(metric))
+    return {"data": value, "data_age": age}
+
+def _error_panel(url):
+    tail = tail_errors(url)
+    return {"data": tail["rows"][:ERRORS_PANEL_ROWS], "cursor": tail["cursor"], "data_age": tail["data_age"]}
+
+SNAPSHOT_SECTIONS = {
+    "instance_stats": lambda url: get_instance_stats(url, cache=cache),
+    "errors": lambda url: _error_panel(url),
+    "security_stats": lambda url: get_security_stats(url, cache=cache),
+    "integration_stats": lambda url: get_integration_health(url, cache=cache),
+    "applications": lambda url: _cached_list(url, 'sys_scope', APPLICATIONS_QUERY, 'applications', lambda: fetch_applications(url)),
+}
+
+SNAPSHOT_VIEWS = {
+    "stats": ["instance_stats", "errors"],
+    "senior": ["security_stats", "integration_stats"],
+    "all": list(SNAPSHOT_SECTIONS),
+}
+
+@app.route('/dashboard_snapshot', methods=['GET'])
+def dashboard_snapshot():
+    """
+    Gathers every panel of a dashboard view concurrently in one response.
+    A section that fails or exceeds SNAPSHOT_TIMEOUT is returned as null with
+    its message in 'errors'; the other sections are unaffected.
+    """
+    url = request.args.get('instance_url')
+    if not url: return jsonify({"error": "Instance URL required"}), 400
+    view = request.args.get('view', 'all')
+    if view not in SNAPSHOT_VIEWS:
+        return jsonify({"error": f"Unknown view '{view}'. Expected one of: {', '.join(SNAPSHOT_VIEWS)}"}), 400
+
+    started = time.monotonic()
+    futures = {snapshot_pool.submit(SNAPSHOT_SECTIONS[name], url): name for name in SNAPSHOT_VIEWS[view]}
+    done, pending = wait(futures, timeout=SNAPSHOT_TIMEOUT)
+
+    sections = {name: None for name in futures.values()}
+    errors = {}
+    for future in done:
+        name = futures[future]
+        try:
+            sections[name] = future.result()
+        except Exception as e:
+            errors[name] = str(e)
+    for future in pending:
+        future.cancel()
+        errors[futures[future]] = f"Timed out after {SNAPSHOT_TIMEOUT:g}s"
+
+    age = max((s.get("data_age", 0.0) for s in sections.values() if s), default=0.0)
+    return with_age({
+        "view": view,
+        "sections": sections,
+        "errors": errors,
+        "data_age": age,
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+    }, age)
+
+# --- FLEET ---
+@app.route('/fleet/groups', methods=['GET'])
+def fleet_groups():
+    try:
+        return jsonify(load_groups())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/fleet', methods=['GET'])
+def fleet():
+    """
+    Stats for many instances in one table. Takes ?group=<name from the fleet
+    file> and/or ?instances=url1,url2, plus optional ?sections=stats,security,integration.
+    """
+    sections = [s for s in request.args.get('sections', '').split(',') if s]
+    try:
+        urls = resolve_instances(request.args.get('group'), request.args.get('instances'))
+        return jsonify(fleet_stats(urls, sections, cache=cache))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+# --- LIVE STATS STREAM ---
+STREAM_KEEPALIVE = 15
+
+@app.route('/stats_stream', methods=['GET'])
+def stats_stream():
+    """
+    Server-Sent Events stream of stat changes for one instance.
+    Sends a 'snapshot' event first, then 'delta' events with only the metrics
+    that changed. All viewers of an instance share one background poller.
+    """
+    url = request.args.get('instance_url')
+    if not url: return jsonify({"error": "Instance URL required"}), 400
+
+    poller = get_poller(url)
+    q = poller.subscribe()
+
+    def events():
+        try:
+            while True:
+                try:
+                    event = q.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            poller.unsubscribe(q)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 if __name__ == '__main__':
-    app.run(port=5001, debug=True)
+    if '--async' in sys.argv:
+        # See async_server.py; this module's Flask app still serves the non-dashboard routes
+        import async_server
+        async_server.main(sys.modules[__name__], port=5001)
+    else:
+        app.run(port=5001, debug=True)
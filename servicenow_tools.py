@@ -1,9 +1,19 @@
 import requests
+import base64
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from crewai.tools import BaseTool
-from pydantic import Field
+from count_planner import plan_counts, call_params, split_results
+from metrics import observe_upstream, log
+from single_flight import SingleFlight
+from rate_limiter import get_limiter, carry_lane, current_lane, RateLimited
 
 load_dotenv()
 
@@ -12,320 +22,678 @@ load_dotenv()
 INSTANCE_URL = "https://dev309858.service-now.com" # Keeping for other functions that still rely on it.
 USERNAME = os.getenv("SN_USERNAME")
 PASSWORD = os.getenv("SN_PASSWORD") 
+# Local caches (error analyses, schema index) are kept here
+CACHE_DIR = os.getenv("SN_CACHE_DIR", ".snowagent_cache")
 
-def get_instance_stats(instance_url):
+# (connect, read) seconds, applied to every call that doesn't pass its own
+DEFAULT_TIMEOUT = (float(os.getenv("SN_CONNECT_TIMEOUT", "5")), float(os.getenv("SN_READ_TIMEOUT", "10")))
+POOL_SIZE = int(os.getenv("SN_POOL_SIZE", "20"))
+MAX_RETRIES = int(os.getenv("SN_MAX_RETRIES", "2"))
+
+# --- HTTP CLIENT ---
+class ServiceNowClient:
     """
-    Fetches basic stats: incident count, active changes, open problems.
-    Returns dict with keys: incidents, users, jobs
-    """
-    stats = {
-        "incidents": 0,
-        "users": 0,
-        "failed_jobs": 0,
-        "p1_incidents": 0,
-        "unassigned_incidents": 0,
-        "active_changes": 0
+    Keep-alive HTTP session for one instance URL.
+    Connection errors and 5xx responses are retried with exponential backoff;
+    POST is only retried when the connection could not be established, so a
+    create is never sent twice. Every call first takes a turn from the
+    instance's rate limiter (see rate_limiter), and 429s are retried after
+    their Retry-After.
+    """
+
+    def __init__(self, instance_url, username=None, password=None, pool_size=POOL_SIZE, max_retries=MAX_RETRIES, timeout=DEFAULT_TIMEOUT):
+        self.instance_url = instance_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'PUT', 'PATCH', 'DELETE']),
+            raise_on_status=False,
+            # 429s (which carry Retry-After) are left to request(), so each
+            # attempt goes through the rate limiter
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.auth = (username or USERNAME, password or PASSWORD)
+        self.session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+
+    def request(self, method, path, timeout=None, **kwargs):
+        url = path if path.startswith('http') else f"{self.instance_url}{path}"
+        limiter = get_limiter(self.instance_url)
+        attempt = 0
+        while True:
+            try:
+                limiter.acquire()
+            except RateLimited:
+                # Already throttled once: hand back the 429 rather than wait
+                if attempt:
+                    return response
+                raise
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except Exception as e:
+                observe_upstream(method, path, time.monotonic() - started, error=e)
+                raise
+            observe_upstream(method, path, time.monotonic() - started, response)
+            limiter.observe(response.status_code, response.headers)
+            # A 429 was not applied, so any method can be sent again once Retry-After has passed
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            attempt += 1
+
+    def get(self, path, params=None, **kwargs):
+        # Identical GETs already in flight (same instance, path, params and
+        # rate limiter lane) share that call instead of sending their own;
+        # an interactive call never waits behind a background one
+        key = (self.instance_url, path, params_key(params), current_lane())
+        return read_flight.do(key, lambda: self.request('GET', path, params=params, **kwargs))
+
+    def post(self, path, json=None, **kwargs):
+        return self.request('POST', path, json=json, **kwargs)
+
+    def put(self, path, json=None, **kwargs):
+        return self.request('PUT', path, json=json, **kwargs)
+
+read_flight = SingleFlight("read")
+
+def params_key(params):
+    return tuple(sorted((k, str(v)) for k, v in (params or {}).items()))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(instance_url):
+    """
+    Returns the shared ServiceNowClient for instance_url, creating it on first use.
+    """
+    key = instance_url.rstrip('/')
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = ServiceNowClient(key)
+    return client
+
+class ServiceNowError(Exception):
+    """
+    Raised for non-success ServiceNow responses by functions that can't return an error dict.
+    """
+
+    def __init__(self, status_code, text):
+        super().__init__(f"Error {status_code}: {text}")
+        self.status_code = status_code
+
+# --- COUNT QUERIES ---
+# Each metric maps to the (table, encoded query) whose row count it reports.
+TODAY = 'sys_created_onONToday@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()'
+
+INSTANCE_STAT_QUERIES = {
+    "incidents": ('incident', 'active=true'),
+    "users": ('sys_user', 'active=true'),
+    "failed_jobs": ('sys_trigger', 'state=3'), # 3 = Error
+    "p1_incidents": ('incident', 'active=true^priority=1'),
+    "unassigned_incidents": ('incident', 'active=true^assigned_toISEMPTY'),
+    "active_changes": ('change_request', 'active=true'),
+    # Learning Metrics
+    # Errors = Level 2. created_onONToday... is a ServiceNow date constant
+    "today_errors": ('syslog', 'level=2^' + TODAY),
+    "recent_updates": ('sys_update_xml', TODAY),
+    "total_business_rules": ('sys_script', 'active=true'),
+}
+
+SECURITY_STAT_QUERIES = {
+    # Failed Logins Today (sysevent)
+    "failed_logins": ('sysevent', 'name=login.failed^' + TODAY),
+    # New Admin Roles Granted Today (sys_user_has_role)
+    "new_admins": ('sys_user_has_role', 'role.name=admin^' + TODAY),
+}
+
+INTEGRATION_STAT_QUERIES = {
+    # ECC Queue Errors Today
+    "ecc_errors": ('ecc_queue', 'state=error^' + TODAY),
+}
+
+APPLICATIONS_QUERY = 'orderbydesc:sys_updated_on'
+RECENT_ERRORS_QUERY = 'level=2^orderbydesc:sys_created_on' # Level 2 = Error
+
+COUNT_MAX_WORKERS = int(os.getenv("SN_COUNT_MAX_WORKERS", "6"))
+COUNT_TIMEOUT = float(os.getenv("SN_COUNT_TIMEOUT", "10"))
+# The Batch API (/api/now/v1/batch) needs San Diego or later
+USE_BATCH_API = os.getenv("SN_USE_BATCH_API", "false").lower() == "true"
+
+def fetch_count(instance_url, table, query, timeout=None):
+    """
+    Returns the row count of table matching query via the Aggregate (stats) API.
+    Raises on connection errors and non-200 responses.
+    """
+    call = {"table": table, "query": query, "group_by": None, "metrics": {"count": None}}
+    return split_results(call, fetch_aggregate(instance_url, call, timeout=timeout))["count"]
+
+def fetch_aggregate(instance_url, call, timeout=None):
+    """
+    Runs one planned Aggregate API call (see count_planner) and returns its 'result'.
+    """
+    res = get_client(instance_url).get(f"/api/now/stats/{call['table']}", params=call_params(call), timeout=timeout)
+    if res.status_code != 200:
+        raise ServiceNowError(res.status_code, res.text[:200])
+    return res.json().get('result', {})
+
+# Batch API request building and response parsing, shared with async_servicenow
+def batch_payload(rest_requests):
+    return {
+        "batch_request_id": str(int(time.time() * 1000)),
+        "rest_requests": rest_requests
     }
-    
-    headers = {"Content-Type": "application/json"}
-    
-    def get_count(table, query):
-        url = f"{instance_url}/api/now/stats/{table}"
-        params = {
-            'sysparm_count': 'true',
-            'sysparm_query': query
+
+def batch_get_requests(paths):
+    """
+    Batch API sub-requests for paths (request id -> path with query string).
+    """
+    return [
+        {
+            "id": request_id,
+            "url": path,
+            "method": "GET",
+            "headers": [{"name": "Accept", "value": "application/json"}],
+            "exclude_response_headers": True
         }
+        for request_id, path in paths.items()
+    ]
+
+def parse_batch(res):
+    """
+    Batch API response -> id -> (status_code, body). Raises if the batch
+    endpoint itself failed (e.g. older releases without it).
+    """
+    if res.status_code != 200:
+        raise ServiceNowError(res.status_code, res.text[:200])
+    out = {}
+    for served in res.json().get('serviced_requests', []):
+        body = served.get('body')
+        out[served.get('id')] = (served.get('status_code'), json.loads(base64.b64decode(body)) if body else {})
+    return out
+
+def batch_key(instance_url, paths):
+    """
+    Single-flight key for a GET batch; see ServiceNowClient.get.
+    """
+    return (instance_url.rstrip('/'), "batch", tuple(sorted(paths.items())), current_lane())
+
+def _send_batch(instance_url, rest_requests, timeout=None):
+    """
+    Posts rest_requests to the Batch API. Returns id -> (status_code, body).
+    """
+    res = get_client(instance_url).post("/api/now/v1/batch", json=batch_payload(rest_requests), timeout=timeout)
+    return parse_batch(res)
+
+def fetch_batch(instance_url, paths, timeout=None):
+    """
+    Sends several GET requests in one round trip through the Batch API.
+    paths maps a request id -> path with query string. Returns id -> (status_code, body).
+    Identical batches in flight at the same time (in the same lane) share one call.
+    """
+    return read_flight.do(batch_key(instance_url, paths), lambda: _fetch_batch(instance_url, paths, timeout))
+
+def _fetch_batch(instance_url, paths, timeout):
+    return _send_batch(instance_url, batch_get_requests(paths), timeout=timeout)
+
+def count_batch_paths(calls):
+    """
+    Batch API paths for planned Aggregate API calls, keyed by call position.
+    """
+    return {
+        str(i): f"/api/now/stats/{call['table']}?{urlencode(call_params(call))}"
+        for i, call in enumerate(calls)
+    }
+
+def split_batch_counts(calls, responses):
+    """
+    Per-metric (values, errors) from the Batch API responses to count_batch_paths(calls).
+    """
+    values = {}
+    errors = {}
+    for i, call in enumerate(calls):
+        status, body = responses.get(str(i), (None, None))
+        if status == 200:
+            values.update(split_results(call, body.get('result', {})))
+        else:
+            for metric in call["metrics"]:
+                errors[metric] = f"Batch sub-request failed: {status or 'not serviced'}"
+    return values, errors
+
+def _execute_batch(instance_url, calls, timeout):
+    """
+    Runs every planned call in a single Batch API request. Returns (values, errors).
+    """
+    return split_batch_counts(calls, fetch_batch(instance_url, count_batch_paths(calls), timeout=timeout))
+
+def _execute_counts(instance_url, queries, max_workers, timeout, total_timeout=None):
+    """
+    Plans queries into as few Aggregate API calls as possible (see count_planner)
+    and fans those out over a bounded pool, or sends them as one Batch API request
+    when SN_USE_BATCH_API is on. Returns (values, errors, latency_ms).
+    """
+    values = {}
+    errors = {}
+    latency = {}
+    if not queries:
+        return values, errors, latency
+
+    calls = plan_counts(queries)
+    read_timeout = (DEFAULT_TIMEOUT[0], timeout)
+
+    if USE_BATCH_API and len(calls) > 1:
+        started = time.monotonic()
         try:
-            print(f"Fetching count for {table} from {url}...")
-            res = requests.get(url, auth=(USERNAME, PASSWORD), headers=headers, params=params, timeout=10)
-            if res.status_code == 200:
-                print(f"Success: {table}")
-                return res.json().get('result', {}).get('stats', {}).get('count', 0)
-            else:
-                print(f"Failed {table}: {res.status_code}")
+            values, errors = _execute_batch(instance_url, calls, read_timeout)
+            elapsed = round((time.monotonic() - started) * 1000, 1)
+            return values, errors, {metric: elapsed for metric in queries}
         except Exception as e:
-            print(f"Error {table}: {e}")
-            pass
-        return 0
-
-    stats["incidents"] = get_count('incident', 'active=true')
-    stats["users"] = get_count('sys_user', 'active=true')
-    stats["failed_jobs"] = get_count('sys_trigger', 'state=3') # 3 = Error
-    
-    stats["p1_incidents"] = get_count('incident', 'active=true^priority=1')
-    stats["unassigned_incidents"] = get_count('incident', 'active=true^assigned_toISEMPTY')
-    stats["active_changes"] = get_count('change_request', 'active=true')
+            log("batch_unavailable", level="warning", instance=instance_url, error=str(e))
 
-    # Learning Metrics
-    # Errors = Level 2. created_onONToday... is a ServiceNow date constant
-    stats["today_errors"] = get_count('syslog', 'level=2^sys_created_onONToday@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()')
-    stats["recent_updates"] = get_count('sys_update_xml', 'sys_created_onONToday@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()')
-    stats["total_business_rules"] = get_count('sys_script', 'active=true')
-    
-    return stats
+    def timed(call):
+        started = time.monotonic()
+        try:
+            return split_results(call, fetch_aggregate(instance_url, call, timeout=read_timeout))
+        finally:
+            elapsed = round((time.monotonic() - started) * 1000, 1)
+            for metric in call["metrics"]:
+                latency[metric] = elapsed
+
+    workers = max(1, min(max_workers, len(calls)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(carry_lane(timed), call): call for call in calls}
+        # Queued calls only start once a worker frees up, so the overall wait
+        # allows every wave of workers its own per-query timeout.
+        waves = max(1, -(-len(futures) // workers))
+        budget = timeout * waves + 1
+        if total_timeout is not None:
+            budget = min(budget, total_timeout)
+        done, pending = wait(futures, timeout=budget)
+        for future in done:
+            call = futures[future]
+            try:
+                values.update(future.result())
+            except Exception as e:
+                for metric in call["metrics"]:
+                    errors[metric] = str(e)
+                log("count_failed", level="warning", instance=instance_url, table=call['table'], metrics=call['metrics'], error=str(e))
+        for future in pending:
+            future.cancel()
+            for metric in futures[future]["metrics"]:
+                errors[metric] = "Timed out"
+    finally:
+        pool.shutdown(wait=False)
+    return values, errors, latency
+
+# Callables fn(instance_url, {metric: value}) told about every count fetched
+# from the instance (not cache hits), e.g. to record stats history.
+COUNT_OBSERVERS = []
+
+def add_count_observer(fn):
+    if fn not in COUNT_OBSERVERS:
+        COUNT_OBSERVERS.append(fn)
+
+def _notify_counts(instance_url, values):
+    if not values:
+        return
+    for observer in COUNT_OBSERVERS:
+        try:
+            observer(instance_url, values)
+        except Exception as e:
+            log("count_observer_failed", level="error", error=str(e))
+
+def run_count_queries(instance_url, queries, max_workers=None, timeout=None, cache=None, total_timeout=None):
+    """
+    Runs a set of count queries concurrently.
+    queries maps metric name -> (table, query). Returns a dict with one value per
+    metric plus 'errors' (metric -> message) and 'latency_ms' (metric -> ms).
+    A metric that failed or timed out is reported as None, never as 0.
+    timeout applies to each query; total_timeout, if set, caps the whole run.
+    With a StatsCache, cached counts are served first (stale ones are refreshed in
+    the background) and 'age' / 'data_age' report how old each value is.
+    """
+    max_workers = max_workers or COUNT_MAX_WORKERS
+    timeout = timeout or COUNT_TIMEOUT
+    results, ages, misses = begin_counts(instance_url, queries, cache, timeout)
+    values, errors, latency = _execute_counts(instance_url, misses, max_workers, timeout, total_timeout)
+    return finish_counts(instance_url, queries, cache, results, ages, values, errors, latency)
+
+# The cache side of run_count_queries, shared with async_servicenow; only the
+# fetching of misses differs between the two.
+def begin_counts(instance_url, queries, cache, timeout):
+    """
+    Serves what it can from cache (stale entries are refreshed in the
+    background). Returns (results, ages, misses); misses still need fetching.
+    """
+    results = {metric: None for metric in queries}
+    ages = {}
+    misses = dict(queries)
+    if cache is not None:
+        for metric, (table, query) in queries.items():
+            key = (instance_url, table, query)
+            found = cache.lookup(key)
+            if found is None:
+                continue
+            value, age, fresh = found
+            results[metric] = value
+            ages[metric] = round(age, 1)
+            del misses[metric]
+            if not fresh:
+                cache.refresh(key, lambda t=table, q=query, k=key, m=metric: _refresh_count(
+                    instance_url, cache, k, m, t, q, timeout))
+    return results, ages, misses
+
+def finish_counts(instance_url, queries, cache, results, ages, values, errors, latency):
+    """
+    Merges fetched values into results, caches them, tells the count observers,
+    and adds errors, latency_ms and (with a cache) age / data_age.
+    """
+    for metric, value in values.items():
+        results[metric] = value
+        ages[metric] = 0.0
+        if cache is not None:
+            table, query = queries[metric]
+            cache.put((instance_url, table, query), value, cache.ttl_for(metric))
+
+    _notify_counts(instance_url, values)
+
+    results["errors"] = errors
+    results["latency_ms"] = latency
+    if cache is not None:
+        results["age"] = ages
+        results["data_age"] = max(ages.values(), default=0.0)
+    return results
+
+def _refresh_count(instance_url, cache, key, metric, table, query, timeout):
+    value = fetch_count(instance_url, table, query, timeout=(DEFAULT_TIMEOUT[0], timeout))
+    cache.put(key, value, cache.ttl_for(metric))
+    _notify_counts(instance_url, {metric: value})
+
+def get_instance_stats(instance_url, cache=None):
+    """
+    Fetches basic stats: incident count, active changes, open problems.
+    Returns dict with keys: incidents, users, failed_jobs, ... plus errors/latency_ms
+    """
+    return run_count_queries(instance_url, INSTANCE_STAT_QUERIES, cache=cache)
+
+APPLICATIONS_PARAMS = {
+    'sysparm_limit': 50,
+    'sysparm_fields': 'name,scope,version,sys_updated_on',
+    'sysparm_query': APPLICATIONS_QUERY
+}
+
+def fetch_applications(instance_url):
+    """
+    Fetches a list of applications from sys_scope. Raises on failure, so a
+    cache never stores an empty list in place of real data.
+    """
+    response = get_client(instance_url).get("/api/now/table/sys_scope", params=APPLICATIONS_PARAMS)
+    if response.status_code != 200:
+        raise ServiceNowError(response.status_code, response.text[:200])
+    return response.json().get('result', [])
 
 def get_applications(instance_url):
     """
-    Fetches a list of applications from sys_scope.
+    fetch_applications, returning [] on failure.
     """
-    url = f"{instance_url}/api/now/table/sys_scope"
-    params = {
-        'sysparm_limit': 50,
-        'sysparm_fields': 'name,scope,version,sys_updated_on',
-        'sysparm_query': 'orderbydesc:sys_updated_on'
-    }
     try:
-        response = requests.get(
-            url, 
-            auth=(USERNAME, PASSWORD), 
-            headers={"Content-Type": "application/json"}, 
-            params=params,
-            timeout=10
-        )
-        if response.status_code == 200:
-            return response.json().get('result', [])
+        return fetch_applications(instance_url)
     except Exception as e:
-        print(f"App fetch error: {e}")
-        pass
+        log("applications_failed", level="warning", instance=instance_url, error=str(e))
     return []
 
 def get_recent_errors(instance_url, limit=10):
     """
     Fetches recent error logs from syslog.
     """
-    url = f"{instance_url}/api/now/table/syslog"
-    params = {
-        'sysparm_limit': limit,
-        'sysparm_fields': 'sys_created_on,source,message,sys_id',
-        'sysparm_query': 'level=2^orderbydesc:sys_created_on' # Level 2 = Error
-    }
     try:
-        response = requests.get(
-            url, 
-            auth=(USERNAME, PASSWORD), 
-            headers={"Content-Type": "application/json"}, 
-            params=params,
-            timeout=10
-        )
+        response = get_client(instance_url).get("/api/now/table/syslog", params=recent_errors_params(limit))
         if response.status_code == 200:
             return response.json().get('result', [])
     except Exception as e:
-        print(f"Error fetching errors: {e}")
+        log("recent_errors_failed", level="warning", instance=instance_url, error=str(e))
         pass
     return []
 
-def get_security_stats(instance_url):
+def get_security_stats(instance_url, cache=None):
     """
     Fetches security related stats.
     """
-    headers = {"Content-Type": "application/json"}
-    stats = {"failed_logins": 0, "new_admins": 0}
+    return run_count_queries(instance_url, SECURITY_STAT_QUERIES, cache=cache)
 
-    # 1. Failed Logins Today (sysevent)
-    url_events = f"{instance_url}/api/now/stats/sysevent"
-    params_events = {
-        'sysparm_count': 'true',
-        'sysparm_query': 'name=login.failed^sys_created_onONToday@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()'
-    }
-    
-    # 2. New Admin Roles Granted Today (sys_user_has_role)
-    url_roles = f"{instance_url}/api/now/stats/sys_user_has_role"
-    params_roles = {
-        'sysparm_count': 'true',
-        'sysparm_query': 'role.name=admin^sys_created_onONToday@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()'
-    }
-
-    try:
-        # Fetch Events
-        r1 = requests.get(url_events, auth=(USERNAME, PASSWORD), headers=headers, params=params_events, timeout=10)
-        if r1.status_code == 200:
-            stats["failed_logins"] = r1.json().get('result', {}).get('stats', {}).get('count', 0)
-        
-        # Fetch Roles
-        r2 = requests.get(url_roles, auth=(USERNAME, PASSWORD), headers=headers, params=params_roles, timeout=10)
-        if r2.status_code == 200:
-            stats["new_admins"] = r2.json().get('result', {}).get('stats', {}).get('count', 0)
+def get_integration_health(instance_url, cache=None):
+    """
+    Fetches integration health (ECC Queue).
+    """
+    return run_count_queries(instance_url, INTEGRATION_STAT_QUERIES, cache=cache)
 
-    except Exception as e:
-        print(f"Security stats error: {e}")
-        pass
-        
-    return stats
+PAGE_SIZE = int(os.getenv("SN_PAGE_SIZE", "500"))
 
-def get_integration_health(instance_url):
+def iter_records(instance_url, table, query, fields=None, page_size=PAGE_SIZE, max_records=None):
     """
-    Fetches integration health (ECC Queue).
+    Yields records from a table page by page, so callers never hold more than
+    one page in memory. Pages are requested with sysparm_offset and paging stops
+    when the Link header has no rel="next" (or, without a Link header, on a
+    short page). fields is pushed upstream as sysparm_fields.
     """
-    headers = {"Content-Type": "application/json"}
-    stats = {"ecc_errors": 0}
+    params = page_params(query, fields)
+    client = get_client(instance_url)
+    yielded = 0
+    while True:
+        limit = page_size if max_records is None else min(page_size, max_records - yielded)
+        if limit <= 0:
+            return
+        params['sysparm_limit'] = limit
+        response = client.get(f"/api/now/table/{table}", params=params)
+        if response.status_code != 200:
+            raise ServiceNowError(response.status_code, response.text)
+        rows = response.json().get('result', [])
+        for row in rows:
+            yield row
+        yielded += len(rows)
 
-    # ECC Queue Errors Today
-    url = f"{instance_url}/api/now/stats/ecc_queue"
+        if not has_next_page(response, rows, limit):
+            return
+        params['sysparm_offset'] += len(rows)
+
+# Table API parameters and response handling, shared with async_servicenow
+def page_params(query, fields=None):
+    """
+    Parameters for the first page of iter_records; sysparm_limit is set per page.
+    """
     params = {
-        'sysparm_count': 'true',
-        'sysparm_query': 'state=error^sys_created_onONToday@javascript:gs.beginningOfToday()@javascript:gs.endOfToday()'
+        'sysparm_query': query,
+        'sysparm_offset': 0,
+        'sysparm_exclude_reference_link': 'true'
     }
-    
-    try:
-        r = requests.get(url, auth=(USERNAME, PASSWORD), headers=headers, params=params, timeout=10)
-        if r.status_code == 200:
-            stats["ecc_errors"] = r.json().get('result', {}).get('stats', {}).get('count', 0)
-    except Exception as e:
-        print(f"Integration stats error: {e}")
-        pass
+    if fields:
+        params['sysparm_fields'] = fields
+    return params
 
-    return stats
+def has_next_page(response, rows, limit):
+    if not rows:
+        return False
+    return 'next' in response.links if response.headers.get('Link') else len(rows) == limit
 
-def get_records(instance_url, table, query, fields=None, limit=20):
-    """
-    Fetches a list of records from a table.
-    """
-    url = f"{instance_url}/api/now/table/{table}"
+def record_params(query, fields=None, limit=20):
     params = {
         'sysparm_limit': limit,
         'sysparm_query': query
     }
     if fields:
         params['sysparm_fields'] = fields
-        
+    return params
+
+def records_result(response):
+    if response.status_code == 200:
+        return response.json().get('result', [])
+    return {"error": f"Error {response.status_code}: {response.text}"}
+
+def recent_errors_params(limit):
+    return {
+        'sysparm_limit': limit,
+        'sysparm_fields': 'sys_created_on,source,message,sys_id',
+        'sysparm_query': RECENT_ERRORS_QUERY
+    }
+
+CONNECTION_PARAMS = {
+    'sysparm_limit': 1,
+    'sysparm_fields': 'user_name'
+}
+
+def connection_result(status_code):
+    if status_code == 200:
+        return {"status": "success", "message": "Successfully connected to ServiceNow!"}
+    elif status_code == 401:
+        return {"status": "error", "message": "Authentication Failed. Check SN_USERNAME/SN_PASSWORD in .env"}
+    return {"status": "error", "message": f"ServiceNow returned status {status_code}"}
+
+def get_records(instance_url, table, query, fields=None, limit=20):
+    """
+    Fetches a list of records from a table.
+    """
     try:
-        response = requests.get(
-            url, 
-            auth=(USERNAME, PASSWORD), 
-            headers={"Content-Type": "application/json"}, 
-            params=params,
-            timeout=10
-        )
-        if response.status_code == 200:
-            return response.json().get('result', [])
-        else:
-            return {"error": f"Error {response.status_code}: {response.text}"}
+        response = get_client(instance_url).get(f"/api/now/table/{table}", params=record_params(query, fields, limit))
+        return records_result(response)
     except Exception as e:
         return {"error": f"Connection Error: {str(e)}"}
 
-class ServiceNowQueryTool(BaseTool):
-    name: str = "ServiceNow Table Query"
-    description: str = "Queries any ServiceNow table. Useful for finding records (Users, Incidents, Scripts, etc). Input should be a pipe-separated string: 'table_name|query_string'. Example: 'sys_user|active=true^nameLIKEAlice'"
-    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+# --- BULK WRITES ---
+BULK_MAX_WORKERS = int(os.getenv("SN_BULK_MAX_WORKERS", "8"))
+# Writes per Batch API request when SN_USE_BATCH_API is on
+BULK_BATCH_SIZE = int(os.getenv("SN_BULK_BATCH_SIZE", "50"))
+BULK_MAX_ITEMS = int(os.getenv("SN_BULK_MAX_ITEMS", "500"))
+# Batch endpoint statuses that mean the Batch API isn't available on the instance
+BATCH_UNAVAILABLE_STATUSES = (400, 404, 501)
 
-    def _run(self, input_str: str) -> str:
-        try:
-            table, query = input_str.split('|', 1)
-        except ValueError:
-            return "Error: Input must be in format 'table_name|query_string'"
-
-        url = f"{self.instance_url}/api/now/table/{table.strip()}"
-        params = {
-            'sysparm_query': query.strip(),
-            'sysparm_limit': 5,
-            'sysparm_display_value': 'true'
-        }
-        
-        try:
-            response = requests.get(
-                url, 
-                auth=(USERNAME, PASSWORD), 
-                headers={"Content-Type": "application/json"}, 
-                params=params
-            )
-            if response.status_code == 200:
-                results = response.json().get('result', [])
-                if not results:
-                    return "No records found."
-                return json.dumps(results, indent=2)
-            else:
-                return f"Error: {response.status_code} - {response.text}"
-        except Exception as e:
-            return f"Connection Failed: {str(e)}"
+def _write_result(index, status, body, expected):
+    result = body.get('result', {}) if isinstance(body, dict) else {}
+    if status == expected:
+        return {"index": index, "ok": True, "status": status, "sys_id": result.get('sys_id', ''), "number": result.get('number', '')}
+    error = body.get('error', {}) if isinstance(body, dict) else {}
+    message = error.get('message') or error.get('detail') if isinstance(error, dict) else error
+    return {"index": index, "ok": False, "status": status, "error": str(message or body or 'No response')[:200]}
 
-class ServiceNowCreateTool(BaseTool):
-    name: str = "ServiceNow Create Record"
-    description: str = "Creates a new record in any ServiceNow table. Input should be a pipe-separated string: 'table_name|json_data'. Example: 'incident|{\"short_description\": \"Server outage\", \"urgency\": \"1\"}'"
-    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
-
-    def _run(self, input_str: str) -> str:
+def _write_one(instance_url, index, method, path, data):
+    expected = 201 if method == "POST" else 200
+    try:
+        res = get_client(instance_url).request(method, path, json=data)
         try:
-            table, data_str = input_str.split('|', 1)
-            data = json.loads(data_str.strip())
+            body = res.json()
         except ValueError:
-            return "Error: Input must be in format 'table_name|json_data'"
-        except json.JSONDecodeError:
-            return "Error: Invalid JSON data provided."
+            body = res.text
+        return _write_result(index, res.status_code, body, expected)
+    except Exception as e:
+        return {"index": index, "ok": False, "status": None, "error": f"Connection Failed: {str(e)}"}
 
-        url = f"{self.instance_url}/api/now/table/{table.strip()}"
-        
-        try:
-            response = requests.post(
-                url, 
-                auth=(USERNAME, PASSWORD), 
-                headers={"Content-Type": "application/json"}, 
-                json=data
-            )
-            if response.status_code == 201:
-                result = response.json().get('result', {})
-                return f"Success! Record created. SysID: {result.get('sys_id')} \nNumber: {result.get('number')}"
-            else:
-                return f"Error: {response.status_code} - {response.text}"
-        except Exception as e:
-            return f"Connection Failed: {str(e)}"
+def _batch_not_applied(error):
+    """
+    True when a failed Batch API call certainly applied nothing: the endpoint
+    isn't available, or the connection was never made.
+    """
+    if isinstance(error, ServiceNowError):
+        return error.status_code in BATCH_UNAVAILABLE_STATUSES
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        # NewConnectionError (refused, DNS) is a ConnectTimeoutError too
+        return isinstance(getattr(error.args[0], 'reason', None), ConnectTimeoutError)
+    return False
 
-class ServiceNowUpdateTool(BaseTool):
-    name: str = "ServiceNow Update Record"
-    description: str = "Updates an existing record. Input should be a pipe-separated string: 'table_name|sys_id|json_data'. Example: 'incident|abc12345|{\"state\": \"2\"}'"
-    instance_url: str = Field(..., description="The base URL of the ServiceNow instance")
+def _write_chunk(instance_url, chunk):
+    """
+    Sends one chunk of (index, method, path, data) writes as a single Batch API
+    request. Falls back to individual requests only when the Batch API is
+    unavailable; after any other failure the batch may already have been
+    applied, so its writes are reported as failed and never resent.
+    """
+    rest_requests = [
+        {
+            "id": str(index),
+            "url": path,
+            "method": method,
+            "headers": [
+                {"name": "Content-Type", "value": "application/json"},
+                {"name": "Accept", "value": "application/json"}
+            ],
+            "body": base64.b64encode(json.dumps(data).encode('utf-8')).decode('ascii'),
+            "exclude_response_headers": True
+        }
+        for index, method, path, data in chunk
+    ]
+    try:
+        responses = _send_batch(instance_url, rest_requests)
+    except Exception as e:
+        log("batch_write_failed", level="warning", instance=instance_url, requests=len(chunk), error=str(e))
+        if _batch_not_applied(e):
+            return [_write_one(instance_url, *item) for item in chunk]
+        if isinstance(e, RateLimited):
+            error = f"Not sent: {str(e)}"
+        else:
+            error = f"Outcome unknown, not retried (the batch may have been applied): {str(e)}"
+        return [{"index": index, "ok": False, "status": getattr(e, 'status_code', None), "error": error}
+                for index, _, _, _ in chunk]
+    results = []
+    for index, method, path, data in chunk:
+        status, body = responses.get(str(index), (None, None))
+        results.append(_write_result(index, status, body, 201 if method == "POST" else 200))
+    return results
 
-    def _run(self, input_str: str) -> str:
-        try:
-            parts = input_str.split('|', 2)
-            if len(parts) != 3:
-                raise ValueError
-            table, sys_id, data_str = parts
-            data = json.loads(data_str.strip())
-        except ValueError:
-            return "Error: Input must be in format 'table_name|sys_id|json_data'"
-        except json.JSONDecodeError:
-            return "Error: Invalid JSON data provided."
+def run_bulk_writes(instance_url, writes, max_workers=None):
+    """
+    Runs many table writes concurrently. writes is a list of (method, path, data)
+    with method POST or PUT. Uses the Batch API in chunks of BULK_BATCH_SIZE when
+    SN_USE_BATCH_API is on, otherwise one request per write on a bounded pool.
+    Returns one dict per write, in input order: {"index", "ok", "status", and
+    "sys_id"/"number" or "error"}.
+    """
+    if len(writes) > BULK_MAX_ITEMS:
+        raise ValueError(f"Too many records ({len(writes)}); the limit is {BULK_MAX_ITEMS} per call.")
+    items = [(index, method, path, data) for index, (method, path, data) in enumerate(writes)]
+    if not items:
+        return []
 
-        url = f"{self.instance_url}/api/now/table/{table.strip()}/{sys_id.strip()}"
-        
-        try:
-            response = requests.put(
-                url, 
-                auth=(USERNAME, PASSWORD), 
-                headers={"Content-Type": "application/json"}, 
-                json=data
-            )
-            if response.status_code == 200:
-                result = response.json().get('result', {})
-                return f"Success! Record updated. SysID: {result.get('sys_id')}"
-            else:
-                return f"Error: {response.status_code} - {response.text}"
-        except Exception as e:
-            return f"Connection Failed: {str(e)}"
+    if USE_BATCH_API and len(items) > 1:
+        tasks = [items[i:i + BULK_BATCH_SIZE] for i in range(0, len(items), BULK_BATCH_SIZE)]
+        run = _write_chunk
+    else:
+        tasks = [[item] for item in items]
+        run = lambda url, chunk: [_write_one(url, *chunk[0])]
+
+    workers = min(max_workers or BULK_MAX_WORKERS, len(tasks))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        chunks = list(pool.map(run, [instance_url] * len(tasks), tasks))
+    return [result for chunk in chunks for result in chunk]
 
 def check_connection(instance_url):
     """
     Simple check to verify connectivity and credentials.
     Fetches the current user to validate auth.
     """
-    url = f"{instance_url}/api/now/table/sys_user"
-    params = {
-        'sysparm_limit': 1,
-        'sysparm_fields': 'user_name'
-    }
     try:
-        response = requests.get(
-            url, 
-            auth=(USERNAME, PASSWORD), 
-            headers={"Content-Type": "application/json"}, 
-            params=params,
-            timeout=10
-        )
-        if response.status_code == 200:
-            return {"status": "success", "message": "Successfully connected to ServiceNow!"}
-        elif response.status_code == 401:
-            return {"status": "error", "message": "Authentication Failed. Check SN_USERNAME/SN_PASSWORD in .env"}
-        else:
-            return {"status": "error", "message": f"ServiceNow returned status {response.status_code}"}
+        response = get_client(instance_url).get("/api/now/table/sys_user", params=CONNECTION_PARAMS)
+        return connection_result(response.status_code)
     except Exception as e:
         return {"status": "error", "message": f"Connection Failed: {str(e)}"}
+
+# The CrewAI tools live in agent_tools so that importing this module for stats
+# doesn't pull in crewai. Keep the old import path working.
+_AGENT_TOOLS = ('ServiceNowQueryTool', 'ServiceNowCreateTool', 'ServiceNowUpdateTool')
+
+def __getattr__(name):
+    if name in _AGENT_TOOLS:
+        import agent_tools
+        return getattr(agent_tools, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
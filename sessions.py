@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+import uuid
+
+# --- CONFIGURATION ---
+# Token budget for the verbatim turns sent with each prompt
+SESSION_TOKEN_BUDGET = int(os.getenv("SN_SESSION_TOKEN_BUDGET", "1500"))
+# Turns that are never compacted into the summary (only truncated when over budget)
+SESSION_RECENT_TURNS = int(os.getenv("SN_SESSION_RECENT_TURNS", "4"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SN_SESSION_SUMMARY_TOKENS", "400"))
+SESSION_TTL = float(os.getenv("SN_SESSION_TTL", str(4 * 3600)))
+MAX_SESSIONS = int(os.getenv("SN_MAX_SESSIONS", "500"))
+# Characters of each compacted turn kept in the summary
+SUMMARY_LINE_CHARS = 160
+TRUNCATED_MARKER = " ...[truncated]"
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting
+    return len(text) // 4 + 1
+
+class Session:
+    def __init__(self, session_id=None):
+        self.id = session_id or uuid.uuid4().hex
+        self.turns = []
+        self.summary_lines = []
+        self.compacted = 0
+        self.updated_at = time.time()
+
+    def summary(self):
+        return "\n".join(self.summary_lines)
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "summary": self.summary(),
+            "turns": list(self.turns),
+            "compacted_turns": self.compacted,
+            "history_tokens": sum(estimate_tokens(t["content"]) for t in self.turns),
+            "updated_at": self.updated_at,
+        }
+
+class SessionStore:
+    """
+    Server-side admin conversation history, keyed by session id.
+    Once the verbatim turns exceed SESSION_TOKEN_BUDGET, the oldest ones are
+    compacted into one-line summaries (no LLM call), so the prompt size stays
+    flat however long the conversation runs. Recent turns that are still over
+    budget on their own (e.g. a long result table) are truncated to fit.
+    """
+
+    def __init__(self, token_budget=SESSION_TOKEN_BUDGET, recent_turns=SESSION_RECENT_TURNS, summary_tokens=SESSION_SUMMARY_TOKENS, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.summary_tokens = summary_tokens
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire()
+            return self._sessions.get(session_id)
+
+    def get_or_create(self, session_id=None):
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(session_id)
+                self._sessions[session.id] = session
+                if len(self._sessions) > self.max_sessions:
+                    oldest = min(self._sessions.values(), key=lambda s: s.updated_at)
+                    del self._sessions[oldest.id]
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def append(self, session_id, role, content):
+        session = self.get_or_create(session_id)
+        with self._lock:
+            session.turns.append({"role": role, "content": content})
+            session.updated_at = time.time()
+            self._compact(session)
+        return session
+
+    def prompt_context(self, session_id):
+        """
+        Returns (summary, recent_turns) to put in the agent prompt.
+        """
+        session = self.get_or_create(session_id)
+        with self._lock:
+            return session.summary(), list(session.turns)
+
+    def _compact(self, session):
+        tokens = sum(estimate_tokens(t["content"]) for t in session.turns)
+        while tokens > self.token_budget and len(session.turns) > self.recent_turns:
+            turn = session.turns.pop(0)
+            tokens -= estimate_tokens(turn["content"])
+            text = " ".join(turn["content"].split())
+            if len(text) > SUMMARY_LINE_CHARS:
+                text = text[:SUMMARY_LINE_CHARS] + "..."
+            session.summary_lines.append(f"- {turn['role'].upper()}: {text}")
+            session.compacted += 1
+        if tokens > self.token_budget:
+            self._truncate(session)
+        while len(session.summary_lines) > 1 and estimate_tokens(session.summary()) > self.summary_tokens:
+            session.summary_lines.pop(0)
+
+    def _truncate(self, session):
+        """
+        Cuts the recent turns down to token_budget, shortest first, so each
+        turn keeps at least an even share and short turns stay whole.
+        """
+        turns = session.turns
+        remaining = self.token_budget
+        order = sorted(range(len(turns)), key=lambda i: len(turns[i]["content"]))
+        for n, i in enumerate(order):
+            share = remaining // (len(order) - n)
+            content = turns[i]["content"]
+            if estimate_tokens(content) > share:
+                keep = max(0, (share - 1) * 4 - len(TRUNCATED_MARKER))
+                turns[i] = {**turns[i], "content": content[:keep] + TRUNCATED_MARKER}
+            remaining -= estimate_tokens(turns[i]["content"])
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for session_id in [s.id for s in self._sessions.values() if s.updated_at < cutoff]:
+            del self._sessions[session_id]
+
+sessions = SessionStore()
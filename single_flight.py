@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from metrics import coalesced_requests
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one: the first caller for a
+    key runs the call, and callers arriving while it is in flight wait for
+    and share its result (or exception). Nothing is kept once the call
+    finishes; this is not a cache.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.leaders = 0
+        self.shared = 0
+        self._inflight = {}
+        self._tasks = {}  # async calls, keyed the same way
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            self._count(leader)
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def do_async(self, key, coro_fn):
+        """
+        do() for coroutines on one event loop. A waiter that is cancelled
+        doesn't cancel the shared call.
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(coro_fn())
+                task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self._count(leader)
+        return await asyncio.shield(task)
+
+    def _count(self, leader):
+        if leader:
+            self.leaders += 1
+        else:
+            self.shared += 1
+        coalesced_requests.inc(group=self.name, role="leader" if leader else "shared")
+
+    def stats(self):
+        with self._lock:
+            total = self.leaders + self.shared
+            return {
+                "calls": total,
+                "upstream": self.leaders,
+                "shared": self.shared,
+                "in_flight": len(self._inflight) + len(self._tasks),
+            }
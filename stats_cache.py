@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import log
+from rate_limiter import lane, BACKGROUND
+
+# --- CONFIGURATION ---
+CACHE_MAX_ENTRIES = int(os.getenv("SN_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("SN_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# How long past its TTL an entry may still be served while it refreshes
+CACHE_MAX_STALE = float(os.getenv("SN_CACHE_MAX_STALE", "600"))
+
+# Seconds each metric stays fresh. Slow-moving counts are refreshed less often.
+DEFAULT_TTL = 60
+METRIC_TTLS = {
+    "incidents": 30,
+    "p1_incidents": 30,
+    "unassigned_incidents": 30,
+    "users": 300,
+    "failed_jobs": 120,
+    "active_changes": 60,
+    "today_errors": 60,
+    "recent_updates": 120,
+    "total_business_rules": 600,
+    "failed_logins": 60,
+    "new_admins": 300,
+    "ecc_errors": 60,
+    "errors": 30,
+    "applications": 600,
+}
+
+class StatsCache:
+    """
+    In-process LRU cache with per-entry TTLs and a memory bound.
+    Keys are (instance_url, table, query) tuples. Entries past their TTL are
+    still served (stale-while-revalidate) while a background refresh runs,
+    until they are CACHE_MAX_STALE seconds past it.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, max_stale=CACHE_MAX_STALE, refresh_workers=4):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_stale = max_stale
+        self._entries = OrderedDict() # key -> (value, fetched_at, ttl, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._pool = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="cache-refresh")
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def ttl_for(self, metric):
+        return METRIC_TTLS.get(metric, DEFAULT_TTL)
+
+    def lookup(self, key):
+        """
+        Returns (value, age_seconds, fresh) or None when missing or too stale to serve.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, fetched_at, ttl, _ = entry
+            age = time.time() - fetched_at
+            if age > ttl + self.max_stale:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            fresh = age <= ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return value, age, fresh
+
+    def put(self, key, value, ttl=DEFAULT_TTL):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time(), ttl, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def refresh(self, key, fn):
+        """
+        Runs fn in the background unless a refresh for key is already in flight.
+        fn is expected to put() the new value itself.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                with lane(BACKGROUND):
+                    fn()
+            except Exception as e:
+                log("cache_refresh_failed", level="warning", key=key, error=str(e))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._pool.submit(run)
+
+    def get_or_load(self, key, loader, ttl=DEFAULT_TTL):
+        """
+        Returns (value, age_seconds). Fresh entries are returned as is, stale ones
+        are returned immediately and refreshed in the background, misses are
+        loaded synchronously. loader must raise on failure: nothing is stored
+        then, and a stale value keeps being served until a refresh succeeds.
+        """
+        found = self.lookup(key)
+        if found is not None:
+            value, age, fresh = found
+            if not fresh:
+                self.refresh(key, lambda: self.put(key, loader(), ttl))
+            return value, age
+        value = loader()
+        self.put(key, value, ttl)
+        return value, 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshing": len(self._refreshing),
+            }
+
+    def _remove(self, key):
+        _, _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+cache = StatsCache()
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import threading
+import time
+
+from servicenow_tools import CACHE_DIR
+
+# --- CONFIGURATION ---
+# Bucket size (seconds) -> how long buckets of that size are kept
+RESOLUTIONS = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+}
+RETENTION = {
+    "minute": float(os.getenv("SN_HISTORY_MINUTE_RETENTION", str(2 * 86400))),
+    "hour": float(os.getenv("SN_HISTORY_HOUR_RETENTION", str(90 * 86400))),
+    "day": float(os.getenv("SN_HISTORY_DAY_RETENTION", str(5 * 365 * 86400))),
+}
+# Range queries pick the finest resolution that stays under this many points
+HISTORY_MAX_POINTS = int(os.getenv("SN_HISTORY_MAX_POINTS", "500"))
+PRUNE_INTERVAL = 3600
+
+class StatsHistory:
+    """
+    Local time series of every stat fetched from an instance (SQLite).
+    Each sample is rolled up on write into minute, hour and day buckets
+    holding sum/count/min/max/last, so a range query reads at most
+    HISTORY_MAX_POINTS rows per metric from the primary key index and never
+    touches ServiceNow. Old buckets are pruned per RETENTION.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "stats_history.sqlite3")
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS samples (
+                instance TEXT,
+                metric TEXT,
+                resolution TEXT,
+                bucket INTEGER,
+                total REAL,
+                count INTEGER,
+                min REAL,
+                max REAL,
+                last REAL,
+                PRIMARY KEY (instance, metric, resolution, bucket)
+            ) WITHOUT ROWID
+        """)
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+        self.written = 0
+
+    def record(self, instance_url, values, at=None):
+        """
+        Adds one sample per metric in values (None values are skipped).
+        """
+        at = at or time.time()
+        instance = instance_url.rstrip('/')
+        rows = []
+        for metric, value in values.items():
+            if value is None:
+                continue
+            for resolution, size in RESOLUTIONS.items():
+                rows.append((instance, metric, resolution, int(at // size * size), value, value, value, value))
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("""
+                INSERT INTO samples (instance, metric, resolution, bucket, total, count, min, max, last)
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)
+                ON CONFLICT (instance, metric, resolution, bucket) DO UPDATE SET
+                    total = total + excluded.total,
+                    count = count + 1,
+                    min = MIN(min, excluded.min),
+                    max = MAX(max, excluded.max),
+                    last = excluded.last
+            """, rows)
+            self.written += len(rows)
+            if at - self._pruned_at > PRUNE_INTERVAL:
+                self._prune(at)
+            self._db.commit()
+
+    def _prune(self, now):
+        for resolution, keep in RETENTION.items():
+            self._db.execute("DELETE FROM samples WHERE resolution = ? AND bucket < ?", (resolution, now - keep))
+        self._pruned_at = now
+
+    def pick_resolution(self, start, end):
+        for resolution, size in RESOLUTIONS.items():
+            if (end - start) / size <= HISTORY_MAX_POINTS and start >= time.time() - RETENTION[resolution]:
+                return resolution
+        return "day"
+
+    def query(self, instance_url, metrics, start, end, resolution=None):
+        """
+        Returns (resolution, {metric: [[bucket, avg, min, max, last], ...]}) for
+        buckets starting in [start, end], oldest first.
+        """
+        resolution = resolution or self.pick_resolution(start, end)
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution '{resolution}'. Expected one of: {', '.join(RESOLUTIONS)}")
+        size = RESOLUTIONS[resolution]
+        instance = instance_url.rstrip('/')
+        series = {}
+        with self._lock:
+            for metric in metrics:
+                rows = self._db.execute("""
+                    SELECT bucket, total / count, min, max, last FROM samples
+                    WHERE instance = ? AND metric = ? AND resolution = ? AND bucket BETWEEN ? AND ?
+                    ORDER BY bucket
+                """, (instance, metric, resolution, int(start // size * size), int(end))).fetchall()
+                series[metric] = [[bucket, round(avg, 2), lo, hi, last] for bucket, avg, lo, hi, last in rows]
+        return resolution, series
+
+    def metrics(self, instance_url):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT metric FROM samples WHERE instance = ? AND resolution = 'day'",
+                (instance_url.rstrip('/'),)
+            ).fetchall()
+        return sorted(metric for (metric,) in rows)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT resolution, COUNT(*) FROM samples GROUP BY resolution").fetchall())
+        return {"buckets": counts, "written": self.written}
+
+stats_history = None
+_stats_history_lock = threading.Lock()
+
+def get_stats_history():
+    """
+    Opens the shared on-disk history on first use.
+    """
+    global stats_history
+    if stats_history is None:
+        with _stats_history_lock:
+            if stats_history is None:
+                stats_history = StatsHistory()
+    return stats_history
+
+def record_counts(instance_url, values):
+    """
+    Count observer (see servicenow_tools.add_count_observer).
+    """
+    get_stats_history().record(instance_url, values)
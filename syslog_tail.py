@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from servicenow_tools import get_client, ServiceNowError
+from stats_cache import cache
+
+# --- CONFIGURATION ---
+# Error rows kept in memory per instance
+SYSLOG_BUFFER_SIZE = int(os.getenv("SN_SYSLOG_BUFFER_SIZE", "200"))
+# Rows fetched on the first poll; later polls only ask for rows past the watermark
+SYSLOG_INITIAL_ROWS = int(os.getenv("SN_SYSLOG_INITIAL_ROWS", "50"))
+SYSLOG_FIELDS = 'sys_created_on,source,message,sys_id'
+SYSLOG_ERROR_QUERY = 'level=2'
+
+class SyslogTailer:
+    """
+    Incremental tail of syslog errors (level=2) for one instance.
+    Remembers the newest sys_created_on seen and only asks for rows at or past
+    it, so a refresh is one small indexed query however big syslog is. Rows
+    go into a bounded ring buffer, each tagged with a sequence number that
+    clients use as a cursor for delta reads.
+
+    If more rows arrive between polls than one query returns, only the newest
+    are kept; the error panel shows recent errors, not a complete log.
+    """
+
+    def __init__(self, instance_url, buffer_size=SYSLOG_BUFFER_SIZE, initial_rows=SYSLOG_INITIAL_ROWS):
+        self.instance_url = instance_url
+        self.buffer_size = buffer_size
+        self.initial_rows = initial_rows
+        # Cursors from another process (or before a restart) must not be trusted
+        self.epoch = uuid.uuid4().hex[:8]
+        self.watermark = ""  # sys_created_on of the newest row seen
+        self.polled_at = 0.0
+        self.polls = 0
+        self._rows = deque(maxlen=buffer_size)  # (seq, row), oldest first
+        self._seen = set()  # sys_ids in the buffer
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+
+    def poll(self):
+        """
+        Fetches rows newer than the watermark into the buffer. Returns how many were new.
+        """
+        if self.watermark:
+            # >= so rows logged in the same second as the watermark aren't missed;
+            # rows already in the buffer are skipped by sys_id.
+            query = f"{SYSLOG_ERROR_QUERY}^sys_created_on>={self.watermark}^ORDERBYDESCsys_created_on"
+            limit = self.buffer_size
+        else:
+            query = f"{SYSLOG_ERROR_QUERY}^ORDERBYDESCsys_created_on"
+            limit = self.initial_rows
+        params = {
+            'sysparm_query': query,
+            'sysparm_fields': SYSLOG_FIELDS,
+            'sysparm_limit': limit,
+            'sysparm_no_count': 'true'
+        }
+        response = get_client(self.instance_url).get("/api/now/table/syslog", params=params)
+        if response.status_code != 200:
+            raise ServiceNowError(response.status_code, response.text[:200])
+        rows = response.json().get('result', [])
+
+        added = 0
+        with self._lock:
+            for row in reversed(rows):
+                sys_id = row.get('sys_id')
+                if sys_id in self._seen:
+                    continue
+                if len(self._rows) == self._rows.maxlen:
+                    self._seen.discard(self._rows[0][1].get('sys_id'))
+                self._seq += 1
+                self._rows.append((self._seq, row))
+                self._seen.add(sys_id)
+                self.watermark = max(self.watermark, row.get('sys_created_on', ''))
+                added += 1
+            self.polled_at = time.time()
+            self.polls += 1
+        return added
+
+    def refresh(self, max_age):
+        """
+        Polls unless the last poll is younger than max_age seconds. Concurrent
+        callers share one poll. Returns the age of the buffer.
+        """
+        with self._poll_lock:
+            if time.time() - self.polled_at >= max_age:
+                self.poll()
+        return time.time() - self.polled_at
+
+    def cursor(self):
+        return f"{self.epoch}:{self._seq}"
+
+    def since(self, cursor=None):
+        """
+        Returns {"rows", "cursor", "reset"} with rows newer than cursor, newest
+        first. reset is true when the cursor can't be honoured (unknown epoch
+        or already evicted) and the whole buffer is returned instead.
+        """
+        epoch, _, seq = (cursor or '').partition(':')
+        try:
+            seq = int(seq) if epoch == self.epoch else None
+        except ValueError:
+            seq = None
+        with self._lock:
+            oldest = self._rows[0][0] if self._rows else self._seq + 1
+            reset = seq is None or seq < oldest - 1
+            rows = [row for s, row in self._rows if reset or s > seq]
+            return {"rows": rows[::-1], "cursor": self.cursor(), "reset": reset}
+
+    def latest(self, limit):
+        with self._lock:
+            return [row for _, row in list(self._rows)[-limit:]][::-1]
+
+    def stats(self):
+        with self._lock:
+            return {"buffered": len(self._rows), "watermark": self.watermark, "polls": self.polls, "cursor": self.cursor()}
+
+_tailers = {}
+_tailers_lock = threading.Lock()
+
+def get_tailer(instance_url):
+    key = instance_url.rstrip('/')
+    with _tailers_lock:
+        tailer = _tailers.get(key)
+        if tailer is None:
+            tailer = _tailers[key] = SyslogTailer(key)
+        return tailer
+
+def tailer_stats():
+    with _tailers_lock:
+        tailers = list(_tailers.items())
+    return {url: tailer.stats() for url, tailer in tailers}
+
+def tail_errors(instance_url, cursor=None):
+    """
+    Refreshes the instance's tailer if its data is older than the 'errors' TTL
+    and returns the rows past cursor (all buffered rows without one) plus data_age.
+    """
+    tailer = get_tailer(instance_url)
+    age = tailer.refresh(cache.ttl_for('errors'))
+    return {**tailer.since(cursor), "data_age": age}
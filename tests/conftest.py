@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# CACHE_DIR is read when servicenow_tools is first imported, which happens
+# while test modules are collected, so point it at a scratch directory now.
+# Otherwise importing server registers the stats history recorder and mock
+# counts end up in the real .snowagent_cache.
+TEST_CACHE_DIR = tempfile.mkdtemp(prefix="snowagent-test-cache-")
+os.environ["SN_CACHE_DIR"] = TEST_CACHE_DIR
+
+import mock_servicenow
+
+@pytest.fixture(scope="session", autouse=True)
+def cache_dir():
+    """
+    The scratch SN_CACHE_DIR for the run (stats history, analysis cache,
+    schema indexes); removed afterwards.
+    """
+    import servicenow_tools
+    assert servicenow_tools.CACHE_DIR == TEST_CACHE_DIR
+    yield TEST_CACHE_DIR
+    shutil.rmtree(TEST_CACHE_DIR, ignore_errors=True)
+
+@pytest.fixture(scope="session")
+def mock_instance():
+    """
+    One seeded mock ServiceNow instance for the whole run: (instance, base_url).
+    """
+    server, instance, url = mock_servicenow.start(scale=0.2)
+    yield instance, url
+    server.shutdown()
+
+@pytest.fixture
+def mock(mock_instance):
+    instance, url = mock_instance
+    instance.reset()
+    instance.profile = dict(mock_servicenow.DEFAULT_PROFILE)
+    return instance, url
+
+def count_rows(instance, table, query):
+    """
+    Ground truth from the mock's own data.
+    """
+    predicate, _ = mock_servicenow.parse_query(query)
+    return sum(1 for row in instance.tables[table] if predicate(row))
+
+def upstream_calls(instance, prefix):
+    return sum(v for k, v in instance.stats()["counts"].items() if k.startswith(prefix))
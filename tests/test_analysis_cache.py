@@ -0,0 +1,34 @@
+import pytest
+
+from analysis_cache import AnalysisCache, normalize, fingerprint
+
+@pytest.mark.parametrize("a, b", [
+    ("Record 46d44a23a9fe19810012d100cca80666 not found", "Record 9a1b2c3d4e5f60718293a4b5c6d7e8f9 not found"),
+    ("Approval failed for INC0010023", "Approval failed for INC0099871"),
+    ("Job ran at 2024-05-01 10:15:02 and failed", "Job ran at 2024-06-12 23:01:44 and failed"),
+    ("TypeError: x is undefined (line 42)", "TypeError: x is undefined (line 7)"),
+    ("Evaluator: sys_script_include.Util.script:12:5 null", "Evaluator: sys_script_include.Util.script:88:1 null"),
+])
+def test_variable_parts_share_a_fingerprint(a, b):
+    assert normalize(a) == normalize(b)
+    assert fingerprint(a) == fingerprint(b)
+
+@pytest.mark.parametrize("a, b", [
+    ("Business rule HTTP 401 returned", "Business rule HTTP 500 returned"),
+    ("REST message returned status:404", "REST message returned status:503"),
+    ("Query exceeded 10000 rows", "Query exceeded 500 rows"),
+    ("Error code 0x80070005", "Error code 0x80004005"),
+])
+def test_different_errors_do_not_collide(a, b):
+    assert fingerprint(a) != fingerprint(b)
+
+def test_normalize_keeps_status_codes():
+    assert normalize("Got  HTTP 429 for INC0012345") == "got http 429 for <number>"
+
+def test_same_fingerprint_is_analysed_once(tmp_path):
+    cache = AnalysisCache(path=str(tmp_path / "analysis.sqlite3"))
+    calls = []
+    first, cached = cache.get_or_compute("Failed on line 3", lambda: calls.append(1) or "analysis")
+    assert (first, cached) == ("analysis", False)
+    assert cache.get_or_compute("Failed on line 99", lambda: calls.append(1) or "other") == ("analysis", True)
+    assert len(calls) == 1
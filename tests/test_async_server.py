@@ -0,0 +1,93 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+pytest.importorskip("aiohttp")
+from aiohttp import web
+
+import async_server
+import servicenow_tools as sn
+import server
+from count_planner import plan_counts
+from job_queue import jobs
+from stats_cache import cache
+from conftest import count_rows, upstream_calls
+
+@pytest.fixture(scope="module")
+def async_app():
+    """
+    The async app served from its own event loop thread. Returns its base URL.
+    """
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(async_server.create_app(server))
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{runner.addresses[0][1]}"
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+
+def test_errors_are_not_starved_by_job_long_polls(mock, async_app, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(async_server, "bridge_pool", ThreadPoolExecutor(max_workers=2))
+    job = jobs.submit('test_wait', time.sleep, 3)
+    with ThreadPoolExecutor(max_workers=2) as clients:
+        polls = [clients.submit(requests.get, f"{async_app}/jobs/{job['job_id']}", params={"wait": 3}) for _ in range(2)]
+        time.sleep(0.3)
+        started = time.monotonic()
+        res = requests.get(f"{async_app}/errors", params={"instance_url": url}, timeout=10)
+        elapsed = time.monotonic() - started
+        assert res.status_code == 200
+        assert elapsed < 1.5
+        for poll in polls:
+            assert poll.result().status_code == 200
+
+@pytest.mark.parametrize("batch", [True, False])
+def test_instance_stats_match_the_mock(mock, async_app, monkeypatch, batch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", batch)
+    cache.clear()
+    queries = sn.INSTANCE_STAT_QUERIES
+    stats = requests.get(f"{async_app}/instance_stats", params={"instance_url": url}, timeout=10).json()
+    assert stats["errors"] == {}
+    assert {m: stats[m] for m in queries} == {m: count_rows(instance, t, q) for m, (t, q) in queries.items()}
+    if batch:
+        assert upstream_calls(instance, "batch") == 1
+    else:
+        assert upstream_calls(instance, "stats:") == len(plan_counts(queries))
+
+    # Served from cache the second time
+    instance.reset()
+    again = requests.get(f"{async_app}/instance_stats", params={"instance_url": url}, timeout=10).json()
+    assert {m: again[m] for m in queries} == {m: stats[m] for m in queries}
+    assert upstream_calls(instance, "stats:") + upstream_calls(instance, "batch") == 0
+
+def test_records_stream(mock, async_app):
+    instance, url = mock
+    res = requests.post(f"{async_app}/records", json={
+        "instance_url": url, "table": "incident", "query": "active=true", "fields": "number", "limit": 7
+    }, timeout=10)
+    assert res.status_code == 200
+    rows = [json.loads(line) for line in res.text.splitlines()]
+    assert len(rows) == min(7, count_rows(instance, 'incident', 'active=true'))
+    assert all(set(row) == {"number"} for row in rows)
+
+def test_records_rejects_bad_limit(async_app):
+    res = requests.post(f"{async_app}/records", json={
+        "instance_url": "http://unused", "table": "incident", "query": "active=true", "limit": "-1"
+    }, timeout=10)
+    assert res.status_code == 400
+    assert "limit" in res.json()["error"]
+
+def test_test_connection(mock, async_app):
+    instance, url = mock
+    res = requests.post(f"{async_app}/test_connection", json={"instance_url": url}, timeout=10)
+    assert res.json()["status"] == "success"
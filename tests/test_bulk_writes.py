@@ -0,0 +1,91 @@
+import pytest
+
+import servicenow_tools as sn
+from conftest import upstream_calls
+
+def _row(instance, table, sys_id):
+    return next((r for r in instance.tables[table] if r['sys_id'] == sys_id), None)
+
+def test_creates_one_request_each(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", False)
+    writes = [("POST", "/api/now/table/problem", {"short_description": f"Bulk {i}"}) for i in range(5)]
+    results = sn.run_bulk_writes(url, writes)
+    assert [r["index"] for r in results] == list(range(5))
+    assert all(r["ok"] and r["status"] == 201 for r in results)
+    assert [_row(instance, 'problem', r["sys_id"])["short_description"] for r in results] == [f"Bulk {i}" for i in range(5)]
+    assert upstream_calls(instance, "table:problem") == 5
+
+def test_updates_in_batch_chunks(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    monkeypatch.setattr(sn, "BULK_BATCH_SIZE", 2)
+    ids = [r['sys_id'] for r in instance.tables['problem'][:3]]
+    results = sn.run_bulk_writes(url, [("PUT", f"/api/now/table/problem/{i}", {"state": "3"}) for i in ids])
+    assert all(r["ok"] and r["status"] == 200 for r in results)
+    assert [_row(instance, 'problem', i)["state"] for i in ids] == ["3"] * 3
+    assert upstream_calls(instance, "batch") == 2
+
+def test_failures_are_reported_per_item(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    good = instance.tables['problem'][0]['sys_id']
+    results = sn.run_bulk_writes(url, [
+        ("PUT", f"/api/now/table/problem/{good}", {"state": "2"}),
+        ("PUT", "/api/now/table/problem/doesnotexist", {"state": "2"}),
+    ])
+    assert results[0]["ok"]
+    assert not results[1]["ok"]
+    assert results[1]["status"] == 404
+    assert results[1]["error"] == "No Record found"
+
+def test_falls_back_to_single_writes_without_batch_api(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    monkeypatch.setattr(instance, "batch", lambda payload: (400, {"error": {"message": "Batch API disabled"}}, {}))
+    results = sn.run_bulk_writes(url, [("POST", "/api/now/table/problem", {"short_description": "Fallback"})] * 3)
+    assert all(r["ok"] for r in results)
+    assert upstream_calls(instance, "table:problem") == 3
+
+def test_applied_batch_that_then_fails_is_not_resent(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    apply = instance.batch
+    def applied_then_503(payload):
+        apply(payload)
+        return 503, {"error": {"message": "Service Unavailable"}}, {}
+    monkeypatch.setattr(instance, "batch", applied_then_503)
+    before = len(instance.tables['problem'])
+    results = sn.run_bulk_writes(url, [("POST", "/api/now/table/problem", {"short_description": "Once"})] * 3)
+    assert not any(r["ok"] for r in results)
+    assert all(r["status"] == 503 and "not retried" in r["error"] for r in results)
+    assert len(instance.tables['problem']) == before + 3
+    assert upstream_calls(instance, "batch") == 1
+    assert upstream_calls(instance, "table:problem") == 3
+
+def test_batch_exception_after_send_is_not_resent(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    send = sn._send_batch
+    def applied_then_timeout(instance_url, rest_requests, timeout=None):
+        send(instance_url, rest_requests, timeout)
+        raise sn.requests.exceptions.ReadTimeout("Read timed out")
+    monkeypatch.setattr(sn, "_send_batch", applied_then_timeout)
+    before = len(instance.tables['problem'])
+    results = sn.run_bulk_writes(url, [("POST", "/api/now/table/problem", {"short_description": "Once"})] * 3)
+    assert not any(r["ok"] for r in results)
+    assert len(instance.tables['problem']) == before + 3
+    assert upstream_calls(instance, "batch") == 1
+    assert upstream_calls(instance, "table:problem") == 3
+
+def test_falls_back_when_the_connection_is_refused(monkeypatch):
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    sent = []
+    monkeypatch.setattr(sn, "_write_one", lambda url, index, *args: sent.append(index) or {"index": index, "ok": False})
+    sn.run_bulk_writes("http://127.0.0.1:9", [("POST", "/api/now/table/problem", {})] * 2)
+    assert sent == [0, 1]
+
+def test_rejects_too_many_items(monkeypatch):
+    monkeypatch.setattr(sn, "BULK_MAX_ITEMS", 2)
+    with pytest.raises(ValueError):
+        sn.run_bulk_writes("http://unused", [("POST", "/api/now/table/problem", {})] * 3)
@@ -0,0 +1,104 @@
+import pytest
+
+import servicenow_tools as sn
+from count_planner import plan_counts, call_params, split_results
+from conftest import count_rows, upstream_calls
+
+# --- PLANNER ---
+def test_group_selectors_merge_into_one_call():
+    calls = plan_counts({
+        "open": ('incident', 'active=true'),
+        "p1": ('incident', 'active=true^priority=1'),
+        "p2": ('incident', 'active=true^priority=2'),
+    })
+    assert calls == [{
+        "table": 'incident',
+        "query": 'active=true',
+        "group_by": 'priority',
+        "metrics": {"open": None, "p1": ('priority', '1'), "p2": ('priority', '2')},
+    }]
+
+def test_identical_queries_share_a_call():
+    calls = plan_counts({"a": ('sys_user', 'active=true'), "b": ('sys_user', 'active=true')})
+    assert len(calls) == 1
+    assert calls[0]["group_by"] is None
+    assert set(calls[0]["metrics"]) == {"a", "b"}
+
+def test_unmergeable_queries_stay_separate():
+    calls = plan_counts({
+        "p1": ('incident', 'active=true^priority=1'),
+        "either": ('incident', 'active=true^ORpriority=2'),
+        "unassigned": ('incident', 'active=true^assigned_toISEMPTY'),
+    })
+    assert sorted(c["query"] for c in calls) == sorted([
+        'active=true^priority=1', 'active=true^ORpriority=2', 'active=true^assigned_toISEMPTY',
+    ])
+    assert all(c["group_by"] is None for c in calls)
+
+def test_tables_are_planned_separately():
+    calls = plan_counts({"users": ('sys_user', 'active=true'), "incidents": ('incident', 'active=true')})
+    assert sorted(c["table"] for c in calls) == ['incident', 'sys_user']
+
+def test_call_params():
+    assert call_params({"query": 'active=true', "group_by": None}) == {'sysparm_count': 'true', 'sysparm_query': 'active=true'}
+    assert call_params({"query": 'active=true', "group_by": 'priority'})['sysparm_group_by'] == 'priority'
+
+def test_split_results_total():
+    call = {"group_by": None, "metrics": {"a": None, "b": None}}
+    assert split_results(call, {"stats": {"count": "7"}}) == {"a": 7, "b": 7}
+
+def test_split_results_grouped():
+    call = {"group_by": 'priority', "metrics": {"all": None, "p1": ('priority', '1'), "p5": ('priority', '5')}}
+    result = [
+        {"stats": {"count": "3"}, "groupby_fields": [{"field": 'priority', "value": '1'}]},
+        {"stats": {"count": "4"}, "groupby_fields": [{"field": 'priority', "value": '2'}]},
+    ]
+    # A group with no rows is absent from the response and counts as 0
+    assert split_results(call, result) == {"all": 7, "p1": 3, "p5": 0}
+
+# --- AGAINST THE MOCK ---
+def _expected(instance, queries):
+    return {metric: count_rows(instance, table, query) for metric, (table, query) in queries.items()}
+
+def test_counts_match_and_use_one_call_per_plan(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", False)
+    queries = sn.INSTANCE_STAT_QUERIES
+    result = sn.run_count_queries(url, queries)
+    assert result["errors"] == {}
+    assert {m: result[m] for m in queries} == _expected(instance, queries)
+    assert upstream_calls(instance, "stats:") == len(plan_counts(queries))
+    assert upstream_calls(instance, "batch") == 0
+
+def test_batch_api_sends_one_request(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    queries = sn.INSTANCE_STAT_QUERIES
+    result = sn.run_count_queries(url, queries)
+    assert result["errors"] == {}
+    assert {m: result[m] for m in queries} == _expected(instance, queries)
+    assert upstream_calls(instance, "batch") == 1
+
+def test_falls_back_to_single_calls_without_batch_api(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", True)
+    monkeypatch.setattr(instance, "batch", lambda payload: (400, {"error": {"message": "Batch API disabled"}}, {}))
+    queries = sn.SECURITY_STAT_QUERIES
+    result = sn.run_count_queries(url, queries)
+    assert result["errors"] == {}
+    assert {m: result[m] for m in queries} == _expected(instance, queries)
+    assert upstream_calls(instance, "stats:") == len(plan_counts(queries))
+
+def test_failed_metric_is_none_not_zero(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(sn, "USE_BATCH_API", False)
+    result = sn.run_count_queries(url, {"users": ('sys_user', 'active=true'), "missing": ('no_such_table', 'active=true')})
+    assert result["users"] == count_rows(instance, 'sys_user', 'active=true')
+    assert result["missing"] is None
+    assert "missing" in result["errors"]
+
+@pytest.mark.parametrize("metric", ["incidents", "p1_incidents"])
+def test_fetch_count(mock, metric):
+    instance, url = mock
+    table, query = sn.INSTANCE_STAT_QUERIES[metric]
+    assert sn.fetch_count(url, table, query) == count_rows(instance, table, query)
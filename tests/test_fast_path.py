@@ -0,0 +1,80 @@
+import pytest
+
+import fast_path
+import server
+from fast_path import match_command, run_fast_path, FAST_PATH_MAX_ROWS
+from conftest import count_rows
+
+# --- ROUTES ---
+@pytest.mark.parametrize("command, route, table, query", [
+    ("list the last 5 business rules", "last_records", "sys_script", "ORDERBYDESCsys_created_on"),
+    ("Show me the 3 most recent updated client scripts.", "last_records", "sys_script_client", "ORDERBYDESCsys_updated_on"),
+    ("latest errors", "last_records", "syslog", "level=2^ORDERBYDESCsys_created_on"),
+    ("find user with email jane.doe@example.com", "user_by_email", "sys_user", "email=jane.doe@example.com"),
+    ("user with email address: a.b+c@corp.co.uk", "user_by_email", "sys_user", "email=a.b+c@corp.co.uk"),
+    ("get user with user name admin", "user_by_name", "sys_user", "user_name=admin"),
+    ("show P1 incidents", "priority_incidents", "incident", "active=true^priority=1^ORDERBYDESCsys_created_on"),
+    ("list all open priority 2 incidents", "priority_incidents", "incident", "active=true^priority=2^ORDERBYDESCsys_created_on"),
+    ("show unassigned incidents", "unassigned_incidents", "incident", "active=true^assigned_toISEMPTY^ORDERBYDESCsys_created_on"),
+    ("INC0010023", "record_by_number", "incident", "number=INC0010023"),
+    ("show change CHG0030001?", "record_by_number", "change_request", "number=CHG0030001"),
+])
+def test_routes_match(command, route, table, query):
+    name, spec = match_command(command)
+    assert (name, spec["table"], spec["query"]) == (route, table, query)
+
+@pytest.mark.parametrize("command", [
+    "list the last 5 business rules that mention approval",
+    "list the last 5 widgets",
+    "list the last 0 incidents",
+    "find user with email jane.doe",
+    "find users who logged in today",
+    "show P6 incidents",
+    "show P1 incidents assigned to me",
+    "show unassigned problems",
+    "INC123",
+    "XYZ0010023",
+    "why is INC0010023 still open",
+])
+def test_near_misses_go_to_the_agent(command):
+    assert match_command(command) is None
+
+def test_row_limit_is_capped():
+    _, spec = match_command(f"last {FAST_PATH_MAX_ROWS + 10} incidents")
+    assert spec["limit"] == FAST_PATH_MAX_ROWS
+    assert "limited to" in spec["title"]
+
+# --- EXECUTION ---
+def test_answers_from_the_instance(mock):
+    instance, url = mock
+    name, result = run_fast_path("show P1 incidents", url)
+    assert name == "priority_incidents"
+    assert result.startswith("Open P1 incidents:")
+    assert str(count_rows(instance, 'incident', 'active=true^priority=1')) in result
+
+def test_unmatched_command_goes_to_the_agent(mock):
+    instance, url = mock
+    before = fast_path.fast_path_stats()["commands"]
+    assert run_fast_path("summarize yesterday's failed jobs", url) is None
+    assert fast_path.fast_path_stats()["commands"] == before + 1
+    assert instance.stats()["total"] == 0
+
+def test_failed_query_goes_to_the_agent(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.delitem(instance.tables, 'sys_script')
+    before = fast_path.fast_path_stats()["failed"]
+    assert run_fast_path("list the last 5 business rules", url) is None
+    assert fast_path.fast_path_stats()["failed"] == before + 1
+
+def test_admin_command_does_not_record_a_failed_fast_path(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.delitem(instance.tables, 'sys_script')
+    monkeypatch.setattr(server, "run_admin_command", lambda command, url, recent, summary: "agent answer")
+    res = server.app.test_client().post('/admin_command', json={"command": "list the last 5 business rules", "instance_url": url})
+    assert res.status_code == 202
+    body = res.get_json()
+    assert "fast_path" not in body
+    job = server.jobs.get(body["job_id"], wait=5)
+    assert job["result"] == "agent answer"
+    turns = server.sessions.get(body["session_id"]).turns
+    assert [t["content"] for t in turns] == ["list the last 5 business rules", "agent answer"]
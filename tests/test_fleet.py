@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import fleet
+import servicenow_tools as sn
+from count_planner import plan_counts
+from conftest import count_rows, upstream_calls
+
+@pytest.fixture
+def instance(mock, monkeypatch):
+    monkeypatch.setattr(sn, "USE_BATCH_API", False)
+    monkeypatch.setattr(fleet, "FLEET_INSTANCE_TIMEOUT", 0.5)
+    fleet._down.clear()
+    yield mock
+    fleet._down.clear()
+
+def test_counts_match_the_mock(instance):
+    mock, url = instance
+    result = fleet.fleet_stats([url], ["stats"])
+    row = dict(zip(result["columns"], result["rows"][0]))
+    assert row["status"] == "ok"
+    for metric, (table, query) in sn.INSTANCE_STAT_QUERIES.items():
+        assert row[metric] == count_rows(mock, table, query)
+
+def test_slow_instance_times_out_and_is_marked_down(instance):
+    mock, url = instance
+    mock.profile["latency_ms"] = 2000
+    started = time.monotonic()
+    result = fleet.fleet_stats([url], ["stats"])
+    assert result["rows"][0][1] == "timeout"
+    assert time.monotonic() - started < 1.5
+    # The worker is given back rather than held for every query's own timeout
+    deadline = time.monotonic() + 2
+    while fleet._inflight and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not fleet._inflight
+    assert fleet.fleet_stats([url], ["stats"])["rows"][0][1] == "down"
+
+def test_concurrent_requests_share_one_run_per_instance(instance, monkeypatch):
+    mock, url = instance
+    monkeypatch.setattr(fleet, "FLEET_INSTANCE_TIMEOUT", 5)
+    mock.profile["latency_ms"] = 200
+    runs = []
+    def counted(*args, **kwargs):
+        runs.append(args[0])
+        return sn.run_count_queries(*args, **kwargs)
+    monkeypatch.setattr(fleet, "run_count_queries", counted)
+    with ThreadPoolExecutor(max_workers=3) as clients:
+        results = list(clients.map(lambda _: fleet.fleet_stats([url], ["stats"]), range(3)))
+    assert all(r["rows"][0][1] == "ok" for r in results)
+    assert runs == [url]
+    assert upstream_calls(mock, "stats:") == len(plan_counts(sn.INSTANCE_STAT_QUERIES))
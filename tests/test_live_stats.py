@@ -0,0 +1,30 @@
+import queue
+
+import live_stats
+from stats_cache import cache
+from conftest import count_rows
+
+def test_changes_are_pushed_on_the_next_poll(mock, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(live_stats.StatsPoller, "interval_for", lambda self, metric: 0.2)
+    monkeypatch.setattr(live_stats, "POLL_IDLE_GRACE", 0.5)
+    queries = {"incidents": ('incident', 'active=true')}
+    poller = live_stats.StatsPoller(url, queries)
+    q = poller.subscribe()
+    try:
+        snapshot = q.get(timeout=5)
+        before = count_rows(instance, 'incident', 'active=true')
+        assert snapshot["type"] == "snapshot"
+        assert snapshot["values"] == {"incidents": before}
+
+        instance.tables['incident'].append({'sys_id': 'live-test', 'active': 'true', 'number': 'INC9999999'})
+        # One poll interval plus the call itself, not a further interval on top
+        delta = q.get(timeout=1.0)
+        assert delta["type"] == "delta"
+        assert delta["values"] == {"incidents": before + 1}
+        assert cache.lookup((url, 'incident', 'active=true'))[0] == before + 1
+    except queue.Empty:
+        raise AssertionError("no delta within one poll interval")
+    finally:
+        instance.tables['incident'].remove(next(r for r in instance.tables['incident'] if r['sys_id'] == 'live-test'))
+        poller.unsubscribe(q)
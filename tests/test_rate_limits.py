@@ -0,0 +1,20 @@
+import servicenow_tools as sn
+from rate_limiter import get_limiter
+
+def test_429s_are_retried_through_the_rate_limiter(mock, monkeypatch):
+    instance, url = mock
+    instance.profile["throttle_rate"] = 1.0
+    # Its own host name, so the backed-off limiter isn't shared with other tests
+    client = sn.ServiceNowClient(url.replace("127.0.0.1", "localhost"), max_retries=2)
+    limiter = get_limiter(client.instance_url)
+    acquired = []
+    acquire = limiter.acquire
+    monkeypatch.setattr(limiter, "acquire", lambda *args: acquired.append(1) or acquire(*args))
+
+    # A table nothing else reads, so background calls to the mock aren't counted
+    response = client.request('GET', "/api/now/table/u_throttle_test", params={"sysparm_limit": 1})
+    assert response.status_code == 429
+    # The first try plus max_retries, none of them retried again inside urllib3
+    assert instance.stats()["counts"]["table:u_throttle_test"] == 3
+    assert len(acquired) == 3
+    assert limiter.stats()["throttled"] == 3
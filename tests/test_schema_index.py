@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from mock_servicenow import _sys_id
+from schema_index import SchemaIndex
+
+@pytest.fixture
+def index(mock, tmp_path):
+    instance, url = mock
+    index = SchemaIndex(url, path=str(tmp_path / "schema.json"))
+    index.rebuild()
+    return index
+
+def test_rebuild_loads_tables_and_fields(mock, index):
+    instance, _ = mock
+    assert set(index.tables) == {r['name'] for r in instance.tables['sys_db_object']}
+    assert index.tables['incident']["super_class"] == 'task'
+    assert {'number', 'priority', 'short_description'} <= set(index.table_fields('incident'))
+
+def test_lookup_tables_and_fields(index):
+    assert index.lookup('incid')[0][0] == 'incident'
+    assert index.lookup('Change Request')[0][0] == 'change_request'
+    assert index.lookup('incdent')[0][0] == 'incident'
+    assert index.lookup('short desc', table='incident')[0][0] == 'short_description'
+
+def test_validate_suggests_names(index):
+    assert index.validate('incident', {"priority": "1"}) == []
+    assert "Did you mean: incident" in index.validate('incidnt', {})[0]
+    problems = index.validate('incident', {"priorty": "1"})
+    assert problems == ["Unknown field 'priorty' on incident (did you mean: priority?)"]
+
+def test_index_is_reused_from_disk(mock, index):
+    instance, url = mock
+    instance.reset()
+    reloaded = SchemaIndex(url, path=index.path)
+    assert reloaded.is_loaded()
+    assert reloaded.lookup('incident')[0][0] == 'incident'
+    assert instance.stats()["total"] == 0
+
+def test_refresh_fetches_only_newer_metadata(mock, index):
+    instance, _ = mock
+    instance.tables['sys_dictionary'].append({
+        'sys_id': _sys_id(random.Random(1)), 'name': 'incident', 'element': 'u_region', 'column_label': 'Region',
+        'internal_type': 'string', 'mandatory': 'false', 'sys_updated_on': '2099-01-01 00:00:00',
+    })
+    try:
+        index.refresh()
+        assert 'u_region' in index.table_fields('incident')
+        assert index.watermark == '2099-01-01 00:00:00'
+    finally:
+        instance.tables['sys_dictionary'].pop()
@@ -0,0 +1,56 @@
+import pytest
+
+import server
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+@pytest.mark.parametrize("limit", ["abc", -5, 0, None, [1]])
+def test_records_rejects_bad_limit(client, limit):
+    res = client.post('/records', json={"instance_url": "http://unused", "table": "incident", "query": "active=true", "limit": limit})
+    assert res.status_code == 400
+    assert "limit" in res.get_json()["error"]
+
+def test_records_limit_is_capped(mock, client, monkeypatch):
+    instance, url = mock
+    monkeypatch.setattr(server, "RECORDS_MAX", 3)
+    res = client.post('/records', json={"instance_url": url, "table": "incident", "query": "active=true", "limit": "50"})
+    assert res.status_code == 200
+    assert len(res.get_data(as_text=True).splitlines()) == 3
+
+@pytest.mark.parametrize("wait", ["soon", "nan", ""])
+def test_get_job_rejects_bad_wait(client, wait):
+    res = client.get('/jobs/missing', query_string={"wait": wait})
+    assert res.status_code == 400
+    assert "wait" in res.get_json()["error"]
+
+@pytest.mark.parametrize("wait, expected", [("-5", 0.0), ("2.5", 2.5), ("3600", server.JOB_MAX_WAIT)])
+def test_get_job_clamps_wait(client, monkeypatch, wait, expected):
+    waits = []
+    monkeypatch.setattr(server.jobs, "get", lambda job_id, wait: waits.append(wait))
+    assert client.get('/jobs/missing', query_string={"wait": wait}).status_code == 404
+    assert waits == [expected]
+
+@pytest.mark.parametrize("args", [
+    {"end": "inf"},
+    {"start": "nan"},
+    {"start": "-inf", "end": "nan", "metrics": "incidents"},
+    {"start": "yesterday"},
+])
+def test_stats_history_rejects_bad_range(client, args):
+    res = client.get('/stats_history', query_string={"instance_url": "http://unused", **args})
+    assert res.status_code == 400
+    assert res.get_json() == {"error": "start and end must be epoch seconds"}
+
+def test_metrics_report_cache_and_tailer_state(mock, client):
+    instance, url = mock
+    server.cache.clear()
+    assert client.get('/instance_stats', query_string={"instance_url": url}).status_code == 200
+    assert client.get('/errors', query_string={"instance_url": url}).status_code == 200
+    text = client.get('/metrics').get_data(as_text=True)
+    entries = next(line for line in text.splitlines() if line.startswith("snowagent_stats_cache_entries "))
+    assert int(entries.split()[1]) == server.cache.stats()["entries"] > 0
+    assert f'snowagent_syslog_polls_total{{instance="{url}"}}' in text
+    assert 'snowagent_single_flight_in_flight{group="read"} ' in text
+    assert "# TYPE snowagent_stats_cache_lookups_total counter" in text
@@ -0,0 +1,26 @@
+from sessions import SessionStore, TRUNCATED_MARKER, estimate_tokens
+
+def _history_tokens(session):
+    return sum(estimate_tokens(t["content"]) for t in session.turns)
+
+def test_old_turns_are_compacted_into_the_summary():
+    store = SessionStore(token_budget=100, recent_turns=2)
+    for i in range(6):
+        session = store.append("s", "user", f"question {i} " + "x" * 150)
+    assert len(session.turns) == 2
+    assert session.compacted == 4
+    assert session.summary().startswith("- USER: question")
+
+def test_oversized_recent_turns_are_truncated_to_the_budget():
+    store = SessionStore(token_budget=200, recent_turns=4)
+    store.append("s", "user", "list the last 50 incidents")
+    session = store.append("s", "ai", "row\n" * 5000)
+    assert _history_tokens(session) <= 200
+    assert session.turns[0]["content"] == "list the last 50 incidents"
+    assert session.turns[1]["content"].endswith(TRUNCATED_MARKER)
+
+def test_turns_within_budget_are_left_alone():
+    store = SessionStore(token_budget=200, recent_turns=4)
+    store.append("s", "user", "hello")
+    session = store.append("s", "ai", "hi there")
+    assert [t["content"] for t in session.turns] == ["hello", "hi there"]
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+import servicenow_tools as sn
+from stats_cache import StatsCache
+
+def _wait_idle(cache, key):
+    deadline = time.monotonic() + 5
+    while key in cache._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def fail():
+    raise sn.ServiceNowError(503, "unavailable")
+
+def test_failed_refresh_keeps_stale_value():
+    cache = StatsCache()
+    cache.put("k", ["app"], ttl=0)
+    value, _ = cache.get_or_load("k", fail, ttl=60)
+    assert value == ["app"]
+    _wait_idle(cache, "k")
+    assert cache.lookup("k")[0] == ["app"]
+
+def test_failed_load_is_not_cached():
+    cache = StatsCache()
+    with pytest.raises(sn.ServiceNowError):
+        cache.get_or_load("k", fail)
+    assert cache.lookup("k") is None
+
+def test_applications_error_is_raised_not_emptied(mock):
+    instance, url = mock
+    assert len(sn.fetch_applications(url)) == len(instance.tables['sys_scope'])
+    instance.profile = {**instance.profile, "error_rate": 1.0}
+    with pytest.raises(sn.ServiceNowError):
+        sn.fetch_applications(url)
+    assert sn.get_applications(url) == []
@@ -0,0 +1,110 @@
+import random
+
+import pytest
+
+import server
+import syslog_tail
+from mock_servicenow import _sys_id
+from syslog_tail import SyslogTailer
+
+_rng = random.Random(15)
+
+@pytest.fixture
+def syslog(mock, monkeypatch):
+    """
+    (instance, url, log) where log(ts) adds an error row; added rows are dropped afterwards.
+    """
+    instance, url = mock
+    monkeypatch.setitem(instance.tables, 'syslog', list(instance.tables['syslog']))
+
+    def log(ts, message="Test error"):
+        row = {'sys_id': _sys_id(_rng), 'sys_created_on': ts, 'level': '2', 'source': 'Test', 'message': message}
+        instance.tables['syslog'].append(row)
+        return row['sys_id']
+    return instance, url, log
+
+def _ids(rows):
+    return [row['sys_id'] for row in rows]
+
+def test_first_poll_loads_the_newest_errors(syslog):
+    instance, url, log = syslog
+    newest = log('2099-01-01 00:00:00')
+    tailer = SyslogTailer(url, initial_rows=5)
+    assert tailer.poll() == 5
+    assert tailer.watermark == '2099-01-01 00:00:00'
+    assert _ids(tailer.latest(5))[0] == newest
+    assert all(row['sys_created_on'] <= '2099-01-01 00:00:00' for row in tailer.latest(5))
+
+def test_later_polls_only_add_new_rows(syslog):
+    instance, url, log = syslog
+    log('2099-01-01 00:00:00')
+    tailer = SyslogTailer(url, initial_rows=5)
+    tailer.poll()
+    # The watermark row comes back (>=) but is already buffered
+    assert tailer.poll() == 0
+    added = [log('2099-01-01 00:00:05'), log('2099-01-01 00:00:06')]
+    assert tailer.poll() == 2
+    assert _ids(tailer.latest(2)) == added[::-1]
+    assert tailer.watermark == '2099-01-01 00:00:06'
+
+def test_rows_sharing_the_watermark_second_are_not_missed(syslog):
+    instance, url, log = syslog
+    first = log('2099-01-01 00:00:00')
+    tailer = SyslogTailer(url, initial_rows=5)
+    tailer.poll()
+    second = log('2099-01-01 00:00:00')
+    assert tailer.poll() == 1
+    assert _ids(tailer.latest(5)).count(first) == 1
+    assert second in _ids(tailer.latest(5))
+
+def test_buffer_evicts_oldest_rows(syslog):
+    instance, url, log = syslog
+    tailer = SyslogTailer(url, buffer_size=3, initial_rows=3)
+    before = tailer.cursor()
+    tailer.poll()
+    kept = _ids(tailer.latest(1))
+    added = [log('2099-01-01 00:00:01'), log('2099-01-01 00:00:02')]
+    assert tailer.poll() == 2
+    assert _ids(tailer.latest(10)) == added[::-1] + kept
+    assert tailer.stats()["buffered"] == 3
+    # Evicted rows are forgotten, and a cursor from before them can't be honoured
+    assert tailer._seen == set(added + kept)
+    delta = tailer.since(before)
+    assert delta["reset"]
+    assert _ids(delta["rows"]) == added[::-1] + kept
+
+def test_since_returns_only_rows_past_the_cursor(syslog):
+    instance, url, log = syslog
+    tailer = SyslogTailer(url, initial_rows=5)
+    tailer.poll()
+    cursor = tailer.cursor()
+    assert tailer.since(cursor) == {"rows": [], "cursor": cursor, "reset": False}
+    added = [log('2099-01-01 00:00:01'), log('2099-01-01 00:00:02')]
+    tailer.poll()
+    delta = tailer.since(cursor)
+    assert not delta["reset"]
+    assert _ids(delta["rows"]) == added[::-1]
+    assert tailer.since(delta["cursor"])["rows"] == []
+
+@pytest.mark.parametrize("cursor", [None, "", "otherepoch:3", "garbage"])
+def test_unusable_cursor_returns_the_whole_buffer(syslog, cursor):
+    instance, url, log = syslog
+    tailer = SyslogTailer(url, initial_rows=5)
+    tailer.poll()
+    delta = tailer.since(cursor)
+    assert delta["reset"]
+    assert len(delta["rows"]) == 5
+
+def test_errors_endpoint_returns_the_delta_since_a_cursor(syslog, monkeypatch):
+    instance, url, log = syslog
+    monkeypatch.setattr(syslog_tail, "_tailers", {})
+    monkeypatch.setattr(syslog_tail.cache, "ttl_for", lambda kind: 0)
+    client = server.app.test_client()
+    first = client.get('/errors', query_string={"instance_url": url, "cursor": ""}).get_json()
+    assert first["reset"]
+    added = log('2099-01-01 00:00:00', "New error")
+    delta = client.get('/errors', query_string={"instance_url": url, "cursor": first["cursor"]}).get_json()
+    assert delta["reset"] is False
+    assert _ids(delta["rows"]) == [added]
+    assert delta["cursor"] != first["cursor"]
+    assert client.get('/errors', query_string={"instance_url": url}).get_json()[0]["sys_id"] == added